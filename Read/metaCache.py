@@ -0,0 +1,195 @@
+"""
+元数据持久缓存 (metaCache.py)
+-------------------------------------------------
+把 readPicInfo 提取的相机/镜头元数据保存在 SQLite 中，重复处理同一原图时直接命中。
+
+设计要点:
+1. 缓存键为 (内容哈希, 文件大小)。文件改名、移动后依然命中，内容变化则自动失效。
+2. 另存一张 (路径, 大小, mtime) -> 哈希 的索引表，文件未变化时无需重新读取整个文件计算哈希。
+3. `SCHEMA_VERSION` 随元数据格式变化而递增，版本不一致的旧条目视为未命中并被清理。
+4. `get_many` 支持整批查询，`hits` / `misses` 计数器便于观察命中率。
+5. 只缓存确定的结果：Pillow 或 ExifTool 实际读到的元数据，以及 ExifTool 成功运行后确认没有
+   所需标签的 None。ExifTool 不可用或批量读取失败导致的 None 不写入，下次重新读取。
+6. `get_cache` 返回进程级共享实例，上传、导出任务、监视目录守护进程与渲染队列共用；
+   上传文件没有路径，用 `key_for_bytes` 按内容计算同样的键。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+# 元数据格式版本，修改 readPicInfo 的输出格式时递增
+# (2: 清除旧版本在 ExifTool 失败时写入的 None)
+SCHEMA_VERSION = 2
+
+# 默认缓存文件位置，可用环境变量覆盖
+DEFAULT_CACHE_PATH = os.environ.get("BGF_META_CACHE", os.path.join("cache", "metadata.sqlite"))
+
+# 计算哈希时每次读取的块大小
+_CHUNK = 1 << 20
+
+
+def file_digest(path):
+    """计算文件内容的 blake2b 哈希 (十六进制)。"""
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def bytes_digest(data):
+    """计算内存中字节串的 blake2b 哈希，与 file_digest 结果一致。"""
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+class MetadataCache:
+    """
+    基于 SQLite 的元数据缓存。
+
+    Args:
+        path (str): 数据库文件路径，传入 ":memory:" 可用于临时缓存。
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            " digest TEXT NOT NULL, size INTEGER NOT NULL, version INTEGER NOT NULL,"
+            " data TEXT, PRIMARY KEY (digest, size))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS path_index ("
+            " path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,"
+            " digest TEXT NOT NULL)"
+        )
+        # 清理旧版本条目
+        self._conn.execute("DELETE FROM metadata WHERE version != ?", (SCHEMA_VERSION,))
+        self._conn.commit()
+
+    # ---------- 键计算 ----------
+    def key_for_path(self, path):
+        """
+        返回文件的缓存键 (digest, size)。
+        路径、大小、mtime 均未变化时直接使用索引表中的哈希，不重新读取文件。
+        """
+        st = os.stat(path)
+        abspath = os.path.abspath(path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, digest FROM path_index WHERE path = ?", (abspath,)
+            ).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2], st.st_size
+        digest = file_digest(path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO path_index (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+                (abspath, st.st_size, st.st_mtime_ns, digest),
+            )
+            self._conn.commit()
+        return digest, st.st_size
+
+    def key_for_bytes(self, data):
+        """返回内存中文件内容的缓存键 (digest, size)，与 key_for_path 对同一内容的结果一致。"""
+        return bytes_digest(data), len(data)
+
+    # ---------- 查询与写入 ----------
+    def get_many(self, keys):
+        """
+        批量查询。
+
+        Args:
+            keys (list): (digest, size) 列表。
+
+        Returns:
+            dict: {(digest, size): 元数据或 None}，只包含命中的键。
+        """
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # SQLite 单条语句的参数数量有限，分批查询
+            for start in range(0, len(keys), 400):
+                chunk = keys[start:start + 400]
+                where = " OR ".join(["(digest = ? AND size = ?)"] * len(chunk))
+                args = [v for k in chunk for v in k]
+                rows = self._conn.execute(
+                    f"SELECT digest, size, data FROM metadata WHERE version = {SCHEMA_VERSION} AND ({where})",
+                    args,
+                ).fetchall()
+                for digest, size, data in rows:
+                    found[(digest, size)] = json.loads(data) if data is not None else None
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key):
+        """查询单个键，未命中时返回 (False, None)。"""
+        found = self.get_many([key])
+        if key in found:
+            return True, found[key]
+        return False, None
+
+    def put_many(self, items):
+        """
+        批量写入。
+
+        Args:
+            items (dict): {(digest, size): 元数据或 None}。
+        """
+        rows = [(d, s, SCHEMA_VERSION, json.dumps(m, ensure_ascii=False) if m is not None else None)
+                for (d, s), m in items.items()]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO metadata (digest, size, version, data) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def put(self, key, metadata):
+        """写入单个条目。"""
+        self.put_many({key: metadata})
+
+    def clear(self):
+        """清空全部缓存条目与计数器。"""
+        with self._lock:
+            self._conn.execute("DELETE FROM metadata")
+            self._conn.execute("DELETE FROM path_index")
+            self._conn.commit()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """返回命中统计。"""
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0}
+
+    def close(self):
+        """关闭数据库连接。"""
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_cache():
+    """返回进程级共享的元数据缓存；数据库无法打开时打印错误并返回 None (不使用缓存)。"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            try:
+                _default_cache = MetadataCache()
+            except (OSError, sqlite3.Error) as e:
+                print(f"无法打开元数据缓存 {DEFAULT_CACHE_PATH}: {e}")
+                return None
+        return _default_cache
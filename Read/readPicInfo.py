@@ -1,117 +1,359 @@
-import exiftool
+"""
+图片元数据读取 (readPicInfo.py)
+-------------------------------------------------
+提取相机/镜头参数 (Make/Model/LensModel/ISO/焦距/快门/光圈)，返回清理后的字典。
+
+读取策略:
+1. 优先在进程内用 Pillow 解析 EXIF (JPEG/TIFF/PNG 等 Pillow 能打开的格式)，
+   无需启动外部进程。
+2. Pillow 无法解析（如 RAW 格式）或读不到任何所需标签时，回退到 ExifTool。
+   ExifTool 进程在模块内常驻复用，批量文件通过一次 `execute_json` 调用完成。
+
+ExifTool 可执行文件查找顺序: 环境变量 EXIFTOOL_PATH -> 项目内 Windows 包
+-> 系统 PATH 中的 exiftool。ExifTool 及 pyexiftool 均为可选依赖。
+
+改动记录:
+- 移除每个文件都启动一次 ExifTool 的做法，新增 `get_images_metadata` 批量接口。
+- `get_images_metadata` / `get_image_metadata` 支持传入 metaCache.MetadataCache，
+  已见过的原图直接从缓存返回。
+- 只缓存确定的结果：ExifTool 不可用或该批读取失败时得到的 None 不写入缓存，
+  避免一次临时故障让文件的元数据永久丢失。
+"""
+
+import atexit
 import os
 import json # 用于更美观地打印字典
+import shutil
+import threading
 import traceback # 用于打印详细错误
 
-# --- 指定 ExifTool 可执行文件的相对路径 ---
-EXIFTOOL_PATH = "./exiftool-13.29_64/exiftool(-k).exe"
+from PIL import Image
+
+try:
+    import exiftool
+except ImportError:  # pyexiftool 未安装时仅使用 Pillow 解析
+    exiftool = None
+
+# --- ExifTool 可执行文件路径 ---
+_BUNDLED_EXIFTOOL = "./exiftool-13.29_64/exiftool(-k).exe"
+EXIFTOOL_PATH = (os.environ.get("EXIFTOOL_PATH")
+                 or (_BUNDLED_EXIFTOOL if os.path.isfile(_BUNDLED_EXIFTOOL) else None)
+                 or shutil.which("exiftool"))
+
+# 每次 execute_json 最多处理的文件数，避免命令行过长
+EXIFTOOL_BATCH_SIZE = 200
+
+# --- EXIF 标签编号 ---
+_TAG_MAKE = 0x010F
+_TAG_MODEL = 0x0110
+_IFD_EXIF = 0x8769
+_TAG_EXPOSURE_TIME = 0x829A
+_TAG_FNUMBER = 0x829D
+_TAG_ISO = 0x8827
+_TAG_FOCAL_LENGTH = 0x920A
+_TAG_FOCAL_35MM = 0xA405
+_TAG_LENS_MODEL = 0xA434
+_TAG_LENS_SPEC = 0xA432
+
+# 常驻 ExifTool 进程及其锁
+_et_lock = threading.Lock()
+_et = None
+
+
+def _to_number(value, rational=False):
+    """
+    把 IFDRational / 元组等 EXIF 数值转换为 int 或 float。
+    rational 为真表示该标签是 RATIONAL 类型：旧版 Pillow 把它读成 (分子, 分母) 元组。
+    其他标签的元组是多值 (如 ISOSpeedRatings 的 (100, 100))，取第一个值。
+    """
+    if value is None:
+        return None
+    if rational and isinstance(value, tuple) and len(value) == 2 \
+            and not isinstance(value[0], (tuple, list)):  # 旧式 (分子, 分母)
+        num, den = value
+        return float(num) / den if den else None
+    if isinstance(value, (list, tuple)) and value:
+        return _to_number(value[0], rational)
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "ignore").strip("\x00 ")
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    try:
+        f = float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    if f != f:  # 分母为 0 的 IFDRational 转换为 NaN
+        return None
+    return int(f) if f.is_integer() and isinstance(value, int) else f
+
+
+def _to_text(value):
+    """把 EXIF 字符串值清理为 str，空值返回 None。"""
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "ignore")
+    text = str(value).strip("\x00 ").strip()
+    return text or None
+
 
-def get_image_metadata(image_path):
+def _clean_metadata(metadata):
     """
-    使用指定路径和 UTF-8 编码的 ExifTool 读取图片的元数据。
+    清理 None 值，并格式化部分值。
+    Pillow 与 ExifTool 两条路径共用，保证输出格式一致。
+    """
+    cleaned_metadata = {}
+    for key, value in metadata.items():
+        if value is not None:
+            if key == 'Aperture':
+                if isinstance(value, (int, float)): cleaned_metadata[key] = f"f/{value:.1f}"
+                elif isinstance(value, str) and value.startswith('f/'): cleaned_metadata[key] = value
+                else:
+                     try: fnum = float(value); cleaned_metadata[key] = f"f/{fnum:.1f}"
+                     except (ValueError, TypeError): cleaned_metadata[key] = str(value)
+            elif key == 'ExposureTime':
+                 if isinstance(value, str) and '/' in value: cleaned_metadata[key] = f"{value} s"
+                 elif isinstance(value, (int, float)):
+                     if 0 < value < 1: cleaned_metadata[key] = f"1/{int(1/value + 0.5)} s"
+                     else: cleaned_metadata[key] = f"{value:.3f} s"
+                 else: cleaned_metadata[key] = f"{value} s"
+            elif key == 'FocalLength' and isinstance(value, (int, float)): cleaned_metadata[key] = f"{value:.0f} mm"
+            elif key == 'FocalLengthIn35mmFormat' and isinstance(value, (int, float)): cleaned_metadata[key] = f"{value:.0f} mm (35mm equiv.)"
+            elif key == 'ISO':
+                if isinstance(value, list) and len(value)>0: cleaned_metadata[key] = value[0]
+                else: cleaned_metadata[key] = value
+            else: cleaned_metadata[key] = str(value)
+    return cleaned_metadata
+
+
+# ---------- Pillow 进程内解析 ----------
+def read_pillow_metadata(source):
+    """
+    使用 Pillow 在进程内解析 EXIF。
 
     Args:
-        image_path (str): 图片文件的路径。
+        source (str | file-like): 图片路径或可读的文件对象。
 
     Returns:
-        dict: 包含提取到的元数据的字典，如果出错则返回 None。
+        dict: 清理后的元数据；无法打开或没有所需标签时返回 None。
     """
+    try:
+        with Image.open(source) as img:
+            exif = img.getexif()
+    except Exception:
+        return None
+    if not exif:
+        return None
+    try:
+        sub = exif.get_ifd(_IFD_EXIF)
+    except Exception:
+        sub = {}
+
+    def tag(t):
+        return sub.get(t) if t in sub else exif.get(t)
+
     metadata = {}
+    metadata['Make'] = _to_text(exif.get(_TAG_MAKE))
+    metadata['Model'] = _to_text(exif.get(_TAG_MODEL))
+    metadata['LensModel'] = _to_text(tag(_TAG_LENS_MODEL))
+    if not metadata['LensModel'] and tag(_TAG_LENS_SPEC):
+        # 无镜头型号时，用镜头规格 (最小焦距, 最大焦距, 最大光圈...) 生成描述
+        spec = [_to_number(v, rational=True) for v in tag(_TAG_LENS_SPEC)]
+        if len(spec) >= 2 and spec[0]:
+            focal = f"{spec[0]:g}mm" if spec[0] == spec[1] else f"{spec[0]:g}-{spec[1]:g}mm"
+            metadata['LensModel'] = focal
+    metadata['ISO'] = _to_number(tag(_TAG_ISO))
+    metadata['FocalLength'] = _to_number(tag(_TAG_FOCAL_LENGTH), rational=True)
+    metadata['FocalLengthIn35mmFormat'] = _to_number(tag(_TAG_FOCAL_35MM))
+    metadata['ExposureTime'] = _to_number(tag(_TAG_EXPOSURE_TIME), rational=True)
+    metadata['Aperture'] = _to_number(tag(_TAG_FNUMBER), rational=True)
+    if isinstance(metadata['ISO'], float) and metadata['ISO'].is_integer():
+        metadata['ISO'] = int(metadata['ISO'])
+
+    cleaned_metadata = _clean_metadata(metadata)
+    return cleaned_metadata or None
 
-    # 1. 检查 ExifTool 可执行文件是否存在
-    if not os.path.isfile(EXIFTOOL_PATH):
-        print(f"错误：无法在指定路径找到 ExifTool 可执行文件 - {EXIFTOOL_PATH}")
-        print("请确保路径正确，并且该文件存在。")
-        return None
 
-    # 2. 检查图片文件是否存在
-    if not os.path.isfile(image_path):
-        print(f"错误：图片文件未找到 - {image_path}")
+# ---------- ExifTool 回退 ----------
+def _get_exiftool():
+    """返回常驻的 ExifTool 进程，首次调用时启动。不可用时返回 None。"""
+    global _et
+    if exiftool is None or not EXIFTOOL_PATH:
         return None
+    if _et is None or not _et.running:
+        _et = exiftool.ExifTool(executable=EXIFTOOL_PATH, encoding='utf-8')
+        _et.run()
+    return _et
 
-    try:
-        # *** 添加 encoding='utf-8' 参数 ***
-        # 使用 with 语句确保 ExifTool 进程被正确关闭
-        with exiftool.ExifTool(executable=EXIFTOOL_PATH, encoding='utf-8') as et:
-            # 使用 execute_json 获取元数据
-            all_metadata_list = et.execute_json(image_path)
-
-            # 检查返回的列表是否有效且包含数据
-            if not all_metadata_list or not isinstance(all_metadata_list, list) or len(all_metadata_list) == 0:
-                print(f"警告：无法从 {image_path} 读取到元数据 (ExifTool 返回了空或无效的结果)。")
-                return None
-
-            # 获取列表中的第一个（也是唯一一个）字典
-            tags = all_metadata_list[0]
-
-            # 确保 tags 是一个字典
-            if not isinstance(tags, dict):
-                 print(f"警告：从 {image_path} 读取到的元数据格式不是预期的字典。")
-                 return None
-
-            # --- 提取我们关心的标签 ---
-            # (逻辑与之前相同)
-            metadata['Make'] = tags.get('EXIF:Make') or tags.get('MakerNotes:Make') or tags.get('XMP:Make')
-            metadata['Model'] = tags.get('EXIF:Model') or tags.get('MakerNotes:Model') or tags.get('XMP:Model')
-            if not metadata['Model']:
-                 metadata['Model'] = tags.get('Composite:DeviceModelName') or tags.get('apple-iphone:Model')
-
-            metadata['LensModel'] = (tags.get('EXIF:LensModel') or
-                                   tags.get('MakerNotes:LensModel') or
-                                   tags.get('XMP:Lens') or
-                                   tags.get('Composite:LensID') or
-                                   tags.get('MakerNotes:LensType') or
-                                   tags.get('MakerNotes:Lens'))
-            if not metadata['LensModel'] and tags.get('Composite:LensInfo'):
-                 metadata['LensModel'] = tags.get('Composite:LensInfo')
-
-            metadata['ISO'] = tags.get('EXIF:ISO') or tags.get('MakerNotes:ISO') or tags.get('EXIF:PhotographicSensitivity')
-
-            metadata['FocalLength'] = tags.get('EXIF:FocalLength') or tags.get('MakerNotes:FocalLength')
-            metadata['FocalLengthIn35mmFormat'] = tags.get('EXIF:FocalLengthIn35mmFilm') or tags.get('Composite:FocalLength35efl')
-
-            metadata['ExposureTime'] = tags.get('EXIF:ExposureTime') or tags.get('MakerNotes:ExposureTime') or tags.get('Composite:ShutterSpeed')
-
-            metadata['Aperture'] = tags.get('EXIF:FNumber') or tags.get('MakerNotes:FNumber')
-            if not metadata['Aperture'] and tags.get('EXIF:ApertureValue'):
-                 metadata['Aperture'] = tags.get('Composite:Aperture')
-
-            # 清理 None 值，并格式化部分值
-            cleaned_metadata = {}
-            for key, value in metadata.items():
-                if value is not None:
-                    # (格式化逻辑与之前相同)
-                    if key == 'Aperture':
-                        if isinstance(value, (int, float)): cleaned_metadata[key] = f"f/{value:.1f}"
-                        elif isinstance(value, str) and value.startswith('f/'): cleaned_metadata[key] = value
-                        else:
-                             try: fnum = float(value); cleaned_metadata[key] = f"f/{fnum:.1f}"
-                             except (ValueError, TypeError): cleaned_metadata[key] = str(value)
-                    elif key == 'ExposureTime':
-                         if isinstance(value, str) and '/' in value: cleaned_metadata[key] = f"{value} s"
-                         elif isinstance(value, (int, float)):
-                             if 0 < value < 1: cleaned_metadata[key] = f"1/{int(1/value + 0.5)} s"
-                             else: cleaned_metadata[key] = f"{value:.3f} s"
-                         else: cleaned_metadata[key] = f"{value} s"
-                    elif key == 'FocalLength' and isinstance(value, (int, float)): cleaned_metadata[key] = f"{value:.0f} mm"
-                    elif key == 'FocalLengthIn35mmFormat' and isinstance(value, (int, float)): cleaned_metadata[key] = f"{value:.0f} mm (35mm equiv.)"
-                    elif key == 'ISO':
-                        if isinstance(value, list) and len(value)>0: cleaned_metadata[key] = value[0]
-                        else: cleaned_metadata[key] = value
-                    else: cleaned_metadata[key] = str(value)
-
-            if cleaned_metadata:
-                return cleaned_metadata
+
+def close_exiftool():
+    """关闭常驻的 ExifTool 进程（程序退出前可调用）。"""
+    global _et
+    with _et_lock:
+        if _et is not None and _et.running:
+            _et.terminate()
+        _et = None
+
+
+atexit.register(close_exiftool)
+
+
+def _metadata_from_exiftool_tags(tags):
+    """从 ExifTool 的 -G 标签字典中提取所需字段。"""
+    metadata = {}
+    metadata['Make'] = tags.get('EXIF:Make') or tags.get('MakerNotes:Make') or tags.get('XMP:Make')
+    metadata['Model'] = tags.get('EXIF:Model') or tags.get('MakerNotes:Model') or tags.get('XMP:Model')
+    if not metadata['Model']:
+         metadata['Model'] = tags.get('Composite:DeviceModelName') or tags.get('apple-iphone:Model')
+
+    metadata['LensModel'] = (tags.get('EXIF:LensModel') or
+                           tags.get('MakerNotes:LensModel') or
+                           tags.get('XMP:Lens') or
+                           tags.get('Composite:LensID') or
+                           tags.get('MakerNotes:LensType') or
+                           tags.get('MakerNotes:Lens'))
+    if not metadata['LensModel'] and tags.get('Composite:LensInfo'):
+         metadata['LensModel'] = tags.get('Composite:LensInfo')
+
+    metadata['ISO'] = tags.get('EXIF:ISO') or tags.get('MakerNotes:ISO') or tags.get('EXIF:PhotographicSensitivity')
+
+    metadata['FocalLength'] = tags.get('EXIF:FocalLength') or tags.get('MakerNotes:FocalLength')
+    metadata['FocalLengthIn35mmFormat'] = tags.get('EXIF:FocalLengthIn35mmFilm') or tags.get('Composite:FocalLength35efl')
+
+    metadata['ExposureTime'] = tags.get('EXIF:ExposureTime') or tags.get('MakerNotes:ExposureTime') or tags.get('Composite:ShutterSpeed')
+
+    metadata['Aperture'] = tags.get('EXIF:FNumber') or tags.get('MakerNotes:FNumber')
+    if not metadata['Aperture'] and tags.get('EXIF:ApertureValue'):
+         metadata['Aperture'] = tags.get('Composite:Aperture')
+    return _clean_metadata(metadata) or None
+
+
+def _read_exiftool(image_paths):
+    """
+    使用常驻 ExifTool 进程批量读取元数据。
+
+    Returns:
+        tuple: ({路径: 清理后的元数据或 None}, ExifTool 成功读取过的路径集合)。
+               不在集合中的路径 (ExifTool 不可用或所在批次失败) 结果不确定。
+    """
+    results = {path: None for path in image_paths}
+    answered = set()
+    if not image_paths:
+        return results, answered
+    with _et_lock:
+        try:
+            et = _get_exiftool()
+        except Exception as e:
+            print(f"启动 ExifTool 失败 ({EXIFTOOL_PATH}): {e}")
+            return results, answered
+        if et is None:
+            return results, answered
+        for start in range(0, len(image_paths), EXIFTOOL_BATCH_SIZE):
+            chunk = image_paths[start:start + EXIFTOOL_BATCH_SIZE]
+            try:
+                all_metadata_list = et.execute_json(*chunk)
+            except Exception as e:
+                print(f"ExifTool 批量读取失败: {e}")
+                traceback.print_exc()
+                continue
+            # 按 SourceFile 对应回输入路径（ExifTool 会规范化路径分隔符）
+            by_source = {os.path.normcase(os.path.abspath(t.get("SourceFile", ""))): t
+                         for t in all_metadata_list or [] if isinstance(t, dict)}
+            for path in chunk:
+                answered.add(path)
+                tags = by_source.get(os.path.normcase(os.path.abspath(path)))
+                if tags:
+                    results[path] = _metadata_from_exiftool_tags(tags)
+    return results, answered
+
+
+def read_exiftool_metadata(image_paths):
+    """
+    使用常驻 ExifTool 进程批量读取元数据。
+
+    Args:
+        image_paths (list): 图片路径列表。
+
+    Returns:
+        dict: {路径: 清理后的元数据或 None}。ExifTool 不可用时全部为 None。
+    """
+    return _read_exiftool(image_paths)[0]
+
+
+# ---------- 对外接口 ----------
+def get_images_metadata(image_paths, cache=None):
+    """
+    批量读取多张图片的元数据：先查缓存，未命中的用 Pillow 进程内解析，
+    剩余文件一次性交给 ExifTool，最后把确定的结果写回缓存。
+
+    Args:
+        image_paths (list): 图片文件路径列表。
+        cache (MetadataCache): 可选的持久缓存 (见 Read/metaCache.py)。
+
+    Returns:
+        dict: {路径: 清理后的元数据字典或 None}。
+    """
+    results = {}
+    todo = []
+    for path in image_paths:
+        if not os.path.isfile(path):
+            print(f"错误：图片文件未找到 - {path}")
+            results[path] = None
+        else:
+            todo.append(path)
+
+    # --- 1. 整批查询缓存 ---
+    keys = {}
+    if cache is not None and todo:
+        keys = {path: cache.key_for_path(path) for path in todo}
+        found = cache.get_many(list(keys.values()))
+        remaining = []
+        for path in todo:
+            if keys[path] in found:
+                results[path] = found[keys[path]]
             else:
-                print(f"警告: 从 {image_path} 中未能提取到任何所需的标签。")
-                return None
-
-    # *** 移除了不存在的 exiftool.ExifToolExecuteError 捕获 ***
-    except Exception as e:
-        # 捕获所有错误
-        print(f"处理 {image_path} 时发生错误: {e}")
-        traceback.print_exc() # 打印详细的回溯信息
-        return None
+                remaining.append(path)
+        todo = remaining
+
+    # --- 2. Pillow 解析，失败的交给 ExifTool ---
+    pending = []
+    for path in todo:
+        meta = read_pillow_metadata(path)
+        results[path] = meta
+        if meta is None:
+            pending.append(path)
+    answered = set()
+    if pending:
+        exif_results, answered = _read_exiftool(pending)
+        results.update(exif_results)
+
+    # --- 3. 写回缓存 (只写确定的结果：读到了元数据，或 ExifTool 成功运行后确认没有) ---
+    if cache is not None and todo:
+        definite = {keys[path]: results[path] for path in todo
+                    if results[path] is not None or path in answered}
+        if definite:
+            cache.put_many(definite)
+    return results
+
+
+def get_image_metadata(image_path, cache=None):
+    """
+    读取单张图片的元数据。
+
+    Args:
+        image_path (str): 图片文件的路径。
+        cache (MetadataCache): 可选的持久缓存。
+
+    Returns:
+        dict: 包含提取到的元数据的字典，如果出错则返回 None。
+    """
+    metadata = get_images_metadata([image_path], cache=cache).get(image_path)
+    if metadata is None and os.path.isfile(image_path):
+        print(f"警告: 从 {image_path} 中未能提取到任何所需的标签。")
+    return metadata
 
 # --- 主程序执行部分 ---
 if __name__ == '__main__':
@@ -125,4 +367,4 @@ if __name__ == '__main__':
         print(f"\n--- 从 {image_to_process} 成功提取的元数据 ---")
         print(json.dumps(extracted_data, indent=4, ensure_ascii=False))
     else:
-        print(f"\n未能从 {image_to_process} 提取到所需的元数据或处理过程中出错。")
\ No newline at end of file
+        print(f"\n未能从 {image_to_process} 提取到所需的元数据或处理过程中出错。")
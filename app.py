@@ -1,5 +1,6 @@
 import streamlit as st
-from view import upload_view, param_view, preview_view, output_view
+from view import upload_view, param_view, preview_view, output_view, sweep_view
+from view.compat import fragment
 
 # 页面基本设置
 st.set_page_config(page_title="图片批量背景模糊和阴影工具", layout="wide")
@@ -8,12 +9,14 @@ st.set_page_config(page_title="图片批量背景模糊和阴影工具", layout=
 st.title("图片毛玻璃背景和立体阴影批量处理工具")
 st.markdown("本应用可将照片自动生成毛玻璃模糊背景和悬浮阴影效果，支持批量处理多张图片。您可以调整参数实时预览，并将处理结果一键打包下载。")
 
-# 上传区域
-upload_view.show_upload_section()
 
-# 如果已经上传图片，则显示参数调整和预览
-if "images" in st.session_state and len(st.session_state["images"]) > 0:
-    # 将参数控制和预览区域并排显示
+# 页面分为独立重跑的局部区域 (Streamlit 支持 fragment 时)：
+# - 上传区域不在局部区域内：上传内容变化才需要整页重跑；
+# - 参数与预览为一个局部区域：拖动滑块只重跑参数控件和预览渲染；
+# - 导出区域为另一个局部区域：点击导出按钮不会重跑上传网格和预览。
+@fragment
+def _editor_section():
+    """参数调整与预览 (并排显示)。"""
     col1, col2 = st.columns([1, 1.2])
     with col1:
         params = param_view.show_parameter_controls()
@@ -21,7 +24,17 @@ if "images" in st.session_state and len(st.session_state["images"]) > 0:
         st.session_state["params"] = params
     with col2:
         preview_view.show_preview()
+
+
+# 上传区域
+upload_view.show_upload_section()
+
+# 如果已经上传图片，则显示参数调整和预览
+if "images" in st.session_state and len(st.session_state["images"]) > 0:
+    _editor_section()
     # 导出下载区域
     output_view.show_download_section()
+    # 参数对比 (局部区域)
+    sweep_view.show_sweep_section()
 else:
     st.write("请上传图片后进行参数调整和预览。")
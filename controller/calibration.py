@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+本机性能校准 (calibration.py)
+-------------------------------------------------
+在当前机器上对渲染阶段做微基准测试，选出：
+1.  批处理的工作线程/进程数量，以及使用线程池还是进程池；
+2.  每个模糊半径区间使用的背景模糊方法 ("reference" 全分辨率高斯 / "downscale" 缩小后模糊)，
+    只有误差在容许范围内且更快时才选用 downscale。
+
+结果保存为 JSON 配置文件 (默认 cache/calibration.json，可用环境变量 BGF_PROFILE 覆盖)，
+processing_controller 启动时调用 `load_startup_profile` 读取并应用。
+配置记录了生成时的 CPU 核数，换到核数不同的机器上时自动忽略，回退到默认设置。
+
+用法:
+    python -m controller.calibration            # 完整校准并保存
+    python -m controller.calibration --quick    # 快速校准 (更少的半径与并发档位)
+    python -m controller.calibration --show     # 查看当前配置
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import time
+import numpy as np
+from PIL import Image
+from model import registry
+
+PROFILE_VERSION = 1
+PROFILE_PATH = os.environ.get("BGF_PROFILE", os.path.join("cache", "calibration.json"))
+
+# 未校准时的默认设置
+DEFAULT_WORKERS = 4
+DEFAULT_EXECUTOR = "thread"
+EXECUTORS = ("thread", "process")
+# 可显式选择但不参与校准的执行器 (子进程隔离，见 job_limits.IsolatedPool)
+ALL_EXECUTORS = EXECUTORS + ("isolated",)
+
+# downscale 模糊的容许误差 (与 reference 相比的平均/最大绝对误差)
+BLUR_MEAN_TOLERANCE = 1.0
+BLUR_MAX_TOLERANCE = 16
+
+# 校准用的渲染参数 (与界面默认值一致的常见设置)
+CALIBRATION_PARAMS = {
+    "background_enabled": True, "background_scale": 1.0, "background_blur": 20,
+    "background_mask": "无", "background_mask_opacity": 40,
+    "shadow_enabled": True, "shadow_spread": 16, "shadow_blur": 30, "shadow_opacity": 0.72,
+    "shadow_offset_x": 10, "shadow_offset_y": 10, "shadow_link": True, "shadow_follow_margin": True,
+    "corner_radius_pct": 5, "ratio": (9, 16),
+    "margin_all": 40, "margin_top": 40, "margin_bottom": 40, "margin_left": 40, "margin_right": 40,
+}
+
+# 当前生效的设置 (load_startup_profile / apply_profile 写入)
+_active = {"workers": None, "executor": None, "profile": None}
+
+
+# ---------- 配置读写 ----------
+
+def host_info():
+    """返回用于判断配置是否适用于本机的主机信息。"""
+    return {
+        "cpu_count": os.cpu_count() or 1,
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+    }
+
+
+def load_profile(path=PROFILE_PATH):
+    """读取配置文件；不存在、版本不符或不是本机 (CPU 核数不同) 生成的配置返回 None。"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            profile = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"读取校准配置失败 {path}: {e}")
+        return None
+    if profile.get("version") != PROFILE_VERSION:
+        print(f"校准配置版本不符，已忽略: {path}")
+        return None
+    if profile.get("host", {}).get("cpu_count") != host_info()["cpu_count"]:
+        print(f"校准配置来自 CPU 核数不同的机器，已忽略: {path}")
+        return None
+    return profile
+
+
+def save_profile(profile, path=PROFILE_PATH):
+    """保存配置文件 (先写临时文件再替换)。"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def apply_profile(profile):
+    """应用配置：设置批处理并发与背景阶段的按半径后端选择。传入 None 恢复默认。"""
+    if profile is None:
+        _active.update(workers=None, executor=None, profile=None)
+        registry.set_range_backends("background", None)
+        return
+    _active.update(workers=profile.get("workers"), executor=profile.get("executor"), profile=profile)
+    ranges = [(r.get("max_radius"), r["backend"]) for r in profile.get("blur", [])]
+    registry.set_range_backends("background", ranges)
+
+
+def load_startup_profile(path=PROFILE_PATH):
+    """启动时读取并应用本机配置，返回配置 (不存在时为 None)。"""
+    profile = load_profile(path)
+    apply_profile(profile)
+    return profile
+
+
+def pool_settings(max_workers=None, executor=None):
+    """
+    返回批处理使用的 (并发数, 执行器类型)。
+    显式传入的值优先，其次为校准配置，最后为默认值。
+    """
+    workers = max_workers or _active["workers"] or DEFAULT_WORKERS
+    kind = executor or _active["executor"] or DEFAULT_EXECUTOR
+    if kind not in ALL_EXECUTORS:
+        kind = DEFAULT_EXECUTOR
+    return max(1, int(workers)), kind
+
+
+# ---------- 基准测试 ----------
+
+def _sample_image(width, height, seed=0):
+    """生成带渐变、色块和轻微噪声的测试图 (接近照片的频率分布，噪声图会夸大模糊误差)。"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    arr = np.empty((height, width, 3), np.float32)
+    arr[..., 0] = 128 + 100 * np.sin(x / width * 6.0)
+    arr[..., 1] = 128 + 100 * np.cos(y / height * 5.0)
+    arr[..., 2] = 255 * (x + y) / (width + height)
+    for _ in range(12):
+        cx, cy = rng.integers(0, width), rng.integers(0, height)
+        r = rng.integers(min(width, height) // 20, min(width, height) // 6)
+        arr[(x - cx) ** 2 + (y - cy) ** 2 < r * r] = rng.integers(0, 255, 3)
+    arr += rng.normal(0, 6, arr.shape)
+    return Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8))
+
+
+def _best_time(func, repeat):
+    """运行 repeat 次，返回 (最短耗时, 最后一次结果)。"""
+    best, out = math.inf, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = func()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def bench_blur(img, radii, repeat=3):
+    """
+    对每个模糊半径比较 reference 与 downscale 背景的耗时和误差。
+
+    Returns:
+        list: [{"radius", "reference_s", "downscale_s", "max_err", "mean_err", "backend"}]
+    """
+    ref_fn = registry.resolve("background", registry.REFERENCE)[1]
+    fast_fn = registry.resolve("background", "downscale")[1]
+    size = img.size
+    results = []
+    for r in radii:
+        t_ref, ref = _best_time(lambda: ref_fn(img, size, blur_radius=r), repeat)
+        t_fast, fast = _best_time(lambda: fast_fn(img, size, blur_radius=r), repeat)
+        diff = np.abs(np.asarray(ref, np.int16) - np.asarray(fast, np.int16))
+        max_err, mean_err = int(diff.max()), float(diff.mean())
+        ok = mean_err <= BLUR_MEAN_TOLERANCE and max_err <= BLUR_MAX_TOLERANCE
+        backend = "downscale" if ok and t_fast < t_ref * 0.9 else registry.REFERENCE
+        results.append({"radius": r, "reference_s": round(t_ref, 4), "downscale_s": round(t_fast, 4),
+                        "max_err": max_err, "mean_err": round(mean_err, 3), "backend": backend})
+    return results
+
+
+def blur_ranges(results):
+    """把逐半径的选择合并为区间 [{"max_radius", "backend"}]，最后一个区间无上限。"""
+    ranges = []
+    for res in sorted(results, key=lambda r: r["radius"]):
+        if ranges and ranges[-1]["backend"] == res["backend"]:
+            ranges[-1]["max_radius"] = res["radius"]
+        else:
+            ranges.append({"max_radius": res["radius"], "backend": res["backend"]})
+    if ranges:
+        ranges[-1]["max_radius"] = None
+    return ranges
+
+
+def _worker_candidates(cpu_count, quick):
+    """并发档位：1, 2, 4, ... 直到 CPU 核数 (含核数本身)。"""
+    cands, n = [], 1
+    while n < cpu_count:
+        cands.append(n)
+        n *= 2 if not quick else 4
+    cands.append(cpu_count)
+    return sorted(set(cands))
+
+
+def bench_pool(images, candidates, executors=EXECUTORS):
+    """
+    以不同并发数和执行器批量渲染 images，测量吞吐量 (张/秒)。
+    吞吐量不再提升 (低于当前最佳 5%) 时停止增加该执行器的并发数。
+
+    Returns:
+        list: [{"executor", "workers", "seconds", "throughput"}]
+    """
+    from controller import processing_controller
+
+    results = []
+    for kind in executors:
+        best = 0.0
+        for workers in candidates:
+            t0 = time.perf_counter()
+            processing_controller.process_all_images(images, CALIBRATION_PARAMS,
+                                                     max_workers=workers, executor=kind)
+            seconds = time.perf_counter() - t0
+            throughput = len(images) / seconds
+            results.append({"executor": kind, "workers": workers,
+                            "seconds": round(seconds, 3), "throughput": round(throughput, 3)})
+            print(f"  {kind:7s} x{workers:<3d} {throughput:7.2f} 张/秒")
+            if throughput < best * 1.05:
+                break
+            best = max(best, throughput)
+    return results
+
+
+def calibrate(size=(1600, 1200), quick=False):
+    """
+    运行完整校准，返回配置字典 (不保存)。
+
+    Args:
+        size (tuple): 测试图尺寸 (宽, 高)。
+        quick (bool): 快速模式，减少半径与并发档位。
+    """
+    # 先导入 processing_controller (导入时会应用已有配置)，之后再应用本次测得的模糊区间
+    from controller import processing_controller  # noqa: F401
+
+    host = host_info()
+    img = _sample_image(*size)
+
+    radii = [4, 16, 48] if quick else [4, 8, 16, 24, 32, 48, 64, 96]
+    print("模糊方法基准:")
+    blur = bench_blur(img, radii, repeat=1 if quick else 3)
+    for r in blur:
+        print(f"  半径 {r['radius']:>3d}: reference {r['reference_s']:.3f}s  downscale {r['downscale_s']:.3f}s"
+              f"  误差 max {r['max_err']} mean {r['mean_err']}  -> {r['backend']}")
+    # 后续批处理基准使用选出的模糊方法
+    ranges = blur_ranges(blur)
+    registry.set_range_backends("background", [(r["max_radius"], r["backend"]) for r in ranges])
+
+    print("批处理并发基准:")
+    candidates = _worker_candidates(host["cpu_count"], quick)
+    n_images = max(8, 2 * candidates[-1])
+    small = img.resize((size[0] // 2, size[1] // 2))
+    images = [small] * n_images
+    pool = bench_pool(images, candidates)
+    best = max(pool, key=lambda r: r["throughput"])
+
+    return {
+        "version": PROFILE_VERSION,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "host": host,
+        "workers": best["workers"],
+        "executor": best["executor"],
+        "blur": ranges,
+        "benchmarks": {"blur": blur, "pool": pool},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="校准本机的批处理并发与模糊方法，并保存配置。")
+    parser.add_argument("--output", default=PROFILE_PATH, help="配置文件路径")
+    parser.add_argument("--size", default="1600x1200", help="测试图尺寸，如 1600x1200")
+    parser.add_argument("--quick", action="store_true", help="快速校准")
+    parser.add_argument("--show", action="store_true", help="只显示当前配置")
+    args = parser.parse_args(argv)
+
+    if args.show:
+        profile = load_profile(args.output)
+        print(json.dumps(profile, ensure_ascii=False, indent=2) if profile else "没有适用于本机的校准配置。")
+        return
+    w, h = (int(v) for v in args.size.lower().split("x"))
+    profile = calibrate((w, h), quick=args.quick)
+    save_profile(profile, args.output)
+    print(f"并发: {profile['workers']} ({profile['executor']})，"
+          f"模糊区间: {[(r['max_radius'], r['backend']) for r in profile['blur']]}")
+    print(f"已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,556 @@
+# -*- coding: utf-8 -*-
+"""
+后台导出任务 (export_jobs.py)
+-------------------------------------------------
+把批量导出从 Streamlit 脚本运行中剥离出来，交给进程级的线程池执行。
+
+设计要点:
+1.  执行器与任务表保存在模块级（进程级）变量中，不随页面 rerun 重建，
+    控件交互导致的 rerun 不会中断或丢弃正在进行的导出。
+2.  每个任务记录进度、状态和错误，界面只需轮询 `get_job`。
+3.  `cancel_job` 设置取消标志，任务在处理下一张图片前检查并退出。
+4.  每个任务是 output/jobs/<id>/ 下的一个目录，跨 rerun 与进程重启保留，直到 `remove_job` 删除。
+5.  渲染前先查询渲染缓存 (render_cache)：原图、参数、编码设置都未变化的输出直接复制缓存文件；
+    渲染后的结果编码一次，同时写入缓存和任务目录。
+6.  每个任务带一个遥测对象 `job.metrics` (controller/telemetry.py)，记录吞吐量、各阶段耗时、
+    写出字节数等，任务结束时写入 Prometheus 指标文件，界面显示其摘要。
+7.  渲染默认在隔离子进程中进行 (job_limits.IsolatedPool，每个任务一个子进程，渲染与 PNG 编码都在
+    子进程内)：单张超过 RENDER_TIMEOUT 的渲染被终止、子进程崩溃或内存耗尽，都只记为该图片失败，
+    不会卡住或拖垮界面进程。此时各阶段耗时在子进程中，不计入遥测。
+    设置 BGF_EXPORT_ISOLATED=0 改为在任务线程内渲染 (没有超时与崩溃隔离，只有像素/画布内存检查)。
+
+断点续传:
+- 任务目录结构:
+    manifest.json   任务描述 (名称、参数、比例、源文件与元数据列表、状态)，状态变化时原子重写；
+    progress.jsonl  每完成一张图片追加一行 (下标、源文件、输出文件名/哈希/大小、参数哈希)，
+                    写入后 fsync，进程中途退出最多丢失正在处理的那一张；
+    sources/        原图 (上传的原始字节，没有时保存为 PNG)，开始渲染前全部写入；
+    files/          已渲染的输出 (先写临时文件再替换)；
+    <id>.zip        全部完成后由 `assemble_archive` 按输入顺序组装。
+- `resume_job` 跳过 progress.jsonl 中已记录且输出文件完好的图片，从磁盘读取原图继续渲染。
+- 界面进程启动时调用 `recover_jobs` 载入已有任务目录；中断的任务 (排队中/进行中) 标记为已取消，
+  由任务所有者在界面上点击“继续”续传，不自动续传。
+- 任务记录所有者标识 (`owner`，界面为每个浏览器会话生成)，写入 manifest.json；
+  `list_jobs(owner)` 只返回该所有者的任务，恢复的任务不会出现在其他会话中。
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from PIL import Image
+from controller import processing_controller, render_cache, telemetry, job_limits
+from Read import readPicInfo, metaCache
+
+# 导出文件目录
+JOBS_DIR = os.path.join("output", "jobs")
+
+# 任务目录格式版本
+MANIFEST_VERSION = 1
+
+# 同时运行的导出任务数；每个任务内部逐张渲染，避免多个任务互相抢占 CPU 导致界面卡顿
+MAX_CONCURRENT_JOBS = 1
+
+# 是否在隔离子进程中渲染 (超时终止、崩溃隔离)
+EXPORT_ISOLATED = os.environ.get("BGF_EXPORT_ISOLATED", "1") not in ("", "0")
+
+# 任务状态
+STATUS_QUEUED = "排队中"
+STATUS_RUNNING = "进行中"
+STATUS_DONE = "已完成"
+STATUS_CANCELLED = "已取消"
+STATUS_FAILED = "失败"
+
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS, thread_name_prefix="export-job")
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+class ExportJob:
+    """一个后台导出任务的状态。所有字段由工作线程写入、界面线程只读。"""
+
+    def __init__(self, name, total, job_id=None, owner=None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.name = name
+        self.owner = owner            # 所有者标识 (界面会话)，None 表示未记录
+        self.total = total
+        self.done = 0
+        self.failed = []              # 处理失败的文件名
+        self.status = STATUS_QUEUED
+        self.error = None
+        self.artifact_path = None     # 完成后的 ZIP 路径
+        self.created = time.time()
+        self.finished = None
+        self.metrics = telemetry.BatchMetrics(name)
+        self.dir = os.path.join(JOBS_DIR, self.id)
+        self.spec = None              # manifest.json 的内容
+        self._cancel = threading.Event()
+
+    @property
+    def progress(self):
+        """完成比例 (0~1)。"""
+        return self.done / self.total if self.total else 1.0
+
+    @property
+    def active(self):
+        """任务是否仍在排队或运行中。"""
+        return self.status in (STATUS_QUEUED, STATUS_RUNNING)
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def resumable(self):
+        """已中止 (取消/失败) 且尚未全部完成的任务可以续传。"""
+        return not self.active and self.status != STATUS_DONE and self.spec is not None
+
+
+# ---------- 任务目录 ----------
+
+def _write_json(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1, default=str)
+    os.replace(tmp, path)
+
+
+def _save_manifest(job):
+    """把任务状态写回 manifest.json。"""
+    job.spec.update(status=job.status, error=job.error, finished=job.finished)
+    try:
+        _write_json(os.path.join(job.dir, "manifest.json"), job.spec)
+    except OSError as e:  # 任务目录已被 remove_job 删除等
+        print(f"写入导出任务 {job.id} 的清单失败: {e}")
+
+
+def _load_progress(job_dir):
+    """读取 progress.jsonl，返回 {下标: 记录}；末尾不完整的行 (写入中途退出) 被忽略。"""
+    entries = {}
+    path = os.path.join(job_dir, "progress.jsonl")
+    if not os.path.exists(path):
+        return entries
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            entries[entry["index"]] = entry
+    return entries
+
+
+def _entry_complete(job_dir, entry):
+    """记录为成功且所有输出文件完好 (存在且大小一致)。"""
+    if entry.get("status") != "done":
+        return False
+    for out in entry["outputs"]:
+        try:
+            if os.path.getsize(os.path.join(job_dir, "files", out["file"])) != out["size"]:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def _source_name(index, fname):
+    return f"{index:05d}_{os.path.basename(fname)}"
+
+
+def _persist_sources(job, images, sources):
+    """把原图写入 sources/ (已存在的跳过)：优先保存上传的原始字节，否则编码为 PNG。"""
+    src_dir = os.path.join(job.dir, "sources")
+    os.makedirs(src_dir, exist_ok=True)
+    for i, item in enumerate(job.spec["sources"]):
+        path = os.path.join(src_dir, item["file"])
+        if os.path.exists(path):
+            continue
+        tmp = f"{path}.tmp"
+        source = sources[i] if sources is not None else None
+        if isinstance(source, str):
+            shutil.copyfile(source, tmp)
+        elif source is not None:
+            data = source.getvalue() if hasattr(source, "getvalue") else source
+            with open(tmp, "wb") as f:
+                f.write(data)
+        else:
+            images[i].save(tmp, format="PNG", compress_level=1)
+        os.replace(tmp, path)
+
+
+def _load_source(job, index):
+    """从 sources/ 读取第 index 张原图 (解码前检查像素数)。"""
+    path = os.path.join(job.dir, "sources", job.spec["sources"][index]["file"])
+    img = Image.open(path)
+    job_limits.check_pixels(img.size)
+    img.load()
+    return img
+
+
+def _tuple_ratio(r):
+    return tuple(r) if isinstance(r, list) else r
+
+
+def _render_images(img, params, meta, ratios, shared_cache):
+    """渲染单张图片，返回与目标一一对应的 PIL.Image 列表。超出资源限制时抛出 JobLimitError。"""
+    job_limits.check_pixels(img.size)
+    if ratios:
+        return processing_controller.process_multi_target(img, params, ratios, meta)
+    # 单一比例：同几何的图片共享阴影/圆角/蒙版图层
+    src, p = processing_controller.apply_output_cap(img, params)
+    geo = processing_controller.resolve_geometry(src.width, src.height, p)
+    job_limits.check_canvas(geo)
+    shared = shared_cache.get(geo, processing_controller.uses_contour_shadow(src, p))
+    return [processing_controller.process_single_image(src, p, meta, shared=shared)]
+
+
+def _encode(out_img):
+    buf = io.BytesIO()
+    out_img.save(buf, format=render_cache.PNG_ENCODER[0], **render_cache.PNG_ENCODER[1])
+    return buf.getvalue()
+
+
+# 隔离子进程内的共享图层缓存 (参数变化时重建)
+_isolated_cache = {"params": None, "cache": None}
+
+
+def _isolated_render(img, params, meta, ratios):
+    """隔离模式任务 (在子进程中运行)：渲染并编码，返回与目标一一对应的 PNG 字节列表。"""
+    if _isolated_cache["params"] != params:
+        _isolated_cache.update(params=params, cache=processing_controller.SharedLayerCache(params))
+    return [_encode(im) for im in _render_images(img, params, meta, ratios, _isolated_cache["cache"])]
+
+
+def render_outputs(img, fname, params, meta=None, ratios=None, shared_cache=None, cache=None, pool=None):
+    """
+    渲染单张图片的全部输出 (带渲染缓存)。
+
+    Args:
+        img (PIL.Image): 原图。
+        fname (str): 原文件名，用于构造输出文件名。
+        params (dict): 渲染参数。
+        meta (dict): 元数据 (参数信息条使用)。
+        ratios (list): 多比例导出的比例列表；None 表示按 params["ratio"] 单比例导出。
+        shared_cache (SharedLayerCache): 按几何分组的共享图层，批量导出时在图片之间复用；
+            None 时只在本次调用内使用。
+        cache (RenderCache): 渲染缓存，None 使用默认缓存。
+        pool (job_limits.IsolatedPool): 未命中缓存时在该执行器的子进程中渲染 (受超时限制)，
+            None 时在当前线程渲染。
+
+    Returns:
+        list: [(输出文件名, PNG 字节)]。命中缓存时读取缓存内容；条目在读取前被淘汰或删除时
+        视为未命中，重新渲染。
+    """
+    cache = cache if cache is not None else render_cache.get_cache()
+    base, _ = os.path.splitext(fname)
+    if ratios:
+        targets = [(f"{base}_{r[0]}x{r[1]}.png" if r else f"{base}_orig.png", ["multi", r]) for r in ratios]
+    else:
+        targets = [(f"{base}_output.png", None)]
+    digest = render_cache.image_digest(img)
+    keys = [cache.key(digest, params, meta, extra=extra) for _, extra in targets]
+    hits = [cache.read(k) for k in keys]
+    if all(data is not None for data in hits):
+        return [(name, data) for (name, _), data in zip(targets, hits)]
+
+    if pool is not None:
+        job_limits.check_pixels(img.size)   # 超大图片不发送给子进程
+        encoded = pool.submit(_isolated_render, img, params, meta, ratios).result()
+    else:
+        if shared_cache is None:
+            shared_cache = processing_controller.SharedLayerCache(params, max_groups=1)
+        encoded = [_encode(im) for im in _render_images(img, params, meta, ratios, shared_cache)]
+    entries = []
+    for (name, _), key, data in zip(targets, keys, encoded):
+        try:
+            cache.put(key, data)
+        except OSError as e:
+            print(f"写入渲染缓存失败: {e}")
+        entries.append((name, data))
+    return entries
+
+
+def render_file(path, out_dir, params, meta_cache=None):
+    """
+    从磁盘读取一张图片，渲染后把输出原子写入 out_dir (监视目录守护进程、渲染队列工作进程使用)。
+
+    Args:
+        path (str): 图片路径。
+        out_dir (str): 输出目录，不存在时创建。
+        params (dict): 渲染参数。
+        meta_cache (MetadataCache): 元数据缓存 (参数信息条使用)，None 使用共享缓存。
+
+    Returns:
+        list: 写出的输出文件路径。
+    """
+    with Image.open(path) as im:
+        job_limits.check_pixels(im.size)   # 解码前拒绝超大图片
+        im.load()
+        meta = None
+        if params.get("banner_enabled"):
+            cache = meta_cache if meta_cache is not None else metaCache.get_cache()
+            meta = readPicInfo.get_image_metadata(path, cache=cache)
+        entries = render_outputs(im, os.path.basename(path), params, meta)
+    os.makedirs(out_dir, exist_ok=True)
+    outputs = []
+    for name, data in entries:
+        target = os.path.join(out_dir, name)
+        tmp = f"{target}.{uuid.uuid4().hex[:8]}.tmp"   # 多个进程/主机可能同时写同一目录
+        with open(tmp, "wb") as dst:
+            dst.write(data)
+        os.replace(tmp, target)
+        outputs.append(target)
+    return outputs
+
+
+def _run_job(job, images=None):
+    """
+    工作线程：逐张渲染并写入任务目录，处理前检查取消标志；全部完成后组装 ZIP。
+    images 为 None (续传) 时从 sources/ 读取原图。
+    """
+    if job.cancelled:
+        job.status = STATUS_CANCELLED
+        _save_manifest(job)
+        return
+    job.status = STATUS_RUNNING
+    _save_manifest(job)
+    spec = job.spec
+    params = dict(spec["params"], ratio=_tuple_ratio(spec["params"].get("ratio")))
+    ratios = [_tuple_ratio(r) for r in spec["ratios"]] if spec["ratios"] else None
+    params_hash = render_cache.params_digest(params, extra=spec["ratios"])
+    files_dir = os.path.join(job.dir, "files")
+    os.makedirs(files_dir, exist_ok=True)
+    progress = _load_progress(job.dir)
+    todo = [i for i in range(job.total) if not (i in progress and _entry_complete(job.dir, progress[i]))]
+    job.done = job.total - len(todo)
+    job.failed = []
+    shared_cache = processing_controller.SharedLayerCache(params)
+    metrics = job.metrics.start()
+    metrics.queued(len(todo))
+    worker = threading.current_thread().name
+    isolated = job_limits.IsolatedPool(1, timeout=job_limits.RENDER_TIMEOUT) if EXPORT_ISOLATED else None
+    try:
+        with open(os.path.join(job.dir, "progress.jsonl"), "a", encoding="utf-8") as log, \
+                telemetry.bind(metrics), isolated or nullcontext():
+            for index in todo:
+                if job.cancelled:
+                    break
+                source = spec["sources"][index]
+                fname = source["name"]
+                metrics.dequeued()
+                t0 = time.perf_counter()
+                error = None
+                entry = {"index": index, "source": fname, "params": params_hash, "outputs": []}
+                try:
+                    img = images[index] if images is not None else _load_source(job, index)
+                    for out_name, data in render_outputs(img, fname, params, source.get("meta"),
+                                                         ratios, shared_cache, pool=isolated):
+                        out_file = f"{index:05d}_{out_name}"
+                        out_path = os.path.join(files_dir, out_file)
+                        with open(f"{out_path}.tmp", "wb") as f:
+                            f.write(data)
+                        os.replace(f"{out_path}.tmp", out_path)
+                        entry["outputs"].append({"name": out_name, "file": out_file, "size": len(data),
+                                                 "sha256": hashlib.sha256(data).hexdigest()})
+                        metrics.add_bytes(len(data))
+                    entry["status"] = "done"
+                except Exception as e:
+                    print(f"导出任务 {job.id} 处理 '{fname}' 失败: {e}")
+                    job.failed.append(fname)
+                    entry.update(status="failed", error=str(e))
+                    error = e
+                # 输出文件已落盘后再记录进度
+                log.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                log.flush()
+                os.fsync(log.fileno())
+                metrics.image_done(worker, time.perf_counter() - t0, error, pool="export")
+                job.done += 1
+        if not job.cancelled:
+            job.artifact_path = assemble_archive(job)
+    except Exception as e:
+        job.status = STATUS_FAILED
+        job.error = str(e)
+        job.finished = time.time()
+        metrics.finish()
+        _save_manifest(job)
+        return
+    job.finished = time.time()
+    metrics.finish()
+    job.status = STATUS_CANCELLED if job.cancelled else STATUS_DONE
+    _save_manifest(job)
+
+
+def assemble_archive(job):
+    """
+    按输入顺序把 progress.jsonl 中记录的输出组装为 <id>.zip (先写临时文件再替换)，返回路径。
+    失败的图片不写入压缩包。
+    """
+    progress = _load_progress(job.dir)
+    path = os.path.join(job.dir, f"{job.id}.zip")
+    tmp = f"{path}.tmp"
+    with zipfile.ZipFile(tmp, "w") as zf:
+        for index in range(job.total):
+            entry = progress.get(index)
+            if entry is None or entry.get("status") != "done":
+                continue
+            for out in entry["outputs"]:
+                zf.write(os.path.join(job.dir, "files", out["file"]), out["name"])
+    os.replace(tmp, path)
+    return path
+
+
+def submit_export(images, filenames, params, metadata=None, ratios=None, name=None, sources=None, owner=None):
+    """
+    提交一个后台 ZIP 导出任务，立即返回任务 id。
+
+    Args:
+        images (list): PIL.Image 列表 (任务期间只读引用，不复制)。
+        filenames (list): 与 images 对应的文件名。
+        params (dict): 导出参数 (会复制一份，之后界面修改参数不影响本任务)。
+        metadata (list): 与 images 对应的元数据，可为 None。
+        ratios (list): 多比例导出的比例列表；None 表示按 params["ratio"] 单比例导出。
+        name (str): 显示用的任务名。
+        sources (list): 与 images 对应的原始文件 (字节、带 getvalue() 的上传文件或文件路径)，
+            写入任务目录供续传使用；为 None 时把 images 编码为 PNG 保存。
+        owner (str): 所有者标识，写入 manifest.json，`list_jobs(owner)` 按此筛选。
+
+    Returns:
+        str: 任务 id。
+    """
+    images = list(images)
+    filenames = list(filenames)
+    metadata = list(metadata) if metadata is not None else [None] * len(images)
+    job = ExportJob(name or f"{len(images)} 张图片", len(images), owner=owner)
+    job.spec = {
+        "version": MANIFEST_VERSION,
+        "id": job.id,
+        "name": job.name,
+        "owner": owner,
+        "created": job.created,
+        "params": dict(params),
+        "ratios": list(ratios) if ratios else None,
+        "sources": [{"name": fname, "file": _source_name(i, fname), "meta": meta}
+                    for i, (fname, meta) in enumerate(zip(filenames, metadata))],
+    }
+    os.makedirs(job.dir, exist_ok=True)
+    _save_manifest(job)
+    with _jobs_lock:
+        _jobs[job.id] = job
+    _executor.submit(_start_job, job, images, list(sources) if sources is not None else None)
+    return job.id
+
+
+def _start_job(job, images, sources):
+    """先把原图全部写入任务目录 (之后进程重启也能续传)，再开始渲染。"""
+    try:
+        _persist_sources(job, images, sources)
+    except Exception as e:
+        job.status = STATUS_FAILED
+        job.error = f"保存原图失败: {e}"
+        job.finished = time.time()
+        _save_manifest(job)
+        return
+    _run_job(job, images)
+
+
+def resume_job(job_id):
+    """续传已中止的任务：跳过已完成的图片，从任务目录读取原图继续渲染。返回是否已提交。"""
+    job = get_job(job_id)
+    if job is None or job.active or job.spec is None:
+        return False
+    job._cancel = threading.Event()
+    job.status = STATUS_QUEUED
+    job.error = None
+    job.metrics = telemetry.BatchMetrics(job.name)
+    _save_manifest(job)
+    _executor.submit(_run_job, job)
+    return True
+
+
+def recover_jobs(auto_resume=False):
+    """
+    载入 JOBS_DIR 下已有的任务目录 (进程重启后调用)，返回载入的任务 id 列表。
+    中断的任务 (排队中/进行中) 标记为已取消，等待所有者续传；
+    auto_resume 为 True 时直接续传 (无界面的批处理脚本使用)。
+    """
+    if not os.path.isdir(JOBS_DIR):
+        return []
+    loaded = []
+    for job_id in sorted(os.listdir(JOBS_DIR)):
+        manifest = os.path.join(JOBS_DIR, job_id, "manifest.json")
+        if get_job(job_id) is not None or not os.path.exists(manifest):
+            continue
+        try:
+            with open(manifest, "r", encoding="utf-8") as f:
+                spec = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"读取导出任务 {job_id} 失败: {e}")
+            continue
+        if spec.get("version") != MANIFEST_VERSION:
+            continue
+        job = ExportJob(spec["name"], len(spec["sources"]), job_id=job_id, owner=spec.get("owner"))
+        job.spec = spec
+        job.created = spec.get("created", job.created)
+        job.finished = spec.get("finished")
+        job.error = spec.get("error")
+        progress = _load_progress(job.dir)
+        job.done = sum(1 for e in progress.values() if e.get("status") in ("done", "failed"))
+        job.failed = [e["source"] for e in progress.values() if e.get("status") == "failed"]
+        interrupted = spec.get("status") in (STATUS_QUEUED, STATUS_RUNNING)
+        job.status = STATUS_CANCELLED if interrupted else spec.get("status", STATUS_FAILED)
+        artifact = os.path.join(job.dir, f"{job_id}.zip")
+        if job.status == STATUS_DONE and os.path.exists(artifact):
+            job.artifact_path = artifact
+        with _jobs_lock:
+            _jobs[job_id] = job
+        loaded.append(job_id)
+        if interrupted and auto_resume:
+            print(f"续传中断的导出任务 {job_id} ({job.done}/{job.total})")
+            resume_job(job_id)
+    return loaded
+
+
+def list_jobs(owner=None):
+    """返回任务 id (按创建时间排序)；指定 owner 时只返回该所有者的任务，None 返回全部 (管理用)。"""
+    with _jobs_lock:
+        jobs = sorted(_jobs.values(), key=lambda j: j.created)
+    return [j.id for j in jobs if owner is None or j.owner == owner]
+
+
+def get_job(job_id):
+    """按 id 返回任务，不存在时返回 None。"""
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def cancel_job(job_id):
+    """请求取消任务（正在渲染的那张图片完成后生效）。已完成的图片保留，可用 resume_job 续传。"""
+    job = get_job(job_id)
+    if job is not None:
+        job._cancel.set()
+
+
+def read_artifact(job_id):
+    """读取已完成任务的 ZIP 内容，未完成时返回 None。"""
+    job = get_job(job_id)
+    if job is None or job.artifact_path is None or not os.path.exists(job.artifact_path):
+        return None
+    with open(job.artifact_path, "rb") as f:
+        return f.read()
+
+
+def remove_job(job_id):
+    """取消（如仍在运行）并删除任务及其任务目录。"""
+    cancel_job(job_id)
+    with _jobs_lock:
+        job = _jobs.pop(job_id, None)
+    if job is not None and os.path.isdir(job.dir):
+        shutil.rmtree(job.dir, ignore_errors=True)
+
@@ -4,36 +4,132 @@
 改动：
 1. create_thumbnails() 默认 max_size = 600，保证预览最长边 ≤ 600，
    大幅降低实时预览运算量，又能保持清晰度。
+2. 新增 load_metadata()，在进程内读取 EXIF 供参数信息条使用。
+3. load_images() 可传入 ImageStore：每张图解码后立即放入存储，超出内存预算的原图
+   写出到内存映射文件，不再把全部原图同时常驻内存。
+4. 缩略图并行生成：不再整图 copy() 后缩小，上传文件直接以缩小解码 (JPEG draft) 打开；
+   同时编码好 JPEG/WebP 字节 (encode_thumbnail)，网格直接展示字节，rerun 时无需任何图像运算。
+5. load_images() 在解码前检查像素数 (controller/job_limits.py)，超限的文件记为读取失败。
+6. load_metadata() 使用共享的元数据缓存 (Read/metaCache.py)，按文件内容命中，重复上传无需重新解析。
 """
 
 import io
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, features
+from Read import readPicInfo, metaCache
+from model import modes
+from controller import job_limits
 
+# 缩略图编码：不透明图用 JPEG，带透明度的用 WebP (不可用时退回 PNG)
+THUMB_QUALITY = 85
+THUMB_ALPHA_FORMAT = "WEBP" if features.check("webp") else "PNG"
 
-def load_images(uploaded_files):
+# 并行生成缩略图的线程数 (解码与缩放在 Pillow 内部释放 GIL)
+THUMB_WORKERS = 4
+
+
+def load_images(uploaded_files, store=None):
     """
     将 Streamlit 上传文件读取为 PIL.Image 列表。
+    传入 store (ImageStore) 时图片逐张放入存储，返回的 images 即该 store。
     返回 (images, filenames, errors)。
     """
-    images, filenames, errors = [], [], []
+    images = store if store is not None else []
+    filenames, errors = [], []
     for file in uploaded_files:
         try:
             img = Image.open(io.BytesIO(file.getvalue()))
+            job_limits.check_pixels(img.size)   # 解码前拒绝超大图片
             img.load()            # 强制读取
-            images.append(img)
+            if store is not None:
+                store.add(img)
+            else:
+                images.append(img)
             filenames.append(file.name)
+        except job_limits.JobLimitError as e:
+            print(f"跳过 {file.name}: {e}")
+            errors.append(file.name)
         except Exception:         # 格式错误 / 读取失败
             errors.append(file.name)
     return images, filenames, errors
 
 
-def create_thumbnails(images, max_size: int = 600):
+def _thumbnail(img, max_size):
+    """按比例缩小到最长边不超过 max_size，不产生整图拷贝 (reducing_gap 先整数倍缩小)。"""
+    w, h = img.size
+    scale = min(1.0, max_size / max(w, h))
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    if size == img.size:
+        return img.copy()
+    return img.resize(size, Image.LANCZOS, reducing_gap=2.0)
+
+
+def create_thumbnails(images, max_size: int = 600, max_workers: int = THUMB_WORKERS):
+    """
+    为预览生成缩略图，最长边不超过 max_size 像素 (多线程并行)。
+    """
+    images = list(images)
+    if len(images) <= 1 or max_workers <= 1:
+        return [_thumbnail(img, max_size) for img in images]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(lambda img: _thumbnail(img, max_size), images))
+
+
+def encode_thumbnail(thumb):
+    """把缩略图编码为 JPEG (带透明度时为 WebP/PNG) 字节，可直接交给 st.image。"""
+    buf = io.BytesIO()
+    if modes.has_alpha(thumb):
+        thumb.save(buf, format=THUMB_ALPHA_FORMAT, quality=THUMB_QUALITY)
+    else:
+        modes.ensure_mode(thumb, "RGB").save(buf, format="JPEG", quality=THUMB_QUALITY)
+    return buf.getvalue()
+
+
+def _thumbnail_from_bytes(data, max_size):
+    """从文件字节直接生成缩略图：JPEG 以 1/2~1/8 缩小解码，不解码全尺寸像素。"""
+    img = Image.open(io.BytesIO(data))
+    img.draft("RGB", (max_size, max_size))   # 非 JPEG 格式忽略
+    thumb = _thumbnail(modes.normalize_source(img), max_size)
+    return thumb, encode_thumbnail(thumb)
+
+
+def create_thumbnails_from_files(uploaded_files, max_size: int = 300, max_workers: int = THUMB_WORKERS):
+    """
+    并行地从上传文件生成缩略图及其编码字节。
+    返回 (thumbs, encoded)，两者与 uploaded_files 一一对应，无法读取的为 None。
+    """
+    def work(file):
+        try:
+            return _thumbnail_from_bytes(file.getvalue(), max_size)
+        except Exception:
+            return None, None
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        results = list(pool.map(work, uploaded_files))
+    return [r[0] for r in results], [r[1] for r in results]
+
+
+def load_metadata(uploaded_files, cache=None):
     """
-    为预览生成缩略图，最长边不超过 max_size 像素。
+    在进程内读取上传文件的相机/镜头元数据 (用于参数信息条)。
+    返回与 uploaded_files 一一对应的列表，读取失败的为 None。
+
+    cache 为 None 时使用共享的元数据缓存。上传文件只经 Pillow 解析 (不调用 ExifTool)，
+    所以只缓存读到的元数据，None 不写入，避免以后按路径读取同一内容时跳过 ExifTool。
     """
-    thumbs = []
-    for img in images:
-        thumb = img.copy()
-        thumb.thumbnail((max_size, max_size), Image.LANCZOS)
-        thumbs.append(thumb)
-    return thumbs
+    cache = cache if cache is not None else metaCache.get_cache()
+    datas = [file.getvalue() for file in uploaded_files]
+    keys = [cache.key_for_bytes(data) for data in datas] if cache is not None else []
+    found = cache.get_many(keys) if cache is not None else {}
+    results, fresh = [], {}
+    for i, data in enumerate(datas):
+        if keys and keys[i] in found:
+            results.append(found[keys[i]])
+            continue
+        meta = readPicInfo.read_pillow_metadata(io.BytesIO(data))
+        results.append(meta)
+        if keys and meta is not None:
+            fresh[keys[i]] = meta
+    if fresh:
+        cache.put_many(fresh)
+    return results
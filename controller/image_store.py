@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+原图存储 (image_store.py)
+-------------------------------------------------
+会话中上传的原图不再全部以 PIL.Image 常驻内存，而是放入 ImageStore：
+
+1.  解码后的像素先留在内存中；常驻字节数超过预算 (budget) 时，最久未访问的图片
+    被写出为会话临时目录中的原始像素文件 (RGB 按 RGBX、RGBA 按 RGBA，每像素 4 字节)。
+2.  已写出的图片通过 np.memmap 映射，`store[i]` 用 Image.frombuffer 直接在映射上构造
+    只读 PIL 图像 (零拷贝)，`store.array(i)` 返回 (h, w, 4) 的只读 NumPy 视图。
+    映射页属于文件页缓存，内存紧张时由内核回收，不计入预算。
+3.  每个 ImageStore 拥有独立的临时目录，`close()`、对象被回收 (会话结束) 或进程退出时删除。
+4.  行为类似只读列表：len()、下标、迭代、bool()，可直接替换原来的图片列表。
+
+注意: 写出的 RGB 图像映射回来后模式为 "RGBX"，渲染流程入口的 modes.normalize_source
+会把它转换为 RGB (渲染本身也需要一份可写的副本)。
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from model import modes
+
+# 常驻内存预算 (MB)，可通过环境变量覆盖
+DEFAULT_BUDGET_MB = int(os.environ.get("BGF_IMAGE_BUDGET_MB", "1024"))
+
+# 临时目录所在位置，None 表示系统临时目录
+SPILL_DIR = os.environ.get("BGF_SPILL_DIR") or None
+
+
+class _Entry:
+    """一张图片的存储记录：内存中的 PIL 图像，或磁盘上的原始像素文件。"""
+
+    __slots__ = ("mode", "size", "image", "path", "mapped")
+
+    def __init__(self, image):
+        self.mode = image.mode            # "RGB" 或 "RGBA"
+        self.size = image.size
+        self.image = image                # 常驻时的 PIL 图像
+        self.path = None                  # 写出后的文件路径
+        self.mapped = None                # 写出后的 np.memmap (只读)
+
+    @property
+    def nbytes(self):
+        w, h = self.size
+        return w * h * 4
+
+
+class ImageStore:
+    """
+    带常驻内存预算的原图存储，超出预算的图片写出到内存映射文件。
+
+    Args:
+        budget_mb (int): 常驻内存预算 (MB)，0 表示全部写出。
+        spill_dir (str): 临时目录的父目录，None 使用系统临时目录。
+    """
+
+    def __init__(self, budget_mb=DEFAULT_BUDGET_MB, spill_dir=SPILL_DIR):
+        self.budget = max(0, int(budget_mb)) * 1024 * 1024
+        self.dir = tempfile.mkdtemp(prefix="bgf-images-", dir=spill_dir)
+        self._entries = []
+        self._resident = OrderedDict()    # 下标 -> None，按访问先后排列 (LRU)
+        self._resident_bytes = 0
+        self._lock = threading.Lock()
+        # 会话结束 (对象被回收) 或进程退出时删除临时目录
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.dir, True)
+
+    # ---------- 写入 ----------
+
+    def add(self, img):
+        """加入一张图片 (任意模式，统一为 RGB / RGBA)，返回其下标。"""
+        img = modes.normalize_source(img)
+        entry = _Entry(img)
+        with self._lock:
+            idx = len(self._entries)
+            self._entries.append(entry)
+            self._resident[idx] = None
+            self._resident_bytes += entry.nbytes
+            self._evict()
+        return idx
+
+    def extend(self, images):
+        for img in images:
+            self.add(img)
+
+    def _evict(self):
+        """把最久未访问的常驻图片写出，直到常驻字节数不超过预算。调用方持有锁。"""
+        while self._resident and self._resident_bytes > self.budget:
+            idx, _ = self._resident.popitem(last=False)
+            self._spill(idx)
+
+    def _spill(self, idx):
+        entry = self._entries[idx]
+        w, h = entry.size
+        path = os.path.join(self.dir, f"{idx}.raw")
+        mm = np.memmap(path, dtype=np.uint8, mode="w+", shape=(h, w, 4))
+        if entry.mode == "RGBA":
+            mm[...] = np.asarray(entry.image)
+        else:
+            # RGB 按 RGBX 排列，映射回来即可零拷贝构造图像
+            mm[..., :3] = np.asarray(entry.image)
+            mm[..., 3] = 255
+        mm.flush()
+        del mm
+        entry.path = path
+        entry.mapped = np.memmap(path, dtype=np.uint8, mode="r", shape=(h, w, 4))
+        entry.image = None
+        self._resident_bytes -= entry.nbytes
+
+    # ---------- 读取 ----------
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __bool__(self):
+        return bool(self._entries)
+
+    def __iter__(self):
+        for i in range(len(self._entries)):
+            yield self[i]
+
+    def __getitem__(self, idx):
+        """返回第 idx 张图片：常驻时为原 PIL 图像，已写出时为映射在文件上的只读图像。"""
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        entry = self._entries[idx]
+        with self._lock:
+            if entry.image is not None:
+                self._resident.move_to_end(idx % len(self._entries))
+                return entry.image
+        raw = "RGBA" if entry.mode == "RGBA" else "RGBX"
+        return Image.frombuffer(entry.mode, entry.size, entry.mapped, "raw", raw, 0, 1)
+
+    def array(self, idx):
+        """返回第 idx 张图片的只读像素视图 (常驻时为 (h, w, 3/4)，已写出时为 (h, w, 4) 映射)。"""
+        entry = self._entries[idx]
+        if entry.image is not None:
+            return np.asarray(entry.image)
+        return entry.mapped
+
+    def size(self, idx):
+        """返回第 idx 张图片的 (宽, 高)，不读取像素。"""
+        return self._entries[idx].size
+
+    # ---------- 统计与清理 ----------
+
+    def stats(self):
+        """返回存储状态 (常驻/写出的张数与字节数)。"""
+        with self._lock:
+            spilled = [e for e in self._entries if e.path is not None]
+            return {
+                "count": len(self._entries),
+                "resident": len(self._entries) - len(spilled),
+                "resident_bytes": self._resident_bytes,
+                "spilled": len(spilled),
+                "spilled_bytes": sum(e.nbytes for e in spilled),
+                "budget_bytes": self.budget,
+            }
+
+    def close(self):
+        """释放所有图片并删除临时目录。之后不可再使用。"""
+        with self._lock:
+            self._entries = []
+            self._resident.clear()
+            self._resident_bytes = 0
+        self._finalizer()
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+单任务资源限制与隔离 (job_limits.py)
+-------------------------------------------------
+防止一张异常图片 (解压炸弹 PNG、三万像素的全景图) 拖垮整个批处理。
+
+1.  像素数上限 `check_pixels`: Image.open 只读取文件头，尺寸在解码前即可得知，
+    超过 MAX_PIXELS 的图片在解码前拒绝。
+2.  画布内存估算 `estimate_render_bytes` / `check_canvas`: 按解析后的几何量估算渲染
+    各图层的内存占用 (输出缓冲、背景、阴影 alpha、前景与圆角遮罩)，超过 MAX_RENDER_MB 拒绝。
+3.  隔离执行器 `IsolatedPool`: 每个工作槽位对应一个子进程，任务逐个发送；
+    - 超过 RENDER_TIMEOUT 秒未返回的任务，其子进程被终止，任务记为 RenderTimeoutError；
+    - 子进程崩溃 (段错误、被系统 OOM 终止等) 时任务记为 WorkerCrashedError；
+    两种情况都只影响当前任务，槽位随即启动新的子进程继续处理后续任务。
+    - 子进程无法启动 (spawn 失败、文件描述符耗尽、调用脚本缺少 __main__ 保护等) 时按退避重试
+      SPAWN_RETRIES 次，仍失败则执行器标记为不可用：当前及排队中的任务、之后提交的任务都以
+      WorkerCrashedError 结束，不会一直等待。
+    可选 BGF_WORKER_MEM_MB 为子进程设置地址空间上限 (RLIMIT_AS)，超限的分配在子进程内抛出 MemoryError。
+
+上限均可用环境变量覆盖: BGF_MAX_PIXELS、BGF_MAX_RENDER_MB、BGF_RENDER_TIMEOUT (0 表示不限)。
+注意 RENDER_TIMEOUT 与崩溃隔离只对经过 IsolatedPool 的渲染生效：界面的后台导出任务默认如此
+(export_jobs.EXPORT_ISOLATED)，批处理需指定 executor="isolated"；线程池/进程池模式下线程无法被强制
+终止，超时设置不起作用，只有像素数与画布内存检查。
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+try:
+    import resource  # Windows 无此模块
+except ImportError:
+    resource = None
+
+# 原图像素数上限 (默认 1 亿像素)
+MAX_PIXELS = int(os.environ.get("BGF_MAX_PIXELS", str(100_000_000)))
+
+# 单张渲染的估算内存上限 (MB)
+MAX_RENDER_MB = int(os.environ.get("BGF_MAX_RENDER_MB", "2048"))
+
+# 隔离模式下单张渲染的超时 (秒)
+RENDER_TIMEOUT = float(os.environ.get("BGF_RENDER_TIMEOUT", "300"))
+
+# 隔离模式子进程的地址空间上限 (MB)，0 为不限制
+WORKER_MEM_MB = int(os.environ.get("BGF_WORKER_MEM_MB", "0"))
+
+
+# 子进程启动失败时的重试次数与首次退避 (秒，每次翻倍)
+SPAWN_RETRIES = 3
+SPAWN_BACKOFF = 0.5
+
+
+class JobLimitError(Exception):
+    """单张图片超出资源限制或执行失败 (批处理中只影响该图片)。"""
+
+
+class PixelLimitError(JobLimitError):
+    """原图像素数超过上限。"""
+
+
+class MemoryLimitError(JobLimitError):
+    """估算的渲染内存超过上限。"""
+
+
+class RenderTimeoutError(JobLimitError):
+    """渲染超时，子进程已被终止。"""
+
+
+class WorkerCrashedError(JobLimitError):
+    """执行任务的子进程异常退出。"""
+
+
+# ---------- 像素数与内存检查 ----------
+
+def check_pixels(size, limit=None):
+    """
+    检查原图尺寸 (宽, 高)，超过像素数上限时抛出 PixelLimitError。
+    对 Image.open 得到的惰性图片在 load() 之前调用，不会解码像素。
+    """
+    limit = MAX_PIXELS if limit is None else limit
+    w, h = size
+    if limit and w * h > limit:
+        raise PixelLimitError(f"图片尺寸 {w}x{h} ({w * h / 1e6:.0f} MP) 超过上限 {limit / 1e6:.0f} MP")
+
+
+def estimate_render_bytes(geo):
+    """
+    按 processing_controller.resolve_geometry 的结果粗略估算单张渲染的内存峰值 (字节)。
+
+    - 画布: 输出 RGBA + 背景 RGBA + 颜色蒙版 RGB，约 11 字节/像素；
+    - 阴影: alpha 及扩散/模糊的中间图，约 3 字节/像素 (含安全边距的总画布)；
+    - 前景: 原图 RGBA + 圆角前景 + 圆角遮罩，约 9 字节/像素。
+    """
+    canvas = geo["canvas_w"] * geo["canvas_h"]
+    full = geo["full_w"] * geo["full_h"]
+    source = geo["orig_w"] * geo["orig_h"]
+    return canvas * 11 + full * 3 + source * 9
+
+
+def check_canvas(geo, limit_mb=None):
+    """估算内存超过上限时抛出 MemoryLimitError。"""
+    limit_mb = MAX_RENDER_MB if limit_mb is None else limit_mb
+    need = estimate_render_bytes(geo)
+    if limit_mb and need > limit_mb * 1024 * 1024:
+        raise MemoryLimitError(
+            f"画布 {geo['canvas_w']}x{geo['canvas_h']} 预计需要 {need / 2**20:.0f} MB，超过上限 {limit_mb} MB")
+
+
+# ---------- 隔离执行器 ----------
+
+def _worker_main(conn, mem_limit_mb):
+    """子进程主循环：逐个接收 (函数, 参数) 并返回 (是否成功, 结果或异常)。"""
+    if mem_limit_mb and resource is not None:
+        limit = int(mem_limit_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        fn, args = job
+        try:
+            reply = (True, fn(*args))
+        except Exception as e:  # 含 MemoryError
+            reply = (False, e)
+        try:
+            conn.send(reply)
+        except Exception as e:  # 结果或异常无法序列化
+            conn.send((False, RuntimeError(f"{type(e).__name__}: {e}")))
+
+
+class IsolatedPool:
+    """
+    子进程隔离的执行器，接口与 concurrent.futures 的执行器一致 (submit / shutdown / with)。
+
+    Args:
+        max_workers (int): 子进程数量。
+        timeout (float): 单个任务的超时 (秒)，None 或 0 为不限。
+        mem_limit_mb (int): 子进程地址空间上限 (MB)，None 取 WORKER_MEM_MB。
+    """
+
+    def __init__(self, max_workers, timeout=None, mem_limit_mb=None):
+        self.timeout = timeout or None
+        self.mem_limit_mb = WORKER_MEM_MB if mem_limit_mb is None else mem_limit_mb
+        # spawn: 子进程不继承父进程的线程与锁状态
+        self._ctx = multiprocessing.get_context("spawn")
+        self._jobs = queue.Queue()
+        self._broken = None   # 子进程无法启动时的异常，之后的任务直接失败
+        self._threads = [threading.Thread(target=self._supervise, name=f"isolated-{i}", daemon=True)
+                         for i in range(max(1, max_workers))]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, fn, *args):
+        future = Future()
+        if self._broken is not None:
+            future.set_exception(self._broken)
+            return future
+        self._jobs.put((future, fn, args))
+        return future
+
+    def shutdown(self, wait=True):
+        for _ in self._threads:
+            self._jobs.put(None)
+        if wait:
+            for t in self._threads:
+                t.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown(wait=True)
+        return False
+
+    def _spawn(self):
+        parent, child = self._ctx.Pipe()
+        try:
+            proc = self._ctx.Process(target=_worker_main, args=(child, self.mem_limit_mb), daemon=True)
+            proc.start()
+        except BaseException:
+            parent.close()
+            child.close()
+            raise
+        child.close()
+        return proc, parent
+
+    def _spawn_with_retry(self):
+        """启动子进程，失败时按退避重试；全部失败时标记执行器不可用并返回 None。"""
+        delay = SPAWN_BACKOFF
+        for attempt in range(SPAWN_RETRIES + 1):
+            if self._broken is not None:
+                return None
+            try:
+                return self._spawn()
+            except Exception as e:
+                if attempt == SPAWN_RETRIES:
+                    print(f"隔离执行器无法启动工作进程: {e}")
+                    self._broken = WorkerCrashedError(f"无法启动工作进程: {type(e).__name__}: {e}")
+                    return None
+                time.sleep(delay)
+                delay *= 2
+
+    @staticmethod
+    def _kill(proc, conn):
+        if proc.is_alive():
+            proc.kill()
+        proc.join()
+        conn.close()
+
+    def _supervise(self):
+        """监督线程：把任务发给自己的子进程并等待结果，超时或崩溃时重建子进程。"""
+        proc = conn = None
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    return
+                future, fn, args = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if self._broken is not None:
+                    future.set_exception(self._broken)
+                    continue
+                if proc is None or not proc.is_alive():
+                    if proc is not None:
+                        self._kill(proc, conn)
+                        proc = None
+                    spawned = self._spawn_with_retry()
+                    if spawned is None:
+                        future.set_exception(self._broken)
+                        continue
+                    proc, conn = spawned
+                try:
+                    conn.send((fn, args))
+                except (EOFError, ConnectionError):
+                    pass  # 子进程已退出，下面的 recv 会报告
+                except Exception as e:  # 参数无法序列化
+                    future.set_exception(e)
+                    continue
+                try:
+                    if not conn.poll(self.timeout):
+                        self._kill(proc, conn)
+                        proc = None
+                        future.set_exception(RenderTimeoutError(f"渲染超过 {self.timeout:g} 秒，已终止"))
+                        continue
+                    ok, value = conn.recv()
+                except (EOFError, ConnectionError):
+                    proc.join(5)
+                    code = proc.exitcode
+                    self._kill(proc, conn)
+                    proc = None
+                    future.set_exception(WorkerCrashedError(f"工作进程异常退出 (exitcode {code})"))
+                    continue
+                except Exception as e:  # 结果无法反序列化等：子进程状态不确定，重建
+                    self._kill(proc, conn)
+                    proc = None
+                    future.set_exception(e)
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+        finally:
+            if proc is not None:
+                try:
+                    conn.send(None)
+                except (OSError, ValueError):
+                    pass
+                proc.join(5)
+                self._kill(proc, conn)
@@ -9,10 +9,11 @@
     - 计算画布尺寸 (`_canvas_size`)，考虑边距和目标比例。
     - 计算像素偏移量 (`_offset_px`)。
     - 生成背景层 (调用 `background.create_blur_background`)。
-    - 生成阴影层 (调用 `shadow.create_shadow_layer`)，考虑偏移联动和边距跟随。
+    - 生成阴影 alpha (调用 `shadow.create_shadow_alpha`)，考虑偏移联动和边距跟随。
     - 生成前景层 (调用 `foreground.apply_round_corners`)。
-    - 合成图层并按最终画布尺寸裁剪。
-2.  提供 `process_all_images` 函数，使用线程池并行处理多张图片。
+    - 合成图层 (融合合成器，直接输出最终画布尺寸)。
+2.  提供 `process_all_images` 函数，使用线程池并行处理多张图片
+    (`iter_process_images` 按完成顺序逐张产出)。
 3.  包含核心计算逻辑的辅助函数 `_canvas_size` 和 `_offset_px`。
 
 改动记录:
@@ -21,12 +22,57 @@
       原为 `p.get("target_ratio")`，应为 `p.get("ratio")`，以匹配 param_view.py 中设置的状态键。
     - 添加/更新中文注释，保持代码风格一致。
     - 确认 `background.create_blur_background` 调用时传递了 `mask_opacity`。
+- 背景/阴影/圆角三个阶段改为通过 `model.registry.run_stage` 调用，
+  可用参数 `render_backend` 按次选择后端，未指定时使用注册表的全局默认。
+- 新增参数信息条图层 (model/banner.py)：`process_single_image` 接收 `meta`，
+  `process_all_images` 接收与图片对应的 `metadata` 列表。
+- 入口统一输入模式 (model/modes.py)，各阶段在模式已符合时跳过 convert()，
+  未启用的背景/阴影不再创建空白整图图层。
+- 几何计算提取为 `resolve_geometry`；阴影层、圆角遮罩、颜色蒙版层由
+  `build_shared_layers` 生成，`process_all_images` 按几何分组每组只生成一次并只读共享。
+- 新增 `process_multi_target`：一次渲染多个画面比例，共享源图、圆角前景和覆盖所有目标的模糊背景。
+- 新增输出尺寸上限 `output_max_edge`：`apply_output_cap` 先算出最终缩放比例，
+  源图只缩小一次、像素参数用 `scale_params` (原 preview_view._scaled_params) 同步缩放，
+  之后整个流程在输出分辨率下渲染。
+- 图层合成改用 model/compositor.py 的 NumPy 融合合成器：背景、阴影 alpha、前景和信息条
+  一次遍历写入画布尺寸的输出缓冲区，不再创建带安全边距的中间 RGBA 图层和裁剪拷贝。
+- 启动时加载本机校准配置 (controller/calibration.py)：`process_all_images` 的并发数与
+  线程池/进程池默认取自配置，背景模糊方法按模糊半径区间选择。
+- 新增背景模式 `background_mode` (`render_background`)：除毛玻璃模糊外，可选主色纯色、
+  双色/四角渐变和色调低清模糊 (model/palette.py)，颜色按图片缓存，几乎不增加渲染成本。
+- `process_all_images` 记录批次遥测 (controller/telemetry.py)：吞吐量、各工作线程忙碌时间、
+  队列深度、各阶段耗时/内存峰值、峰值 RSS 和失败类型，可传入 `metrics` 获取。
+- 新增生成器 `iter_process_images`：按完成顺序产出 (下标, 结果或异常)，在途任务数有上限，
+  输入可以是惰性迭代器；`process_all_images` 改为在其之上收集结果。
+- 单张资源限制 (controller/job_limits.py)：解码前检查像素数，渲染前按几何估算画布内存；
+  新增执行器 "isolated"：每张图片在子进程中渲染，超时的任务被终止、崩溃的子进程被重建，
+  均只记为该图片失败，批次继续。
+- 新增水印图层 (model/watermark.py)：Logo 与文字按 (素材, 目标尺寸) 光栅化并缓存，
+  作为合成器的小图层只在所在区域混合。
+- 新增阴影形状 `shadow_shape`："透明轮廓" 时带透明度的输入由圆角后前景的 alpha 生成轮廓阴影
+  (`build_contour_shadow`，逐图计算，扩散与模糊在缩小分辨率下进行)；不透明的输入仍使用共享的矩形阴影。
+- 批处理共享图层缓存 `SharedLayerCache` 只保留最近使用的 SHARED_LAYER_GROUPS 个几何分组
+  (每组含画布尺寸的阴影 alpha 与蒙版层)，混合尺寸的批次内存不再随尺寸种类增长；
+  使用轮廓阴影的图片单独分组，不生成用不到的矩形阴影。
 """
 
-from concurrent.futures import ThreadPoolExecutor
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
 from PIL import Image
 # 导入模型子模块 (假设在 model/ 目录下)
-from model import background, shadow, foreground
+from model import registry, banner, modes, background, foreground, compositor, palette, watermark, shadow
+from controller import calibration, telemetry, job_limits
+
+# 启动时加载本机校准配置 (python -m controller.calibration 生成)，不存在时使用默认设置
+calibration.load_startup_profile()
+
+# 批处理共享图层缓存保留的几何分组数 (同尺寸的图片通常相邻，少量分组即可命中)
+SHARED_LAYER_GROUPS = int(os.environ.get("BGF_SHARED_LAYER_GROUPS", "4"))
 
 # --- 工具函数 ---
 
@@ -139,81 +185,154 @@ def _offset_px(cw, ch, p):
         off_y_pct = p.get("offset_y_val_pct", 0)
         return int(off_x_pct / 100 * cw), int(off_y_pct / 100 * ch)
 
+# ----- 将所有像素参数按 scale 同步缩放 -----
+def scale_params(p: dict, scale: float):
+    """创建参数副本，并将像素单位参数按 scale 缩放（预览与输出尺寸上限共用）。"""
+    p2 = p.copy()
+    # 缩放边距参数（仅当单位为像素）
+    if p2.get("margin_unit", "像素(px)") == "像素(px)":
+        use_independent = p2.get("ind_margin", False)
+        if use_independent:
+             for m in ["margin_top", "margin_bottom", "margin_left", "margin_right"]:
+                 p2[m] = int(p2.get(m, 0) * scale)
+        else:
+             p2["margin_all"] = int(p2.get("margin_all", 0) * scale)
+             # 同步更新独立值，以便 _canvas_size 能正确计算
+             p2["margin_top"] = p2["margin_bottom"] = p2["margin_left"] = p2["margin_right"] = p2["margin_all"]
+
+    # 缩放阴影参数（仅当单位为像素）
+    if p2.get("shadow_unit", "像素(px)") == "像素(px)":
+        for s in ["shadow_spread", "shadow_blur", "shadow_offset_x", "shadow_offset_y"]:
+            # 偏移量可为负，其他非负
+            val = p2.get(s, 0)
+            scaled_val = int(val * scale)
+            if "offset" not in s:
+                 scaled_val = max(0, scaled_val)
+            p2[s] = scaled_val
 
-# ---------- 单张图像处理核心函数 ----------
-def process_single_image(img, p):
+    # 缩放背景模糊半径
+    p2["background_blur"] = max(0, int(p2.get("background_blur", 0) * scale))
+
+    # 缩放前景偏移量（仅当单位为像素）
+    if p2.get("offset_unit", "像素(px)") == "像素(px)":
+        p2["offset_x_val"] = int(p2.get("offset_x_val", 0) * scale)
+        p2["offset_y_val"] = int(p2.get("offset_y_val", 0) * scale)
+
+    # --- 重要的：不缩放百分比值或比例值 ---
+    # background_scale, corner_radius_pct, shadow_opacity, background_mask_opacity 等保持不变
+
+    return p2
+
+
+def apply_output_cap(img, p, ratios=None):
     """
-    处理单张 PIL 图像，应用所有选定的效果。
+    输出尺寸上限 (output_max_edge，最终画布长边像素，0 表示不限制)。
+    先按原分辨率算出最终画布，超出上限时把源图一次性缩小、像素参数同步缩放，
+    之后整个渲染流程都在输出分辨率下进行。
 
     Args:
-        img (PIL.Image): 输入的原始图像 (RGBA 或 RGB)。
-        p (dict): 包含所有处理参数的字典。
+        img (PIL.Image): 已统一模式的源图。
+        p (dict): 参数字典。
+        ratios (list): 多目标导出时的比例列表，按其中最大的画布计算缩放。
 
     Returns:
-        PIL.Image: 处理完成的 RGBA 图像，或在极端情况下返回一个空的 1x1 图像。
+        tuple: (缩放后的源图, 缩放后的参数)。返回的参数中 output_max_edge 已清零，避免重复缩放。
     """
-    if img is None:
-        return Image.new("RGBA", (1, 1), (0, 0, 0, 0)) # 处理空输入
+    if int(p.get("output_max_edge", 0) or 0) <= 0:
+        return img, p
+    p2 = dict(p, output_max_edge=0)
+    scale = output_cap_scale(img.size, p, ratios)
+    if scale is None:
+        return img, p2
+    # reducing_gap 先用整数倍缩小再精确重采样，大幅缩小时明显更快
+    small = img.resize(_scaled_size(img.size, scale), Image.LANCZOS, reducing_gap=3.0)
+    return small, scale_params(p2, scale)
+
+
+def output_cap_scale(size, p, ratios=None):
+    """返回输出尺寸上限要求的缩放比例，不需要缩小时返回 None。"""
+    max_edge = int(p.get("output_max_edge", 0) or 0)
+    if max_edge <= 0:
+        return None
+    ow, oh = size
+    long_edge = 0
+    for ratio in (ratios if ratios else [p.get("ratio")]):
+        cw, ch, _, _ = _canvas_size(ow, oh, dict(p, ratio=ratio))
+        long_edge = max(long_edge, cw, ch)
+    if long_edge <= max_edge:
+        return None
+    return max_edge / long_edge
+
+
+def _scaled_size(size, scale):
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def _banner_box(cw, ch, fg_bottom, p):
+    """
+    计算参数信息条在画布上的位置和尺寸。
+    信息条高度为画布高度的 banner_height_pct%；优先放在前景下方的留白中居中，
+    留白不足时贴着画布底边放置 (覆盖在前景上)。
+
+    Returns:
+        tuple: (x, y, w, h)
+    """
+    bh = max(1, int(p.get("banner_height_pct", 8) / 100 * ch))
+    space = ch - fg_bottom
+    if space >= bh:
+        by = fg_bottom + (space - bh) // 2
+    else:
+        by = ch - bh
+    return 0, max(0, by), cw, bh
 
-    ow, oh = img.size # 获取原图尺寸
 
+# ---------- 几何解析与共享图层 ----------
+def resolve_geometry(ow, oh, p):
+    """
+    根据原图尺寸和参数解析出渲染所需的全部几何量。
+    参数相同且原图尺寸相同的图片得到完全相同的结果，可据此共享图层。
+
+    Args:
+        ow (int): 原始图像宽度。
+        oh (int): 原始图像高度。
+        p (dict): 参数字典。
+
+    Returns:
+        dict: 画布尺寸、安全边距、前景/阴影位置、阴影与圆角的像素参数等。
+    """
     # --- 1. 计算最终画布尺寸和前景基线位置 ---
     # 调用 _canvas_size 计算考虑边距和比例后的画布尺寸 (canvas_w, canvas_h)
     # 以及前景内容在此画布上的左上角位置 (base_x, base_y)
     canvas_w, canvas_h, base_x, base_y = _canvas_size(ow, oh, p)
+    min_dim = min(ow, oh) if min(ow,oh) > 0 else 1 # 防止除零
 
     # --- 2. 计算阴影所需的安全边距 (padding) ---
     # 阴影可能会超出原图+边距的范围，需要额外的画布空间绘制
+    is_px_shadow = p.get("shadow_unit", "像素(px)") == "像素(px)"
+    if is_px_shadow:
+         spread_px = p.get("shadow_spread", 0)
+         blur_px = p.get("shadow_blur", 0)
+    else: # 百分比单位，基于原图短边计算
+         spread_px = int(p.get("shadow_spread_pct", 0) / 100 * min_dim)
+         blur_px = int(p.get("shadow_blur_pct", 0) / 100 * min_dim)
     pad = 0 # 默认无额外边距
     if p.get("shadow_enabled"):
-        is_px_shadow = p.get("shadow_unit", "像素(px)") == "像素(px)"
-        if is_px_shadow:
-             spread = p.get("shadow_spread", 0)
-             blur = p.get("shadow_blur", 0)
-        else: # 百分比单位，基于原图短边计算
-             min_dim = min(ow, oh) if min(ow,oh) > 0 else 1 # 防止除零
-             spread = int(p.get("shadow_spread_pct", 0) / 100 * min_dim)
-             blur = int(p.get("shadow_blur_pct", 0) / 100 * min_dim)
         # 安全边距约等于扩散半径+模糊半径 (确保模糊效果不被裁剪)
-        pad = max(0, spread + blur)
-
-    # 计算包含安全边距的总画布尺寸
-    full_w = canvas_w + 2 * pad
-    full_h = canvas_h + 2 * pad
-    # 确保总画布尺寸至少为 1x1
-    full_w = max(1, full_w)
-    full_h = max(1, full_h)
-
-
-    # --- 3. 创建背景层 ---
-    # 先创建一个透明画布，尺寸为不含安全边距的 canvas_w x canvas_h
-    bg_core = Image.new("RGBA", (canvas_w, canvas_h), (0, 0, 0, 0))
-    if p.get("background_enabled"):
-        # 如果启用了背景效果，则调用 background 模块生成
-        bg_core = background.create_blur_background(
-            original_img=img,                      # 原始图像
-            output_size=(canvas_w, canvas_h),      # 目标背景尺寸
-            scale_factor=p.get("background_scale", 1.0), # 背景内容缩放
-            blur_radius=p.get("background_blur", 0),    # 背景模糊半径
-            mask_type=p.get("background_mask", "无"),   # 背景蒙版类型
-            mask_opacity=p.get("background_mask_opacity", 40) # 背景蒙版不透明度
-        )
+        pad = max(0, spread_px + blur_px)
 
-    # 创建包含安全边距的总背景画布 (全透明)
-    bg = Image.new("RGBA", (full_w, full_h), (0, 0, 0, 0))
-    # 将生成的背景核心内容粘贴到总背景画布的中心区域 (考虑安全边距 pad)
-    bg.paste(bg_core, (pad, pad))
+    # 计算包含安全边距的总画布尺寸，确保至少为 1x1
+    full_w = max(1, canvas_w + 2 * pad)
+    full_h = max(1, canvas_h + 2 * pad)
 
-    # --- 4. 计算前景内容在总画布上的最终位置 (考虑偏移) ---
+    # --- 3. 计算前景内容在总画布上的最终位置 (考虑偏移) ---
     # 获取像素偏移量
     off_x, off_y = _offset_px(canvas_w, canvas_h, p)
     # 前景最终位置 = 安全边距 + 基线位置 + 偏移量
     fg_x = pad + base_x + off_x
     fg_y = pad + base_y + off_y
 
-    # --- 5. 计算阴影的偏移量 (考虑联动和边距跟随) ---
+    # --- 4. 计算阴影的偏移量 (考虑联动和边距跟随) ---
     # 基础阴影偏移
-    is_px_shadow = p.get("shadow_unit", "像素(px)") == "像素(px)"
     if is_px_shadow:
         base_sh_x = p.get("shadow_offset_x", 0)
         base_sh_y = p.get("shadow_offset_y", 0)
@@ -253,105 +372,591 @@ def process_single_image(img, p):
         sh_off_x += (l_px - r_px) // 2
         sh_off_y += (t_px - b_px) // 2
 
-    # --- 6. 创建阴影层 ---
-    # 创建一个透明的总画布用于绘制阴影
-    sh_layer = Image.new("RGBA", (full_w, full_h), (0, 0, 0, 0))
+    return {
+        "orig_w": ow, "orig_h": oh,
+        "canvas_w": canvas_w, "canvas_h": canvas_h,
+        "base_x": base_x, "base_y": base_y,
+        "pad": pad, "full_w": full_w, "full_h": full_h,
+        "off_x": off_x, "off_y": off_y,
+        "fg_x": fg_x, "fg_y": fg_y,
+        "sh_off_x": sh_off_x, "sh_off_y": sh_off_y,
+        "spread_px": max(0, spread_px), "blur_px": max(0, blur_px),
+        # 圆角半径（百分比转像素）
+        "corner_radius_px": int(p.get("corner_radius_pct", 0) / 100 * min_dim),
+    }
+
+
+def geometry_key(geo):
+    """把几何解析结果转为可哈希的分组键。"""
+    return tuple(sorted(geo.items()))
+
+
+def render_background(img, size, p, mask_layer=None):
+    """
+    按背景模式 `background_mode` 生成画布尺寸的背景层。
+
+    - "毛玻璃模糊" (默认): 调用 background 阶段 (注册表，按模糊半径选择后端)。
+    - 主色纯色 / 双色渐变 / 四角渐变 / 色调低清模糊: 由 model/palette.py 根据缓存的主色生成，
+      成本几乎与模糊半径和原图尺寸无关，再叠加同样的颜色蒙版。
+
+    Returns:
+        PIL.Image: RGBA 背景层。
+    """
+    mode = p.get("background_mode", palette.MODE_BLUR)
+    if mode != palette.MODE_BLUR and mode in palette.BACKGROUND_MODES:
+        bg = palette.create_palette_background(img, size, mode, blur_radius=p.get("background_blur", 0))
+        bg = background.apply_mask(bg, p.get("background_mask", "无"),
+                                   p.get("background_mask_opacity", 40), mask_layer)
+        return bg.convert("RGBA")
+    return registry.run_stage(
+        "background",
+        backend=p.get("render_backend"),
+        range_value=p.get("background_blur", 0), # 按模糊半径选择模糊方法 (校准结果)
+        original_img=img,                      # 原始图像
+        output_size=size,                      # 目标背景尺寸
+        scale_factor=p.get("background_scale", 1.0), # 背景内容缩放
+        blur_radius=p.get("background_blur", 0),    # 背景模糊半径
+        mask_type=p.get("background_mask", "无"),   # 背景蒙版类型
+        mask_opacity=p.get("background_mask_opacity", 40), # 背景蒙版不透明度
+        mask_layer=mask_layer, # 共享的颜色蒙版层
+    )
+
+
+def build_shared_layers(geo, p):
+    """
+    生成只依赖几何与参数、与像素内容无关的图层，供同组图片只读共享。
+
+    Returns:
+        dict:
+            - "shadow_alpha": 阴影 alpha (L，含安全边距) 或 None。
+            - "corner_mask": 前景圆角遮罩 (L) 或 None。
+            - "mask_overlay": 背景颜色蒙版层 (RGB) 或 None。
+    """
+    return {
+        "shadow_alpha": build_shadow_alpha(geo, p),
+        "corner_mask": build_corner_mask(geo),
+        "mask_overlay": build_mask_overlay(geo, p),
+    }
+
+
+def build_shadow_alpha(geo, p):
+    """阴影 alpha (L，含安全边距)；未启用阴影时为 None。"""
     if p.get("shadow_enabled"):
-        # 如果启用了阴影
-        # 获取阴影参数（像素或百分比转换后的像素）
-        is_px_shadow = p.get("shadow_unit", "像素(px)") == "像素(px)"
-        if is_px_shadow:
-             spread_px = p.get("shadow_spread", 0)
-             blur_px = p.get("shadow_blur", 0)
-        else:
-             min_dim = min(ow, oh) if min(ow,oh) > 0 else 1
-             spread_px = int(p.get("shadow_spread_pct", 0) / 100 * min_dim)
-             blur_px = int(p.get("shadow_blur_pct", 0) / 100 * min_dim)
-        # 获取圆角半径（百分比转像素）
-        min_dim = min(ow, oh) if min(ow,oh) > 0 else 1
-        corner_radius_px = int(p.get("corner_radius_pct", 0) / 100 * min_dim)
-
-        # 调用 shadow 模块生成阴影层
-        sh_layer = shadow.create_shadow_layer(
-            orig_size=(ow, oh),                 # 原图尺寸，用于确定阴影形状
-            output_size=(full_w, full_h),       # 阴影绘制的总画布尺寸
-            corner_radius=corner_radius_px,     # 圆角半径
-            spread_radius=max(0, spread_px),    # 扩散半径 (确保非负)
-            blur_radius=max(0, blur_px),        # 模糊半径 (确保非负)
-            opacity=p.get("shadow_opacity", 0.5), # 阴影不透明度
-            offset_x=sh_off_x,                  # 计算后的总水平偏移
-            offset_y=sh_off_y,                  # 计算后的总垂直偏移
+        # 调用 shadow_alpha 阶段生成阴影 (黑色阴影只需 alpha 通道)
+        return registry.run_stage(
+            "shadow_alpha",
+            backend=p.get("render_backend"),
+            orig_size=(geo["orig_w"], geo["orig_h"]),  # 原图尺寸，用于确定阴影形状
+            output_size=(geo["full_w"], geo["full_h"]),  # 阴影绘制的总画布尺寸
+            corner_radius=geo["corner_radius_px"],    # 圆角半径
+            spread_radius=geo["spread_px"],           # 扩散半径
+            blur_radius=geo["blur_px"],               # 模糊半径
+            opacity=p.get("shadow_opacity", 0.5),     # 阴影不透明度
+            offset_x=geo["sh_off_x"],                 # 计算后的总水平偏移
+            offset_y=geo["sh_off_y"],                 # 计算后的总垂直偏移
         )
-
-    # --- 7. 创建前景层 ---
-    # 计算前景圆角半径 (像素)
-    min_dim = min(ow, oh) if min(ow,oh) > 0 else 1
-    cr_px = int(p.get("corner_radius_pct", 0) / 100 * min_dim)
-    # 应用圆角
-    fg_img = foreground.apply_round_corners(img, cr_px)
-    # 创建透明的总画布用于放置前景
-    fg_layer = Image.new("RGBA", (full_w, full_h), (0, 0, 0, 0))
-    # 将带圆角的前景图粘贴到计算好的最终位置 (fg_x, fg_y)
-    # 使用 fg_img 作为 mask 进行粘贴，以保留透明圆角区域
-    fg_layer.paste(fg_img, (fg_x, fg_y), fg_img)
-
-    # --- 8. 图层合成与最终裁剪 ---
-    # 合成顺序：背景 -> 阴影 -> 前景
-    merged = Image.alpha_composite(bg, sh_layer) # 背景上叠加阴影
-    merged = Image.alpha_composite(merged, fg_layer) # 再叠加上前景
-
-    # 定义最终裁剪区域（去除安全边距 pad，得到 canvas_w x canvas_h）
-    final_crop_box = (pad, pad, pad + canvas_w, pad + canvas_h)
-
-    # 确保裁剪坐标在有效范围内
-    final_crop_box = (
-        max(0, final_crop_box[0]), max(0, final_crop_box[1]),
-        min(full_w, final_crop_box[2]), min(full_h, final_crop_box[3])
+    return None
+
+
+def build_contour_shadow(fg_img, geo, p):
+    """轮廓阴影 alpha (L，含安全边距)：由圆角后前景的 alpha 通道生成，随图片内容变化，不共享。"""
+    return registry.run_stage(
+        "shadow_contour",
+        backend=p.get("render_backend"),
+        alpha=modes.ensure_mode(fg_img, "RGBA").getchannel("A"),  # 前景 alpha (含圆角)
+        output_size=(geo["full_w"], geo["full_h"]),
+        spread_radius=geo["spread_px"],
+        blur_radius=geo["blur_px"],
+        opacity=p.get("shadow_opacity", 0.5),
+        offset_x=geo["sh_off_x"],
+        offset_y=geo["sh_off_y"],
     )
 
-    # 执行裁剪，前提是裁剪区域有效 (宽度和高度大于0)
-    if final_crop_box[2] > final_crop_box[0] and final_crop_box[3] > final_crop_box[1]:
-        return merged.crop(final_crop_box)
-    else:
-        # 如果裁剪区域无效（例如画布尺寸为0），返回一个默认的空图像
-        print(f"警告: 最终裁剪区域无效 {final_crop_box}，画布尺寸 W={canvas_w}, H={canvas_h}")
-        return Image.new("RGBA", (max(1, canvas_w), max(1, canvas_h)), (0,0,0,0))
+
+def uses_contour_shadow(img, p):
+    """是否对该图使用轮廓阴影: 阴影形状为 "透明轮廓" 且输入带透明度。"""
+    return (bool(p.get("shadow_enabled")) and p.get("shadow_shape") == shadow.SHAPE_CONTOUR
+            and modes.has_alpha(img))
+
+
+def build_corner_mask(geo):
+    """前景圆角遮罩 (L)；无圆角时为 None。"""
+    if geo["corner_radius_px"] > 0:
+        return foreground.round_corner_mask((geo["orig_w"], geo["orig_h"]), geo["corner_radius_px"])
+    return None
+
+
+def build_mask_overlay(geo, p):
+    """背景颜色蒙版层 (RGB)；未启用背景或无蒙版时为 None。"""
+    if p.get("background_enabled"):
+        return background.create_mask_overlay(
+            (geo["canvas_w"], geo["canvas_h"]),
+            p.get("background_mask", "无"), p.get("background_mask_opacity", 40))
+    return None
+
+
+# ---------- 单张图像处理核心函数 ----------
+def process_single_image(img, p, meta=None, shared=None, layers=None):
+    """
+    处理单张 PIL 图像，应用所有选定的效果。
+
+    Args:
+        img (PIL.Image): 输入的原始图像 (RGBA 或 RGB)。
+        p (dict): 包含所有处理参数的字典。
+        meta (dict): 该图的相机/镜头元数据 (readPicInfo 格式)，用于参数信息条，可为 None。
+        shared (dict): `build_shared_layers` 的结果，批处理时同几何的图片共用；
+                       为 None 时在本次调用内生成。
+        layers (dict): 预先生成的逐图图层 (多目标导出时使用)，可包含：
+                       "background" 画布尺寸的背景核心 (RGBA)、"foreground" 圆角后的前景 (RGBA)。
+
+    Returns:
+        PIL.Image: 处理完成的 RGBA 图像，或在极端情况下返回一个空的 1x1 图像。
+    """
+    if img is None:
+        return Image.new("RGBA", (1, 1), (0, 0, 0, 0)) # 处理空输入
+
+    # 入口处统一输入模式 (RGB/RGBA)，P/LA/I;16 等只在这里转换一次，后续各阶段不再重复拷贝
+    img = modes.normalize_source(img)
+    # 设置了输出尺寸上限时，先把源图和像素参数缩放到输出分辨率
+    img, p = apply_output_cap(img, p)
+    ow, oh = img.size # 获取原图尺寸
+
+    # --- 1. 解析几何量 (画布尺寸、安全边距、前景与阴影位置) ---
+    geo = resolve_geometry(ow, oh, p)
+    canvas_w, canvas_h = geo["canvas_w"], geo["canvas_h"]
+    pad = geo["pad"]
+
+    # --- 2. 几何相关的共享图层 (阴影、圆角遮罩、颜色蒙版) ---
+    contour = uses_contour_shadow(img, p)
+    if shared is None:
+        # 轮廓阴影不使用共享的矩形阴影，无需生成
+        shared = build_shared_layers(geo, dict(p, shadow_enabled=False) if contour else p)
+
+    layers = layers or {}
+
+    # --- 3. 创建背景层 (画布尺寸，合成器直接读取，无需带安全边距的整图) ---
+    bg_arr = None
+    if p.get("background_enabled"):
+        # 如果启用了背景效果，则调用 background 阶段生成 (已预先生成时直接使用)
+        bg_core = layers.get("background")
+        if bg_core is None:
+            bg_core = render_background(img, (canvas_w, canvas_h), p, mask_layer=shared.get("mask_overlay"))
+        if bg_core.size != (canvas_w, canvas_h):
+            bg_core = bg_core.resize((canvas_w, canvas_h), Image.BILINEAR)
+        bg_arr = np.asarray(modes.ensure_mode(bg_core, "RGBA"))
+
+    # --- 4. 创建前景层 ---
+    # 应用圆角 (使用共享的圆角遮罩；已预先生成时直接使用)
+    fg_img = layers.get("foreground")
+    if fg_img is None:
+        fg_img = registry.run_stage(
+            "corners", img, geo["corner_radius_px"],
+            mask=shared.get("corner_mask"), backend=p.get("render_backend"))
+    fg_arr = np.asarray(modes.ensure_mode(fg_img, "RGBA"))
+
+    # --- 5. 阴影 alpha：轮廓阴影由前景 alpha 逐图生成，否则使用共享的矩形阴影 (只读)；
+    #        取与画布对齐的视图，去掉安全边距 ---
+    sh_img = build_contour_shadow(fg_img, geo, p) if contour else shared.get("shadow_alpha")
+    sh_arr = None
+    if sh_img is not None:
+        sh_arr = np.asarray(sh_img)[pad:pad + canvas_h, pad:pad + canvas_w]
+
+    # --- 5.1 参数信息条 (可选，作为前景之上的小图层) ---
+    overlays = []
+    if p.get("banner_enabled") and meta:
+        fg_bottom = geo["base_y"] + geo["off_y"] + oh # 前景底边在画布上的 y 坐标
+        bx, by, bw, bh = _banner_box(canvas_w, canvas_h, fg_bottom, p)
+        info = banner.create_info_banner(
+            meta, (bw, bh),
+            text_color=p.get("banner_text_color", "白色"),
+            font_path=p.get("banner_font") or None,
+            show_logo=p.get("banner_logo", True),
+        )
+        if info is not None:
+            overlays.append((np.asarray(info), (bx, by)))
+
+    # --- 5.2 水印 (可选，缓存的小图层，只在其区域内混合) ---
+    if p.get("watermark_enabled"):
+        mark = watermark.create_watermark(
+            (canvas_w, canvas_h),
+            logo_path=p.get("watermark_logo") or None,
+            text=p.get("watermark_text", ""),
+            scale_pct=p.get("watermark_scale_pct", 15),
+            opacity=p.get("watermark_opacity", 60),
+            text_color=p.get("watermark_text_color", "白色"),
+            font_path=p.get("banner_font") or None,
+        )
+        if mark is not None:
+            pos = watermark.watermark_position((canvas_w, canvas_h), (mark.shape[1], mark.shape[0]),
+                                               p.get("watermark_position", "右下"),
+                                               p.get("watermark_margin_pct", 3))
+            overlays.append((mark, pos))
+
+    # --- 6. 融合合成：背景 -> 阴影 -> 前景 -> 信息条，一次遍历写入输出缓冲区 ---
+    # 前景位置换算为画布坐标 (去掉安全边距)
+    with telemetry.stage("composite"):
+        out = compositor.composite(
+            (canvas_w, canvas_h),
+            background=bg_arr,
+            shadow_alpha=sh_arr,
+            foreground=fg_arr,
+            fg_pos=(geo["fg_x"] - pad, geo["fg_y"] - pad),
+            overlays=overlays,
+        )
+    return Image.fromarray(out) # 直接由输出缓冲区构造结果图像
+
+
+# ---------- 多目标导出 ----------
+def process_multi_target(img, p, ratios, meta=None):
+    """
+    一次性为同一张图渲染多个画面比例的输出。
+
+    各目标共享：
+    - 模式统一后的源图；
+    - 圆角前景 (圆角半径只与原图尺寸有关，各比例相同)；
+    - 一张覆盖所有目标画布的模糊背景，各目标从中心裁剪所需区域。
+    因此每多一个目标只增加一次裁剪、一次阴影和一次合成。
+
+    注意: 背景按覆盖尺寸取景后再中心裁剪，取景比单独导出时略大，
+    模糊后的背景观感一致，但与逐个比例单独导出的像素不完全相同。
+
+    Args:
+        img (PIL.Image): 输入图像。
+        p (dict): 参数字典 (其中的 "ratio" 会被各目标比例覆盖)。
+        ratios (list): 目标比例列表，元素为 None (原图比例) 或 (宽, 高)。
+        meta (dict): 相机/镜头元数据，可为 None。
+
+    Returns:
+        list: 与 ratios 对应的 PIL.Image 列表。
+    """
+    if img is None or not ratios:
+        return [process_single_image(img, p, meta) for _ in ratios]
+    src = modes.normalize_source(img)
+    src, p = apply_output_cap(src, p, ratios)
+    ow, oh = src.size
+
+    targets = []
+    for ratio in ratios:
+        tp = p.copy()
+        tp["ratio"] = ratio
+        targets.append((tp, resolve_geometry(ow, oh, tp)))
+
+    # --- 共享前景：圆角只做一次 ---
+    cr_px = targets[0][1]["corner_radius_px"]
+    fg_img = registry.run_stage("corners", src, cr_px, backend=p.get("render_backend"))
+
+    # --- 共享背景：按所有目标画布的外接尺寸生成一次 ---
+    # (主色/渐变背景成本很低且需与各自画布四角对齐，由每个目标单独生成)
+    cover = None
+    if p.get("background_enabled") and p.get("background_mode", palette.MODE_BLUR) == palette.MODE_BLUR:
+        cover_w = max(geo["canvas_w"] for _, geo in targets)
+        cover_h = max(geo["canvas_h"] for _, geo in targets)
+        cover = render_background(src, (cover_w, cover_h), p)
+
+    results = []
+    for tp, geo in targets:
+        layers = {"foreground": fg_img}
+        if cover is not None:
+            cw, ch = geo["canvas_w"], geo["canvas_h"]
+            left = (cover.width - cw) // 2
+            top = (cover.height - ch) // 2
+            layers["background"] = cover.crop((left, top, left + cw, top + ch))
+        # 背景已预先生成，共享图层只需阴影与圆角遮罩 (轮廓阴影逐图生成，也不需要矩形阴影)
+        tp_shared = dict(tp, background_enabled=False)
+        if uses_contour_shadow(src, tp):
+            tp_shared["shadow_enabled"] = False
+        results.append(process_single_image(
+            src, tp, meta, shared=build_shared_layers(geo, tp_shared), layers=layers))
+    return results
 
 
 # ---------- 批量处理 ----------
-def process_all_images(images, params, max_workers: int = 4):
+class SharedLayerCache:
     """
-    使用线程池并行处理多张图像。
+    批处理内按几何分组缓存共享图层。
+    每组只由第一个到达的任务生成一次，其余任务等待并只读复用；不同组之间互不阻塞。
+    只保留最近使用的 max_groups 组，更早的分组被丢弃 (正在使用它的任务仍持有引用)，
+    之后再遇到该几何时重新生成。
+
+    Args:
+        params (dict): 渲染参数。
+        max_groups (int): 保留的分组数，None 时取 SHARED_LAYER_GROUPS。
+    """
+
+    def __init__(self, params, max_groups=None):
+        self._params = params
+        self.max_groups = max(1, SHARED_LAYER_GROUPS if max_groups is None else max_groups)
+        self._layers = OrderedDict()
+        self._locks = {}
+        self._guard = threading.Lock()
+        self.built = 0
+
+    def get(self, geo, contour=False):
+        """
+        返回该几何的共享图层。contour 为真 (该图使用轮廓阴影) 时单独分组，不生成矩形阴影。
+        """
+        key = (geometry_key(geo), bool(contour))
+        with self._guard:
+            layers = self._layers.get(key)
+            if layers is not None:
+                self._layers.move_to_end(key)
+                return layers
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            with self._guard:
+                layers = self._layers.get(key)
+            if layers is None:
+                p = dict(self._params, shadow_enabled=False) if contour else self._params
+                layers = build_shared_layers(geo, p)
+                with self._guard:
+                    self._layers[key] = layers
+                    self.built += 1
+                    while len(self._layers) > self.max_groups:
+                        old, _ = self._layers.popitem(last=False)
+                        self._locks.pop(old, None)
+            return layers
+
+    def group_count(self):
+        """返回当前保留的几何分组数量。"""
+        with self._guard:
+            return len(self._layers)
+
+
+def _process_with_shared(img, p, meta, cache):
+    """批处理任务：解析几何后从分组缓存取共享图层，再渲染。"""
+    if img is None:
+        return process_single_image(img, p, meta)
+    job_limits.check_pixels(img.size)
+    src = modes.normalize_source(img)
+    src, p = apply_output_cap(src, p)
+    geo = resolve_geometry(src.width, src.height, p)
+    job_limits.check_canvas(geo)
+    return process_single_image(src, p, meta, shared=cache.get(geo, uses_contour_shadow(src, p)))
+
+
+def _process_chunk(images, p, metas):
+    """
+    进程池任务：在子进程内依次处理一组连续的图片，组内共享图层。
+    返回 (结果列表, 每张的耗时列表, 每张的异常或 None 列表, 进程标识)。
+    """
+    cache = SharedLayerCache(p)
+    out, seconds, errors = [], [], []
+    for img, meta in zip(images, metas):
+        t0 = time.perf_counter()
+        try:
+            out.append(_process_with_shared(img, p, meta, cache))
+            errors.append(None)
+        except Exception as e:
+            out.append(None)
+            errors.append(e)
+        seconds.append(time.perf_counter() - t0)
+    return out, seconds, errors, f"process-{os.getpid()}"
+
+
+# 隔离模式子进程内的共享图层缓存 (参数变化时重建)
+_isolated_cache = {"params": None, "cache": None}
+
+
+def _isolated_task(img, p, meta):
+    """隔离模式任务 (在子进程中运行)：处理一张图片，返回 (结果, 耗时, 进程标识)。"""
+    if _isolated_cache["params"] != p:
+        _isolated_cache.update(params=p, cache=SharedLayerCache(p))
+    t0 = time.perf_counter()
+    out = _process_with_shared(img, p, meta, _isolated_cache["cache"])
+    return out, time.perf_counter() - t0, f"isolated-{os.getpid()}"
+
+
+def _measured_task(metrics, img, p, meta, cache):
+    """线程池任务：处理一张图片并记录耗时、阶段统计与失败类型。"""
+    metrics.dequeued()
+    worker = threading.current_thread().name
+    t0 = time.perf_counter()
+    with telemetry.bind(metrics):
+        try:
+            out = _process_with_shared(img, p, meta, cache)
+        except Exception as e:
+            metrics.image_done(worker, time.perf_counter() - t0, e)
+            raise
+    metrics.image_done(worker, time.perf_counter() - t0)
+    return out
+
+
+def _bounded_submit(pool, jobs, submit, limit):
+    """
+    按完成顺序产出 (任务标识, future)，同时在途的任务不超过 limit 个。
+    jobs 为惰性迭代器，只在有空位时才取下一个任务 (不会提前读取/解码全部输入)。
+    """
+    pending = {}
+    jobs = iter(jobs)
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < limit:
+                job = next(jobs, None)
+                if job is None:
+                    exhausted = True
+                    break
+                pending[submit(pool, job)] = job
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future
+    finally:
+        # 调用方提前结束迭代时取消尚未开始的任务
+        for future in pending:
+            future.cancel()
+
+
+def iter_process_images(images, params, max_workers=None, metadata=None, executor=None,
+                        metrics=None, prefetch=None, timeout=None):
+    """
+    并行处理多张图像，按完成顺序逐张产出结果 (生成器)。
+    慢图片不会阻塞其他结果；调用方拿到结果后即可编码/写出并释放，内存按张回收。
+
+    Args:
+        images (iterable): PIL.Image 的可迭代对象 (可以是惰性生成器)。
+        params (dict): 应用于所有图像的参数字典。
+        max_workers (int): 最大并发数，None 时取校准配置。
+        metadata (iterable): 与 images 一一对应的元数据 (可选)。
+        executor (str): "thread"、"process" 或 "isolated"，None 时取校准配置。
+            "isolated" 每张图片在独立子进程中渲染，超时与崩溃只影响该图片。
+        metrics (telemetry.BatchMetrics): 批次指标对象，None 时新建。
+        prefetch (int): 同时在途 (已提交未取走) 的最大图片数，None 时为并发数的 2 倍。
+            进程池模式下按分块计数。
+        timeout (float): 隔离模式下单张渲染的超时 (秒)，None 取 job_limits.RENDER_TIMEOUT。
+            线程无法被强制终止，其他模式下不生效。
+
+    Yields:
+        tuple: (输入下标, 结果)，结果为 PIL.Image，处理失败时为异常对象。
+    """
+    p = params.copy()
+    workers, kind = calibration.pool_settings(max_workers, executor)
+    limit = max(1, prefetch or workers * 2)
+    metas = iter(metadata) if metadata is not None else None
+    metrics = (metrics or telemetry.BatchMetrics(f"批处理 ({kind} x{workers})")).start()
+
+    rejected = []
+
+    def inputs():
+        for index, img in enumerate(images):
+            meta = next(metas, None) if metas is not None else None
+            try:
+                # 解码前检查像素数 (惰性打开的图片此时尚未读取像素)，超限的不提交
+                if img is not None:
+                    job_limits.check_pixels(img.size)
+            except job_limits.JobLimitError as e:
+                metrics.image_done("precheck", 0.0, e, pool=kind)
+                rejected.append((index, e))
+                continue
+            yield index, img, meta
+
+    def drain_rejected():
+        while rejected:
+            yield rejected.pop(0)
+
+    try:
+        if kind == "isolated":
+            def submit(pool, job):
+                index, img, meta = job
+                metrics.queued()
+                return pool.submit(_isolated_task, img, p, meta)
+
+            timeout = job_limits.RENDER_TIMEOUT if timeout is None else timeout
+            with job_limits.IsolatedPool(workers, timeout=timeout) as pool:
+                for (index, _, _), future in _bounded_submit(pool, inputs(), submit, limit):
+                    metrics.dequeued()
+                    try:
+                        out, dt, worker = future.result()
+                    except Exception as e:
+                        metrics.image_done("isolated", 0.0, e, pool="isolated")
+                        yield index, e
+                    else:
+                        metrics.image_done(worker, dt, pool="isolated")
+                        yield index, out
+                    yield from drain_rejected()
+            yield from drain_rejected()
+            return
+
+        if kind == "process":
+            # 进程池：连续的若干张为一块 (同几何的图片通常相邻)，每块在子进程内共享图层
+            chunk = max(1, math.ceil(limit / workers))
+
+            def chunks():
+                buf = []
+                for item in inputs():
+                    buf.append(item)
+                    if len(buf) == chunk:
+                        yield buf
+                        buf = []
+                if buf:
+                    yield buf
+
+            def submit(pool, job):
+                metrics.queued()
+                return pool.submit(_process_chunk, [img for _, img, _ in job], p, [m for _, _, m in job])
+
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for job, future in _bounded_submit(pool, chunks(), submit, max(1, limit // chunk)):
+                    metrics.dequeued()
+                    try:
+                        out, seconds, errors, worker = future.result()
+                    except Exception as e:
+                        out, seconds, errors, worker = [None] * len(job), [0.0] * len(job), [e] * len(job), "process"
+                    for (index, _, _), res, dt, err in zip(job, out, seconds, errors):
+                        metrics.image_done(worker, dt, err, pool="process")
+                        yield index, err if err is not None else res
+                    yield from drain_rejected()
+            yield from drain_rejected()
+            return
+
+        shared_cache = SharedLayerCache(p)
+
+        def submit(pool, job):
+            index, img, meta = job
+            metrics.queued()
+            return pool.submit(_measured_task, metrics, img, p, meta, shared_cache)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for (index, _, _), future in _bounded_submit(pool, inputs(), submit, limit):
+                try:
+                    yield index, future.result()
+                except Exception as e:
+                    yield index, e
+                yield from drain_rejected()
+        yield from drain_rejected()
+    finally:
+        metrics.finish()
+
+
+def process_all_images(images, params, max_workers=None, metadata=None, executor=None, metrics=None,
+                       timeout=None):
+    """
+    使用线程池 (或进程池) 并行处理多张图像，结果按输入顺序返回。
+    基于 `iter_process_images`；需要逐张处理结果时直接使用后者。
+    按解析后的几何量分组，同组图片 (同尺寸同参数) 的阴影层、圆角遮罩和蒙版层只计算一次。
 
     Args:
         images (list): 包含 PIL.Image 对象的列表。
         params (dict): 应用于所有图像的参数字典。
-        max_workers (int): 线程池的最大工作线程数。
+        max_workers (int): 最大并发数，None 时取校准配置 (默认 4)。
+        metadata (list): 与 images 一一对应的元数据列表 (可选)，用于参数信息条。
+        executor (str): "thread"、"process" 或 "isolated"，None 时取校准配置 (默认线程池)。
+        metrics (telemetry.BatchMetrics): 批次指标对象，None 时新建；结束后可用
+            telemetry.last_batch() 获取。进程池模式下各阶段耗时在子进程中，不计入。
+        timeout (float): 隔离模式下单张渲染的超时 (秒)。
 
     Returns:
         list: 包含处理后 PIL.Image 对象（或处理失败时的 None）的列表，顺序与输入一致。
     """
-    results = [] # 用于存储结果，保持顺序
-    # 使用线程池执行器
-    with ThreadPoolExecutor(max_workers=max_workers) as pool:
-        # 提交所有任务：为每张图片调用 process_single_image
-        # 使用字典将 future 映射到原始索引，以便按顺序组合结果
-        futures = {pool.submit(process_single_image, img, params.copy()): i for i, img in enumerate(images)}
-
-        # 创建一个列表来按索引存储结果
-        result_map = [None] * len(images)
-
-        # 处理已完成的 future
-        for future in futures:
-            index = futures[future] # 获取原始索引
-            try:
-                # 获取任务结果，如果任务抛出异常，这里会重新抛出
-                result_map[index] = future.result()
-            except Exception as e:
-                # 捕获处理单张图片时可能发生的异常
-                print(f"处理图片索引 {index} 时出错: {e}")
-                result_map[index] = None # 标记该图片处理失败
-
-        results = result_map # 将按顺序排列的结果赋给 results
-
-    return results
\ No newline at end of file
+    images = list(images)
+    results = [None] * len(images) # 按索引存储结果，保持顺序
+    # 全部结果都要保留，在途数量不必限制
+    for index, res in iter_process_images(images, params, max_workers, metadata, executor,
+                                          metrics, prefetch=max(1, len(images)), timeout=timeout):
+        if isinstance(res, Exception):
+            # 捕获处理单张图片时可能发生的异常
+            print(f"处理图片索引 {index} 时出错: {res}")
+            res = None # 标记该图片处理失败
+        results[index] = res
+    return results
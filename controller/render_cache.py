@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+渲染结果缓存 (render_cache.py)
+-------------------------------------------------
+把导出时编码好的结果文件按内容寻址保存在磁盘上，再次导出相同的原图与参数时
+直接复制文件，不再渲染和编码。
+
+设计要点:
+1.  缓存键 = blake2b(原图像素哈希, 规范化参数, 编码设置, 额外标识, RENDER_VERSION, 生效的后端)。
+    - 原图哈希基于像素而非文件名，改名后依然命中；
+    - 参数以 sort_keys 的 JSON 规范化，字典顺序不影响结果；
+    - 启用参数信息条时元数据也参与计算 (信息条内容取决于元数据)。
+2.  每个条目是 `<根目录>/<键前两位>/<键>.<扩展名>` 一个文件，写入先写临时文件再 os.replace，
+    中途崩溃不会留下残缺条目。
+3.  命中时更新文件 mtime，总大小超过上限时按 mtime 从旧到新删除 (LRU)。
+4.  `RENDER_VERSION` 随渲染结果变化 (算法修改) 而递增，旧条目自然失效并被逐步淘汰。
+5.  启用水印时 Logo 文件的大小与修改时间也参与计算，替换 Logo 文件后旧结果失效。
+6.  各渲染阶段实际生效的后端 (registry.effective_backends，含校准按模糊半径选择的背景模糊方法)
+    也计入缓存键：重新校准或在校准配置不同的机器上，不会命中另一种模糊方法渲染的结果。
+    该项只进入 `RenderCache.key`，不进入 `params_digest` (监视目录清单等按参数判断是否重新处理)。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import uuid
+import numpy as np
+from model import registry
+
+# 渲染算法版本，修改会影响输出像素的渲染代码时递增
+RENDER_VERSION = 1
+
+# 默认缓存目录与容量上限，可用环境变量覆盖
+DEFAULT_CACHE_DIR = os.environ.get("BGF_RENDER_CACHE", os.path.join("cache", "renders"))
+DEFAULT_MAX_MB = int(os.environ.get("BGF_RENDER_CACHE_MB", "2048"))
+
+# 默认编码设置
+PNG_ENCODER = ("PNG", {})
+
+
+def image_digest(img):
+    """
+    计算图像像素内容的 blake2b 哈希 (包含模式、尺寸，以及调色板与透明色)。
+    ImageStore 写出后映射回来的 RGBX 图像与原 RGB 图像哈希相同。
+    """
+    mode = "RGB" if img.mode == "RGBX" else img.mode
+    arr = np.asarray(img)
+    if img.mode == "RGBX":
+        arr = arr[..., :3]
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f"{mode}:{img.width}x{img.height}:".encode())
+    h.update(np.ascontiguousarray(arr).data)
+    # 调色板模式的像素只是索引，颜色取决于调色板；透明色 (tRNS) 同样影响渲染结果
+    palette = img.getpalette() if img.mode in ("P", "PA") else None
+    if palette is not None:
+        h.update(b"palette:" + bytes(palette))
+    transparency = img.info.get("transparency")
+    if transparency is not None:
+        h.update(f"transparency:{transparency!r}".encode())
+    return h.hexdigest()
+
+
+def _asset_stamp(params):
+    """参数引用的外部素材文件 (水印 Logo) 的 (路径, 大小, 修改时间)。"""
+    path = params.get("watermark_logo") if params.get("watermark_enabled") else None
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [path, None, None]
+    return [path, st.st_size, st.st_mtime_ns]
+
+
+def params_digest(params, meta=None, encoder=PNG_ENCODER, extra=None):
+    """计算参数、编码设置等渲染条件的规范化哈希。"""
+    payload = {
+        "version": RENDER_VERSION,
+        "params": params,
+        "meta": meta if params.get("banner_enabled") else None,
+        "encoder": [encoder[0], encoder[1]],
+        "extra": extra,
+        "assets": _asset_stamp(params),
+    }
+    text = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=repr)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=20).hexdigest()
+
+
+class RenderCache:
+    """
+    基于文件的渲染结果缓存，容量超限时按最近使用时间淘汰。
+
+    Args:
+        root (str): 缓存目录。
+        max_mb (int): 容量上限 (MB)。
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_mb=DEFAULT_MAX_MB):
+        self.root = root
+        self.max_bytes = max(0, int(max_mb)) * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._sizes = None   # 键 -> (文件大小, 扩展名)，首次使用时扫描目录建立
+        self._total = 0
+
+    # ---------- 键与路径 ----------
+
+    @staticmethod
+    def key(source_digest, params, meta=None, encoder=PNG_ENCODER, extra=None):
+        """由原图哈希、渲染条件与各阶段实际生效的后端组合出缓存键。"""
+        cond = params_digest(params, meta, encoder, extra)
+        backends = registry.effective_backends(params.get("render_backend"),
+                                               {"background": params.get("background_blur", 0)})
+        stamp = json.dumps(backends, sort_keys=True)
+        return hashlib.blake2b(f"{source_digest}:{cond}:{stamp}".encode(), digest_size=20).hexdigest()
+
+    def _path(self, key, ext="png"):
+        return os.path.join(self.root, key[:2], f"{key}.{ext}")
+
+    def _scan(self):
+        """建立 键 -> (大小, 扩展名) 的索引 (调用方持有锁)。"""
+        if self._sizes is not None:
+            return
+        self._sizes = {}
+        if os.path.isdir(self.root):
+            for sub in os.listdir(self.root):
+                d = os.path.join(self.root, sub)
+                if not os.path.isdir(d):
+                    continue
+                for name in os.listdir(d):
+                    key, ext = os.path.splitext(name)
+                    if ext == ".tmp":
+                        continue
+                    try:
+                        self._sizes[key] = (os.path.getsize(os.path.join(d, name)), ext[1:])
+                    except OSError:
+                        pass
+        self._total = sum(s for s, _ in self._sizes.values())
+
+    # ---------- 查询与写入 ----------
+
+    def get(self, key):
+        """命中时返回缓存文件路径 (并标记为最近使用)，未命中返回 None。"""
+        with self._lock:
+            self._scan()
+            entry = self._sizes.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            path = self._path(key, entry[1])
+            try:
+                os.utime(path)
+            except OSError:
+                # 文件已被外部删除
+                self._total -= entry[0]
+                del self._sizes[key]
+                self.misses += 1
+                return None
+            self.hits += 1
+            return path
+
+    def read(self, key):
+        """命中时返回缓存文件内容 (bytes)，未命中返回 None。"""
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, key, data, ext="png"):
+        """写入一个条目 (已编码的字节)，返回缓存文件路径。"""
+        path = self._path(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._scan()
+            old = self._sizes.get(key)
+            if old is not None:
+                self._total -= old[0]
+            self._sizes[key] = (len(data), ext)
+            self._total += len(data)
+            self._evict()
+        return path
+
+    def _evict(self):
+        """总大小超过上限时按 mtime 从旧到新删除 (调用方持有锁)。"""
+        if self._total <= self.max_bytes:
+            return
+        entries = []
+        for key, (size, ext) in self._sizes.items():
+            try:
+                entries.append((os.path.getmtime(self._path(key, ext)), key))
+            except OSError:
+                entries.append((0, key))
+        entries.sort()
+        for _, key in entries:
+            if self._total <= self.max_bytes:
+                break
+            size, ext = self._sizes.pop(key)
+            self._total -= size
+            try:
+                os.remove(self._path(key, ext))
+            except OSError:
+                pass
+
+    def clear(self):
+        """删除全部缓存条目并清零计数器。"""
+        with self._lock:
+            self._scan()
+            for key, (_, ext) in list(self._sizes.items()):
+                try:
+                    os.remove(self._path(key, ext))
+                except OSError:
+                    pass
+            self._sizes = {}
+            self._total = 0
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """返回条目数、总大小与命中统计。"""
+        with self._lock:
+            self._scan()
+            total = self.hits + self.misses
+            return {"entries": len(self._sizes), "bytes": self._total, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / total if total else 0.0}
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_cache():
+    """返回进程级共享的默认缓存实例。"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = RenderCache()
+        return _default_cache
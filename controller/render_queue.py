@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+"""
+持久化渲染队列 (render_queue.py)
+-------------------------------------------------
+把批量渲染拆成 (图片路径, 参数预设, 输出目录) 任务写入 SQLite 队列，任意数量的工作进程
+(本机或共享同一文件系统的其他主机) 以租约方式领取任务，经 export_jobs.render_file 渲染后标记完成。
+不依赖外部消息代理，一个数据库文件即是整个队列。
+
+设计要点:
+1.  表结构: presets 按参数哈希保存一次参数 JSON (同一批任务共用)；jobs 每行一张图片，
+    状态 queued -> leased -> done / failed。(status, lease_until) 上有索引，领取只走索引。
+2.  领取: `claim` 在 BEGIN IMMEDIATE 事务内选出排队中或租约已过期的任务，写入持有者与租约到期时间，
+    尝试次数 +1。写锁只在这一次短事务内持有，渲染在事务之外进行，
+    所以数据库开销与工作进程数无关，吞吐量随工作进程数线性增长，直到磁盘或 CPU 成为瓶颈。
+3.  租约: 工作进程渲染期间由心跳线程每 lease/3 秒续租；进程崩溃或主机掉线后续租停止，
+    租约到期的任务被下一次 `claim` 重新领取。尝试次数达到 max_attempts 仍未完成的任务标记为失败。
+4.  完成/失败只更新仍由自己持有的任务 (持有者匹配)，租约已被他人接管的旧工作进程不会覆盖结果；
+    输出文件先写临时文件再替换，重复渲染同一任务也是幂等的。
+5.  超出像素/内存上限 (job_limits.JobLimitError) 的任务不重试，直接标记失败。
+
+共享文件系统上的注意事项:
+- WAL 模式依赖同一主机上的共享内存，多主机共用队列时请设置 BGF_QUEUE_JOURNAL=DELETE
+  (或 --journal DELETE)，并确认文件系统的 POSIX 锁可靠 (NFSv4 等)。
+- 租约使用墙上时钟，各主机需要时间同步 (NTP)。
+
+用法:
+    python -m controller.render_queue enqueue --output /mnt/share/framed --preset presets/douyin.json /mnt/share/shoots
+    python -m controller.render_queue work --processes 8
+    python -m controller.render_queue status
+    python -m controller.render_queue retry      # 失败的任务重新排队
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import threading
+import time
+from controller import export_jobs, job_limits, render_cache
+from controller.watch_daemon import IMAGE_EXTS, load_preset
+from Read import metaCache
+
+DEFAULT_DB = os.environ.get("BGF_QUEUE_DB", os.path.join("cache", "render_queue.sqlite"))
+
+# 日志模式: 单机用 WAL；多主机共享数据库时用 DELETE
+JOURNAL_MODE = os.environ.get("BGF_QUEUE_JOURNAL", "WAL")
+
+# 默认租约时长 (秒) 与最大尝试次数
+LEASE_SECONDS = float(os.environ.get("BGF_QUEUE_LEASE", "120"))
+MAX_ATTEMPTS = int(os.environ.get("BGF_QUEUE_MAX_ATTEMPTS", "3"))
+
+STATUS_QUEUED = "queued"
+STATUS_LEASED = "leased"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+def worker_identity():
+    """工作进程标识: 主机名:进程号。"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class RenderQueue:
+    """
+    SQLite 渲染队列。
+
+    Args:
+        path (str): 数据库文件路径。
+        journal (str): SQLite 日志模式 (WAL / DELETE)。
+    """
+
+    def __init__(self, path=DEFAULT_DB, journal=JOURNAL_MODE):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        # isolation_level=None: 事务由本类显式控制 (BEGIN IMMEDIATE)；timeout 为等待写锁的时长
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute(f"PRAGMA journal_mode={journal}")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS presets ("
+            " digest TEXT PRIMARY KEY, params TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " path TEXT NOT NULL, output TEXT NOT NULL, preset TEXT NOT NULL,"
+            " status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL,"
+            " owner TEXT, lease_until REAL, outputs TEXT, error TEXT,"
+            " created REAL NOT NULL, started REAL, finished REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, lease_until)")
+        self._params = {}
+
+    def _write(self, fn):
+        """在 BEGIN IMMEDIATE 事务内执行 fn(conn)，返回其结果。"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    # ---------- 生产者 ----------
+
+    def enqueue(self, items, params, max_attempts=MAX_ATTEMPTS):
+        """
+        批量加入任务。
+
+        Args:
+            items (list): [(图片路径, 输出目录)]。
+            params (dict): 渲染参数 (同一批任务共用一份)。
+            max_attempts (int): 每个任务的最大尝试次数。
+
+        Returns:
+            int: 加入的任务数。
+        """
+        digest = render_cache.params_digest(params)
+        blob = json.dumps(params, ensure_ascii=False, sort_keys=True, default=list)
+        now = time.time()
+        rows = [(os.path.abspath(path), os.path.abspath(out), digest, STATUS_QUEUED, max_attempts, now)
+                for path, out in items]
+
+        def fn(conn):
+            conn.execute("INSERT OR IGNORE INTO presets (digest, params) VALUES (?, ?)", (digest, blob))
+            conn.executemany(
+                "INSERT INTO jobs (path, output, preset, status, max_attempts, created) VALUES (?, ?, ?, ?, ?, ?)",
+                rows)
+            return len(rows)
+        return self._write(fn)
+
+    # ---------- 工作进程 ----------
+
+    def claim(self, owner, limit=1, lease=LEASE_SECONDS):
+        """
+        领取最多 limit 个任务 (排队中或租约已过期)。
+
+        Returns:
+            list: [{"id", "path", "output", "preset", "attempts"}]。
+        """
+        def fn(conn):
+            now = time.time()
+            # 租约过期且尝试次数已用完的任务不再重试
+            conn.execute(
+                "UPDATE jobs SET status=?, owner=NULL, lease_until=NULL, finished=?,"
+                " error=COALESCE(error, '租约多次过期 (工作进程崩溃或超时)')"
+                " WHERE status=? AND lease_until<? AND attempts>=max_attempts",
+                (STATUS_FAILED, now, STATUS_LEASED, now))
+            rows = conn.execute(
+                "SELECT id, path, output, preset, attempts FROM jobs"
+                " WHERE status=? OR (status=? AND lease_until<?) ORDER BY id LIMIT ?",
+                (STATUS_QUEUED, STATUS_LEASED, now, int(limit))).fetchall()
+            if not rows:
+                return []
+            ids = [r[0] for r in rows]
+            marks = ",".join("?" * len(ids))
+            conn.execute(
+                f"UPDATE jobs SET status=?, owner=?, lease_until=?, attempts=attempts+1, started=?"
+                f" WHERE id IN ({marks})",
+                [STATUS_LEASED, owner, now + lease, now] + ids)
+            return [{"id": r[0], "path": r[1], "output": r[2], "preset": r[3], "attempts": r[4] + 1}
+                    for r in rows]
+        return self._write(fn)
+
+    def params_for(self, digest):
+        """按参数哈希读取参数 (进程内缓存)。"""
+        if digest not in self._params:
+            with self._lock:
+                row = self._conn.execute("SELECT params FROM presets WHERE digest=?", (digest,)).fetchone()
+            if row is None:
+                raise KeyError(f"队列中没有参数预设 {digest}")
+            params = json.loads(row[0])
+            if isinstance(params.get("ratio"), list):
+                params["ratio"] = tuple(params["ratio"])
+            self._params[digest] = params
+        return self._params[digest]
+
+    def renew(self, ids, owner, lease=LEASE_SECONDS):
+        """续租仍由 owner 持有的任务，返回续租成功的数量。"""
+        if not ids:
+            return 0
+        ids = list(ids)
+        marks = ",".join("?" * len(ids))
+        return self._write(lambda conn: conn.execute(
+            f"UPDATE jobs SET lease_until=? WHERE owner=? AND status=? AND id IN ({marks})",
+            [time.time() + lease, owner, STATUS_LEASED] + ids).rowcount)
+
+    def complete(self, job_id, owner, outputs):
+        """标记完成；租约已被他人接管时返回 False。"""
+        return self._write(lambda conn: conn.execute(
+            "UPDATE jobs SET status=?, owner=NULL, lease_until=NULL, outputs=?, error=NULL, finished=?"
+            " WHERE id=? AND owner=? AND status=?",
+            (STATUS_DONE, json.dumps(outputs, ensure_ascii=False), time.time(), job_id, owner, STATUS_LEASED)
+        ).rowcount == 1)
+
+    def fail(self, job_id, owner, error, retry=True):
+        """记录失败：还有尝试次数且 retry 为真时重新排队，否则标记失败。"""
+        return self._write(lambda conn: conn.execute(
+            "UPDATE jobs SET status=CASE WHEN ? AND attempts<max_attempts THEN ? ELSE ? END,"
+            " owner=NULL, lease_until=NULL, error=?, finished=?"
+            " WHERE id=? AND owner=? AND status=?",
+            (1 if retry else 0, STATUS_QUEUED, STATUS_FAILED, str(error), time.time(),
+             job_id, owner, STATUS_LEASED)).rowcount == 1)
+
+    def release(self, ids, owner):
+        """归还已领取但尚未开始的任务 (不计入尝试次数)。"""
+        if not ids:
+            return 0
+        ids = list(ids)
+        marks = ",".join("?" * len(ids))
+        return self._write(lambda conn: conn.execute(
+            f"UPDATE jobs SET status=?, owner=NULL, lease_until=NULL, attempts=attempts-1"
+            f" WHERE owner=? AND status=? AND id IN ({marks})",
+            [STATUS_QUEUED, owner, STATUS_LEASED] + ids).rowcount)
+
+    # ---------- 管理 ----------
+
+    def stats(self, window=60.0):
+        """
+        队列统计。
+
+        Returns:
+            dict: {"counts": {状态: 数量}, "workers": 持有租约的工作进程数,
+                   "rate": 最近 window 秒的完成速度 (张/秒)}。
+        """
+        now = time.time()
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            workers = self._conn.execute(
+                "SELECT COUNT(DISTINCT owner) FROM jobs WHERE status=? AND lease_until>=?",
+                (STATUS_LEASED, now)).fetchone()[0]
+            recent = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status=? AND finished>=?",
+                (STATUS_DONE, now - window)).fetchone()[0]
+        return {"counts": counts, "workers": workers, "rate": recent / window}
+
+    def pending(self):
+        """尚未结束 (排队中或租约中) 的任务数。"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (STATUS_QUEUED, STATUS_LEASED)).fetchone()[0]
+
+    def retry_failed(self):
+        """失败的任务重新排队 (尝试次数清零)，返回数量。"""
+        return self._write(lambda conn: conn.execute(
+            "UPDATE jobs SET status=?, attempts=0, error=NULL, finished=NULL WHERE status=?",
+            (STATUS_QUEUED, STATUS_FAILED)).rowcount)
+
+    def purge_done(self):
+        """删除已完成的任务记录，返回数量。"""
+        return self._write(lambda conn: conn.execute(
+            "DELETE FROM jobs WHERE status=?", (STATUS_DONE,)).rowcount)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class QueueWorker:
+    """
+    队列工作进程：循环领取任务、渲染、标记完成，渲染期间由心跳线程续租。
+
+    Args:
+        queue (RenderQueue): 队列。
+        lease (float): 租约时长 (秒)。
+        batch (int): 每次领取的任务数；单张渲染很快时调大可减少数据库往返。
+        idle (float): 队列为空时的等待间隔 (秒)。
+        exit_when_empty (bool): 队列中没有未结束的任务时退出。
+    """
+
+    def __init__(self, queue, lease=LEASE_SECONDS, batch=1, idle=2.0, exit_when_empty=False):
+        self.queue = queue
+        self.lease = lease
+        self.batch = max(1, int(batch))
+        self.idle = idle
+        self.exit_when_empty = exit_when_empty
+        self.owner = worker_identity()
+        self.meta_cache = metaCache.get_cache()   # 参数信息条的元数据缓存 (进程共享)
+        self.processed = 0
+        self.failed = 0
+        self._held = set()
+        self._held_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def stop(self, *_):
+        self._stop.set()
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease / 3):
+            with self._held_lock:
+                ids = list(self._held)
+            try:
+                self.queue.renew(ids, self.owner, self.lease)
+            except sqlite3.Error as e:
+                print(f"[{self.owner}] 续租失败: {e}")
+
+    def _run_one(self, job):
+        try:
+            params = self.queue.params_for(job["preset"])
+            outputs = export_jobs.render_file(job["path"], job["output"], params, meta_cache=self.meta_cache)
+        except job_limits.JobLimitError as e:
+            print(f"[{self.owner}] 任务 {job['id']} 超出限制: {e}")
+            self.queue.fail(job["id"], self.owner, e, retry=False)
+            self.failed += 1
+            return
+        except Exception as e:
+            print(f"[{self.owner}] 任务 {job['id']} ({job['path']}) 失败: {e}")
+            self.queue.fail(job["id"], self.owner, e)
+            self.failed += 1
+            return
+        if self.queue.complete(job["id"], self.owner, outputs):
+            self.processed += 1
+        else:
+            print(f"[{self.owner}] 任务 {job['id']} 的租约已被接管，结果由新的持有者记录")
+
+    def run(self):
+        """运行直到 stop() (或队列为空且 exit_when_empty)。"""
+        beat = threading.Thread(target=self._heartbeat, daemon=True)
+        beat.start()
+        try:
+            while not self._stop.is_set():
+                jobs = self.queue.claim(self.owner, self.batch, self.lease)
+                if not jobs:
+                    if self.exit_when_empty and self.queue.pending() == 0:
+                        break
+                    self._stop.wait(self.idle)
+                    continue
+                with self._held_lock:
+                    self._held.update(j["id"] for j in jobs)
+                for i, job in enumerate(jobs):
+                    if self._stop.is_set():
+                        # 收到停止信号：归还尚未开始的任务
+                        self.queue.release([j["id"] for j in jobs[i:]], self.owner)
+                        break
+                    self._run_one(job)
+                    with self._held_lock:
+                        self._held.discard(job["id"])
+                with self._held_lock:
+                    self._held.clear()
+        finally:
+            self._stop.set()
+            beat.join()
+        return self.processed, self.failed
+
+
+def _worker_process(db, journal, lease, batch, idle, exit_when_empty):
+    """子进程入口：各自打开数据库连接运行一个 QueueWorker。"""
+    queue = RenderQueue(db, journal)
+    worker = QueueWorker(queue, lease=lease, batch=batch, idle=idle, exit_when_empty=exit_when_empty)
+    signal.signal(signal.SIGINT, worker.stop)
+    signal.signal(signal.SIGTERM, worker.stop)
+    processed, failed = worker.run()
+    queue.close()
+    print(f"[{worker.owner}] 退出，完成 {processed} 张，失败 {failed} 张")
+
+
+def run_workers(processes, db=DEFAULT_DB, journal=JOURNAL_MODE, lease=LEASE_SECONDS, batch=1,
+                idle=2.0, exit_when_empty=False):
+    """在本机启动 processes 个工作进程并等待其退出 (Ctrl+C 时各进程处理完当前图片后退出)。"""
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_worker_process, args=(db, journal, lease, batch, idle, exit_when_empty))
+             for _ in range(max(1, int(processes)))]
+    for p in procs:
+        p.start()
+
+    def forward(signum, _frame):
+        for p in procs:
+            if p.is_alive():
+                os.kill(p.pid, signum)
+    signal.signal(signal.SIGINT, forward)
+    signal.signal(signal.SIGTERM, forward)
+    for p in procs:
+        p.join()
+
+
+def collect_items(paths, output):
+    """
+    展开输入路径为 [(图片路径, 输出目录)]：目录递归查找图片，
+    输出目录按 output/<目录名>/<相对路径> 镜像 (与监视目录守护进程一致)。
+    """
+    items = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            for dirpath, _, files in os.walk(path):
+                rel = os.path.relpath(dirpath, path)
+                out_dir = os.path.normpath(os.path.join(output, os.path.basename(path), rel))
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTS):
+                        items.append((os.path.join(dirpath, name), out_dir))
+        elif os.path.isfile(path):
+            items.append((path, output))
+        else:
+            print(f"跳过不存在的路径: {path}")
+    return items
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="持久化渲染队列 (生产者 / 工作进程 / 状态)。")
+    parser.add_argument("--db", default=DEFAULT_DB, help="队列数据库路径")
+    parser.add_argument("--journal", default=JOURNAL_MODE, help="SQLite 日志模式 (多主机共享时用 DELETE)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_enq = sub.add_parser("enqueue", help="加入任务")
+    p_enq.add_argument("paths", nargs="+", help="图片文件或目录")
+    p_enq.add_argument("--output", required=True, help="输出目录")
+    p_enq.add_argument("--preset", help="参数预设 JSON 文件")
+    p_enq.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS, help="最大尝试次数")
+
+    p_work = sub.add_parser("work", help="运行工作进程")
+    p_work.add_argument("--processes", type=int, default=1, help="本机启动的工作进程数")
+    p_work.add_argument("--lease", type=float, default=LEASE_SECONDS, help="租约时长 (秒)")
+    p_work.add_argument("--batch", type=int, default=1, help="每次领取的任务数")
+    p_work.add_argument("--idle", type=float, default=2.0, help="队列为空时的等待间隔 (秒)")
+    p_work.add_argument("--exit-when-empty", action="store_true", help="队列处理完后退出")
+
+    sub.add_parser("status", help="查看队列状态")
+    sub.add_parser("retry", help="失败的任务重新排队")
+    sub.add_parser("purge", help="删除已完成的任务记录")
+    args = parser.parse_args(argv)
+
+    if args.command == "work":
+        run_workers(args.processes, args.db, args.journal, args.lease, args.batch, args.idle,
+                    args.exit_when_empty)
+        return
+
+    queue = RenderQueue(args.db, args.journal)
+    try:
+        if args.command == "enqueue":
+            items = collect_items(args.paths, args.output)
+            n = queue.enqueue(items, load_preset(args.preset), args.max_attempts)
+            print(f"已加入 {n} 个任务")
+        elif args.command == "status":
+            s = queue.stats()
+            counts = "，".join(f"{k} {v}" for k, v in sorted(s["counts"].items())) or "空"
+            print(f"任务: {counts}；活跃工作进程 {s['workers']}；最近一分钟 {s['rate']:.2f} 张/秒")
+        elif args.command == "retry":
+            print(f"已重新排队 {queue.retry_failed()} 个任务")
+        elif args.command == "purge":
+            print(f"已删除 {queue.purge_done()} 条已完成记录")
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+参数扫描 (sweep.py)
+-------------------------------------------------
+同一张图片按参数网格渲染多个变体，用于挑选样式：可拼成对比图 (contact sheet)，或分别导出。
+
+设计要点:
+1.  `expand_grid` 由基础参数和若干扫描轴 [(参数键, [取值...])] 展开为全部组合；
+    第一个轴为对比图的行，其余轴的组合为列。
+2.  `render_sweep` 按变体依次渲染，但各图层按其真正依赖的参数记忆化，变体之间取值相同即复用：
+    - 背景: 只依赖画布尺寸、背景模式、模糊半径、缩放与后端，先生成不带蒙版的背景，
+      蒙版 (颜色/不透明度) 逐变体叠加，所以扫描蒙版时模糊只做一次；
+    - 阴影 alpha: 依赖几何量与不透明度，扫描背景参数时所有变体共用一份；
+    - 圆角遮罩与圆角前景: 依赖原图尺寸与圆角半径；
+    - 颜色蒙版层、输出尺寸上限缩小后的源图同理。
+    因此 4×4 的背景模糊 × 蒙版扫描只做 4 次模糊、1 次阴影，其余只剩蒙版混合与合成。
+3.  `scale` < 1 时 (对比图) 源图只缩小一次，像素参数按 scale_params 同步缩放，与预览一致。
+"""
+
+import io
+import itertools
+import os
+import zipfile
+from PIL import Image, ImageDraw
+from model import registry, modes, background, banner
+from controller import processing_controller
+
+# 界面可选的扫描参数: 参数键 -> 显示名
+SWEEP_AXES = {
+    "background_blur": "背景模糊半径",
+    "background_mask": "背景蒙版",
+    "background_mask_opacity": "蒙版不透明度",
+    "background_mode": "背景模式",
+    "background_scale": "背景缩放",
+    "shadow_blur": "阴影模糊",
+    "shadow_spread": "阴影扩散",
+    "shadow_opacity": "阴影不透明度",
+    "corner_radius_pct": "圆角(%)",
+}
+
+# 单次扫描的最大变体数
+MAX_VARIANTS = 64
+
+
+def expand_grid(base_params, axes):
+    """
+    展开参数网格。
+
+    Args:
+        base_params (dict): 基础参数。
+        axes (list): [(参数键, [取值...]), ...]，取值为空的轴被忽略。
+
+    Returns:
+        list: [{"params": 变体参数, "values": {参数键: 取值}, "label": 标签}]，
+              按行优先顺序 (第一个轴变化最慢)。
+    """
+    axes = [(key, list(values)) for key, values in axes if values]
+    variants = []
+    for combo in itertools.product(*(values for _, values in axes)):
+        values = dict(zip((key for key, _ in axes), combo))
+        label = "，".join(f"{SWEEP_AXES.get(k, k)} {v}" for k, v in values.items())
+        variants.append({"params": dict(base_params, **values), "values": values, "label": label})
+    if len(variants) > MAX_VARIANTS:
+        raise ValueError(f"扫描组合数 {len(variants)} 超过上限 {MAX_VARIANTS}")
+    return variants
+
+
+class _LayerMemo:
+    """按键记忆化图层，并统计生成/复用次数。"""
+
+    def __init__(self):
+        self._items = {}
+        self.built = {}
+        self.reused = {}
+
+    def get(self, kind, key, build):
+        full = (kind,) + tuple(key)
+        if full in self._items:
+            self.reused[kind] = self.reused.get(kind, 0) + 1
+        else:
+            self._items[full] = build()
+            self.built[kind] = self.built.get(kind, 0) + 1
+        return self._items[full]
+
+    def stats(self):
+        """返回 {图层类型: (生成次数, 复用次数)}。"""
+        kinds = set(self.built) | set(self.reused)
+        return {k: (self.built.get(k, 0), self.reused.get(k, 0)) for k in sorted(kinds)}
+
+
+def _masked_background(bg, p, overlay):
+    """在不带蒙版的共享背景上叠加本变体的颜色蒙版。"""
+    if overlay is None:
+        return bg
+    rgb = background.apply_mask(modes.ensure_mode(bg, "RGB"), p.get("background_mask", "无"),
+                                p.get("background_mask_opacity", 40), overlay)
+    return rgb.convert("RGBA")
+
+
+def render_sweep(img, base_params, axes, meta=None, scale=1.0):
+    """
+    渲染参数网格的全部变体，变体之间共享取值相同的图层。
+
+    Args:
+        img (PIL.Image): 原图。
+        base_params (dict): 基础参数。
+        axes (list): 扫描轴 [(参数键, [取值...])]。
+        meta (dict): 元数据 (参数信息条)。
+        scale (float): 渲染缩放比例 (<1 时用于快速生成对比图)。
+
+    Returns:
+        tuple: (变体列表，每项增加 "image" 键, 图层生成/复用统计)。
+    """
+    variants = expand_grid(base_params, axes)
+    memo = _LayerMemo()
+    src0 = modes.normalize_source(img)
+    if scale < 1.0:
+        src0 = src0.resize((max(1, int(src0.width * scale)), max(1, int(src0.height * scale))), Image.LANCZOS)
+
+    for v in variants:
+        p = v["params"]
+        if scale < 1.0:
+            p = processing_controller.scale_params(p, scale)
+        # 输出尺寸上限：相同缩放比例的变体共用缩小后的源图
+        cap = processing_controller.output_cap_scale(src0.size, p)
+        p = dict(p, output_max_edge=0)
+        src = src0
+        if cap is not None:
+            size = processing_controller._scaled_size(src0.size, cap)
+            src = memo.get("source", size,
+                           lambda: src0.resize(size, Image.LANCZOS, reducing_gap=3.0))
+            p = processing_controller.scale_params(p, cap)
+
+        geo = processing_controller.resolve_geometry(src.width, src.height, p)
+        gkey = processing_controller.geometry_key(geo)
+        backend = p.get("render_backend")
+        canvas = (geo["canvas_w"], geo["canvas_h"])
+        shared = {
+            "shadow_alpha": memo.get(
+                "shadow_alpha", (gkey, p.get("shadow_enabled"), p.get("shadow_opacity"), backend),
+                lambda: processing_controller.build_shadow_alpha(geo, p)),
+            "corner_mask": memo.get(
+                "corner_mask", (src.size, geo["corner_radius_px"]),
+                lambda: processing_controller.build_corner_mask(geo)),
+            "mask_overlay": memo.get(
+                "mask_overlay", (canvas, p.get("background_enabled"), p.get("background_mask"),
+                                 p.get("background_mask_opacity")),
+                lambda: processing_controller.build_mask_overlay(geo, p)),
+        }
+        layers = {
+            "foreground": memo.get(
+                "foreground", (src.size, geo["corner_radius_px"], backend),
+                lambda: registry.run_stage("corners", src, geo["corner_radius_px"],
+                                           mask=shared["corner_mask"], backend=backend)),
+        }
+        if p.get("background_enabled"):
+            bg = memo.get(
+                "background", (src.size, canvas, p.get("background_mode"), p.get("background_blur"),
+                               p.get("background_scale"), backend),
+                lambda: processing_controller.render_background(src, canvas, dict(p, background_mask="无")))
+            layers["background"] = _masked_background(bg, p, shared["mask_overlay"])
+        v["image"] = processing_controller.process_single_image(src, p, meta, shared=shared, layers=layers)
+    return variants, memo.stats()
+
+
+def _grid_shape(axes):
+    """对比图的 (行数, 列数)：第一个轴为行，其余轴的组合为列。"""
+    counts = [len(values) for _, values in axes if values]
+    if not counts:
+        return 1, 1
+    if len(counts) == 1:
+        return 1, counts[0]
+    cols = 1
+    for n in counts[1:]:
+        cols *= n
+    return counts[0], cols
+
+
+def contact_sheet(variants, axes, cell=360, gap=12, bg_color=(245, 245, 245)):
+    """
+    把变体拼成对比图，每格下方标注该变体的扫描取值。
+
+    Args:
+        variants (list): render_sweep 的结果 (行优先顺序)。
+        axes (list): 扫描轴，用于确定行列数。
+        cell (int): 每格图片的最长边 (像素)。
+        gap (int): 格间距 (像素)。
+
+    Returns:
+        PIL.Image: RGB 对比图。
+    """
+    rows, cols = _grid_shape(axes)
+    font_size = max(12, cell // 22)
+    font = banner.load_font(None, font_size)
+    n_lines = max(1, len([1 for _, values in axes if values]))
+    label_h = n_lines * (font_size + 2) + 8
+    sheet = Image.new("RGB", (cols * (cell + gap) + gap, rows * (cell + label_h + gap) + gap), bg_color)
+    draw = ImageDraw.Draw(sheet)
+    for i, v in enumerate(variants):
+        r, c = divmod(i, cols)
+        x0 = gap + c * (cell + gap)
+        y0 = gap + r * (cell + label_h + gap)
+        thumb = v["image"].copy()
+        thumb.thumbnail((cell, cell), Image.LANCZOS)
+        pos = (x0 + (cell - thumb.width) // 2, y0 + (cell - thumb.height) // 2)
+        sheet.paste(thumb, pos, thumb if thumb.mode == "RGBA" else None)
+        # 标签每个轴一行
+        for j, (k, val) in enumerate(v["values"].items()):
+            line = f"{SWEEP_AXES.get(k, k)}: {val}"
+            draw.text((x0, y0 + cell + 4 + j * (font_size + 2)), line, fill=(40, 40, 40), font=font)
+    return sheet
+
+
+def _variant_name(base, values):
+    parts = [f"{k}-{v}" for k, v in values.items()]
+    safe = "_".join(parts).replace("/", "-").replace(" ", "")
+    return f"{base}_{safe}.png" if safe else f"{base}.png"
+
+
+def encode_sweep_zip(variants, fname):
+    """把各变体分别编码为 PNG，打包为 ZIP 字节。文件名包含扫描取值。"""
+    base, _ = os.path.splitext(fname)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+        for v in variants:
+            data = io.BytesIO()
+            v["image"].save(data, format="PNG")
+            zf.writestr(_variant_name(base, v["values"]), data.getvalue())
+    return buf.getvalue()
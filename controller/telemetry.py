@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+批处理遥测 (telemetry.py)
+-------------------------------------------------
+记录批量处理/导出的吞吐量与内存指标，用于容量规划和发现性能回退。
+
+指标 (BatchMetrics):
+1.  吞吐量: 完成张数、耗时、张/秒。
+2.  每个工作线程 (或子进程) 的忙碌时间，以及按池类型 (thread / process / isolated / export)
+    汇总的忙碌时间；队列深度 (已提交未开始) 的当前值与最大值。
+3.  各渲染阶段 (registry 中的 background / shadow_alpha / corners 以及合成 composite)
+    的调用次数与累计耗时；开启 tracemalloc 时记录各阶段的内存分配峰值。
+    注意 tracemalloc 只统计 Python/NumPy 的分配，Pillow 内部的 C 分配不在其中；
+    多线程并行时峰值为各线程叠加后的进程级峰值。
+4.  进程峰值 RSS、按异常类型统计的失败数、写出字节数。
+
+输出方式:
+- 程序接口: `BatchMetrics.summary()` 返回字典；`last_batch()` 返回最近完成的批次。
+- Prometheus 文本格式: 批次结束时把进程累计值写入 METRICS_PATH (默认 output/metrics.prom，
+  环境变量 BGF_METRICS_FILE 覆盖)，可由 node_exporter textfile collector 等本地采集。
+  忙碌时间只按池类型导出 (标签取值固定的几种)；线程名、子进程 pid 每次运行都不同，
+  作为标签会让序列数无限增长，这些明细只保留在 summary() 中。
+- 界面: output_view 在导出任务完成后显示 summary。
+
+工作线程通过 `bind(metrics)` 把当前批次绑定到线程，registry 的阶段钩子据此归属指标。
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from model import registry
+
+try:
+    import resource  # Windows 无此模块
+except ImportError:
+    resource = None
+
+try:
+    import psutil  # 可选依赖
+except ImportError:
+    psutil = None
+
+METRICS_PATH = os.environ.get("BGF_METRICS_FILE", os.path.join("output", "metrics.prom"))
+
+# 是否开启 tracemalloc 统计各阶段内存峰值 (有一定开销，默认关闭)
+TRACE_MEMORY = os.environ.get("BGF_TRACEMALLOC", "") not in ("", "0")
+
+_local = threading.local()
+
+
+def peak_rss_bytes():
+    """返回进程的峰值常驻内存 (字节)，无法获取时返回 None。"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 单位为 KB，macOS 为字节
+        return peak if sys.platform == "darwin" else peak * 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+    return None
+
+
+class BatchMetrics:
+    """
+    一个批次的指标。所有方法线程安全。
+
+    Args:
+        name (str): 批次名 (用于显示)。
+        trace_memory (bool): 是否用 tracemalloc 记录各阶段内存峰值，None 时取 TRACE_MEMORY。
+    """
+
+    def __init__(self, name="batch", trace_memory=None):
+        self.name = name
+        self.trace_memory = TRACE_MEMORY if trace_memory is None else trace_memory
+        self.started = None
+        self.finished = None
+        self.images = 0
+        self.failures = Counter()              # 异常类型名 -> 次数
+        self.bytes_written = 0
+        self.worker_busy = defaultdict(float)  # 工作线程名/子进程标识 -> 忙碌秒数
+        self.pool_busy = defaultdict(float)    # 池类型 -> 忙碌秒数
+        self.queue_depth = 0
+        self.queue_depth_max = 0
+        self.stage_seconds = defaultdict(float)
+        self.stage_calls = Counter()
+        self.stage_mem_peak = {}               # 阶段 -> tracemalloc 峰值 (字节)
+        self.peak_rss = None
+        self._lock = threading.Lock()
+        self._tracing = False
+
+    # ---------- 批次生命周期 ----------
+
+    def start(self):
+        """开始计时；开启内存追踪时启动 tracemalloc。"""
+        self.started = time.perf_counter()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        return self
+
+    def finish(self, write=True):
+        """结束批次：记录峰值 RSS，并入进程累计值，写出 Prometheus 文件。"""
+        self.finished = time.perf_counter()
+        self.peak_rss = peak_rss_bytes()
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        _record_batch(self, write)
+        return self
+
+    # ---------- 记录 ----------
+
+    def queued(self, n=1):
+        with self._lock:
+            self.queue_depth += n
+            self.queue_depth_max = max(self.queue_depth_max, self.queue_depth)
+
+    def dequeued(self, n=1):
+        with self._lock:
+            self.queue_depth = max(0, self.queue_depth - n)
+
+    def image_done(self, worker, seconds, error=None, pool="thread"):
+        """记录一张图片处理完成 (error 为异常对象或异常类型名时计为失败)，pool 为池类型。"""
+        with self._lock:
+            self.images += 1
+            self.worker_busy[worker] += seconds
+            self.pool_busy[pool] += seconds
+            if error is not None:
+                self.failures[error if isinstance(error, str) else type(error).__name__] += 1
+
+    def add_bytes(self, n):
+        with self._lock:
+            self.bytes_written += n
+
+    @contextmanager
+    def stage(self, name):
+        """统计一个渲染阶段的耗时 (及内存峰值)。"""
+        tracing = tracemalloc.is_tracing() and self.trace_memory
+        if tracing:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t0
+            peak = tracemalloc.get_traced_memory()[1] - base if tracing else None
+            with self._lock:
+                self.stage_seconds[name] += dt
+                self.stage_calls[name] += 1
+                if peak is not None:
+                    self.stage_mem_peak[name] = max(self.stage_mem_peak.get(name, 0), peak)
+
+    # ---------- 汇总 ----------
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def images_per_sec(self):
+        return self.images / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        """返回指标字典。"""
+        with self._lock:
+            return {
+                "name": self.name,
+                "images": self.images,
+                "elapsed_s": round(self.elapsed, 3),
+                "images_per_sec": round(self.images_per_sec, 3),
+                "failures": dict(self.failures),
+                "bytes_written": self.bytes_written,
+                "worker_busy_s": {k: round(v, 3) for k, v in self.worker_busy.items()},
+                "pool_busy_s": {k: round(v, 3) for k, v in self.pool_busy.items()},
+                "queue_depth_max": self.queue_depth_max,
+                "stage_seconds": {k: round(v, 3) for k, v in self.stage_seconds.items()},
+                "stage_calls": dict(self.stage_calls),
+                "stage_mem_peak_bytes": dict(self.stage_mem_peak),
+                "peak_rss_bytes": self.peak_rss,
+            }
+
+
+# ---------- 线程绑定与阶段钩子 ----------
+
+@contextmanager
+def bind(metrics):
+    """在当前线程内把阶段统计归属到 metrics (None 时不统计)。"""
+    prev = getattr(_local, "metrics", None)
+    _local.metrics = metrics
+    try:
+        yield metrics
+    finally:
+        _local.metrics = prev
+
+
+def current():
+    """返回当前线程绑定的批次指标，未绑定时为 None。"""
+    return getattr(_local, "metrics", None)
+
+
+def stage(name):
+    """统计当前线程所属批次的一个阶段；未绑定批次时不做任何事。"""
+    m = current()
+    return m.stage(name) if m is not None else nullcontext()
+
+
+# registry.run_stage 的每个阶段都经过此钩子
+registry.set_stage_hook(stage)
+
+
+# ---------- 进程累计值与 Prometheus 输出 ----------
+
+_totals = {
+    "batches": 0,
+    "images": 0,
+    "seconds": 0.0,
+    "bytes": 0,
+    "failures": Counter(),
+    "stage_seconds": defaultdict(float),
+    "stage_calls": Counter(),
+    "pool_busy": defaultdict(float),
+}
+_last = {"batch": None}
+_totals_lock = threading.Lock()
+
+
+def _record_batch(m, write):
+    with _totals_lock:
+        _totals["batches"] += 1
+        _totals["images"] += m.images
+        _totals["seconds"] += m.elapsed
+        _totals["bytes"] += m.bytes_written
+        _totals["failures"].update(m.failures)
+        for k, v in m.stage_seconds.items():
+            _totals["stage_seconds"][k] += v
+        _totals["stage_calls"].update(m.stage_calls)
+        for k, v in m.pool_busy.items():
+            _totals["pool_busy"][k] += v
+        _last["batch"] = m
+    if write:
+        try:
+            write_prometheus()
+        except OSError as e:
+            print(f"写入指标文件失败: {e}")
+
+
+def last_batch():
+    """返回最近完成的批次指标，没有时为 None。"""
+    return _last["batch"]
+
+
+def prometheus_text():
+    """生成 Prometheus 文本格式的进程累计指标 (以及最近批次的吞吐量与峰值)。"""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    with _totals_lock:
+        last = _last["batch"]
+        metric("bgf_batches_total", "counter", "Completed batches.", [({}, _totals["batches"])])
+        metric("bgf_images_total", "counter", "Processed images.", [({}, _totals["images"])])
+        metric("bgf_batch_seconds_total", "counter", "Wall time spent in batches.",
+               [({}, round(_totals["seconds"], 6))])
+        metric("bgf_bytes_written_total", "counter", "Encoded output bytes written.", [({}, _totals["bytes"])])
+        metric("bgf_failures_total", "counter", "Failed images by exception type.",
+               [({"type": k}, v) for k, v in sorted(_totals["failures"].items())])
+        metric("bgf_stage_seconds_total", "counter", "Time spent per render stage.",
+               [({"stage": k}, round(v, 6)) for k, v in sorted(_totals["stage_seconds"].items())])
+        metric("bgf_stage_calls_total", "counter", "Calls per render stage.",
+               [({"stage": k}, v) for k, v in sorted(_totals["stage_calls"].items())])
+        metric("bgf_worker_busy_seconds_total", "counter", "Worker busy time per pool kind.",
+               [({"pool": k}, round(v, 6)) for k, v in sorted(_totals["pool_busy"].items())])
+        if last is not None:
+            metric("bgf_last_batch_images_per_second", "gauge", "Throughput of the last batch.",
+                   [({}, round(last.images_per_sec, 6))])
+            metric("bgf_last_batch_queue_depth_max", "gauge", "Max queue depth in the last batch.",
+                   [({}, last.queue_depth_max)])
+            metric("bgf_last_batch_stage_mem_peak_bytes", "gauge", "tracemalloc peak per stage in the last batch.",
+                   [({"stage": k}, v) for k, v in sorted(last.stage_mem_peak.items())])
+        rss = peak_rss_bytes()
+        if rss is not None:
+            metric("bgf_peak_rss_bytes", "gauge", "Peak resident set size of the process.", [({}, rss)])
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path=METRICS_PATH):
+    """把 prometheus_text() 写入文件 (先写临时文件再替换，采集端不会读到半个文件)。"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+"""
+监视目录守护进程 (watch_daemon.py)
+-------------------------------------------------
+监视一个或多个输入目录，新出现或内容变化的图片按参数预设自动处理，结果写入输出目录。
+
+设计要点:
+1.  变化检测: 安装了 inotify_simple (Linux) 时用 inotify 获得即时通知，并定期全量扫描兜底
+    (网络共享上的远端写入不会产生 inotify 事件)；否则每隔 poll 秒扫描一次 (size, mtime)。
+2.  防抖: 文件的 (大小, mtime) 连续 debounce 秒不变才视为写入完成，避免处理半个文件。
+3.  清单 (manifest): SQLite 记录已完成的 (内容哈希, 预设哈希)。重启后不重复处理；
+    同一内容改名/复制也不重复处理；修改预设后会重新处理。
+    另有 (路径, 大小, mtime) -> 哈希 的索引表，未变化的文件无需重新读取计算哈希。
+    查询均走主键索引，清单增长到几十万条时单次查询仍是 O(log n)，扫描成本只与目录中的文件数相关。
+4.  失败重试: 失败记录尝试次数与下次可重试时间 (退避从 RETRY_BACKOFF 秒起每次翻倍，最长 6 小时)，
+    到期后自动重新处理 (包括重启后)，达到 MAX_ATTEMPTS 次不再重试；超出像素/内存上限的失败
+    不重试。`--retry-failed` 启动时把全部失败记录清零立即重试。只有 "done" 的记录才会跳过。
+5.  并发: 稳定的文件提交到线程池处理，在途数量有上限；渲染由 export_jobs.render_file 完成
+    (含渲染缓存)，输出先写临时文件再替换。
+
+用法:
+    python -m controller.watch_daemon --input /mnt/share/shoots --output /mnt/share/framed \\
+        --preset presets/douyin.json [--poll 2] [--debounce 5] [--workers 4] [--retry-failed]
+"""
+
+import argparse
+import json
+import os
+import signal
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from controller import calibration, export_jobs, render_cache, job_limits
+from Read import metaCache
+
+try:
+    import inotify_simple  # 可选依赖，仅 Linux
+except ImportError:
+    inotify_simple = None
+
+# 支持的图片扩展名
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".webp")
+
+DEFAULT_MANIFEST = os.environ.get("BGF_WATCH_MANIFEST", os.path.join("cache", "watch_manifest.sqlite"))
+
+# inotify 模式下的兜底全量扫描间隔 (秒)
+RESCAN_INTERVAL = 60
+
+# 失败文件的最大尝试次数与首次重试退避 (秒，每次翻倍，最长 RETRY_BACKOFF_MAX)
+MAX_ATTEMPTS = int(os.environ.get("BGF_WATCH_MAX_ATTEMPTS", "5"))
+RETRY_BACKOFF = float(os.environ.get("BGF_WATCH_RETRY_BACKOFF", "60"))
+RETRY_BACKOFF_MAX = 6 * 3600
+
+# 预设未给出的参数使用与界面默认值一致的设置
+DEFAULT_PARAMS = calibration.CALIBRATION_PARAMS
+
+
+def preset_digest(params):
+    """预设参数的规范化哈希 (与渲染缓存的参数哈希一致)。"""
+    return render_cache.params_digest(params)
+
+
+class Manifest:
+    """
+    已处理文件清单 (SQLite)。
+
+    Args:
+        path (str): 数据库文件路径。
+    """
+
+    def __init__(self, path=DEFAULT_MANIFEST):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS done ("
+            " digest TEXT NOT NULL, preset TEXT NOT NULL, status TEXT NOT NULL,"
+            " source TEXT, outputs TEXT, error TEXT, finished REAL,"
+            " PRIMARY KEY (digest, preset))"
+        )
+        # 旧版清单没有尝试次数/重试时间列，补上
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(done)")}
+        if "attempts" not in columns:
+            self._conn.execute("ALTER TABLE done ADD COLUMN attempts INTEGER NOT NULL DEFAULT 1")
+        if "retry_after" not in columns:
+            self._conn.execute("ALTER TABLE done ADD COLUMN retry_after REAL NOT NULL DEFAULT 0")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS path_index ("
+            " path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,"
+            " digest TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def digest_for(self, path, size, mtime_ns):
+        """返回文件内容哈希；路径、大小、mtime 未变化时直接用索引表中的值。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, digest FROM path_index WHERE path = ?", (path,)
+            ).fetchone()
+        if row and row[0] == size and row[1] == mtime_ns:
+            return row[2]
+        digest = metaCache.file_digest(path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO path_index (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+                (path, size, mtime_ns, digest),
+            )
+            self._conn.commit()
+        return digest
+
+    def status(self, digest, preset):
+        """返回 (digest, preset) 的处理状态 ("done" / "failed")，未处理时为 None。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status FROM done WHERE digest = ? AND preset = ?", (digest, preset)
+            ).fetchone()
+        return row[0] if row else None
+
+    def should_process(self, digest, preset, now=None):
+        """未处理过，或失败后已到重试时间且尝试次数未用完时返回 True；"done" 的记录返回 False。"""
+        now = time.time() if now is None else now
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, attempts, retry_after FROM done WHERE digest = ? AND preset = ?",
+                (digest, preset)).fetchone()
+        if row is None:
+            return True
+        status, attempts, retry_after = row
+        return status == "failed" and attempts < MAX_ATTEMPTS and retry_after <= now
+
+    def record(self, digest, preset, status, source, outputs=None, error=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO done (digest, preset, status, source, outputs, error, finished,"
+                " attempts, retry_after)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?,"
+                " COALESCE((SELECT attempts FROM done WHERE digest = ? AND preset = ?), 0) + 1, 0)",
+                (digest, preset, status, source, json.dumps(outputs or [], ensure_ascii=False),
+                 error, time.time(), digest, preset),
+            )
+            self._conn.commit()
+
+    def record_failure(self, digest, preset, source, error, permanent=False):
+        """记录一次失败：尝试次数 +1，按退避设置下次可重试时间；permanent 为真时不再重试。"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT attempts FROM done WHERE digest = ? AND preset = ? AND status = 'failed'",
+                (digest, preset)).fetchone()
+            attempts = MAX_ATTEMPTS if permanent else (row[0] if row else 0) + 1
+            delay = min(RETRY_BACKOFF * 2 ** (attempts - 1), RETRY_BACKOFF_MAX)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO done (digest, preset, status, source, outputs, error, finished,"
+                " attempts, retry_after) VALUES (?, ?, 'failed', ?, '[]', ?, ?, ?, ?)",
+                (digest, preset, source, str(error), now, attempts, now + delay),
+            )
+            self._conn.commit()
+        return attempts
+
+    def due_retries(self, preset, now=None):
+        """返回已到重试时间的失败文件路径。"""
+        now = time.time() if now is None else now
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source FROM done WHERE preset = ? AND status = 'failed'"
+                " AND attempts < ? AND retry_after <= ?", (preset, MAX_ATTEMPTS, now)).fetchall()
+        return [r[0] for r in rows]
+
+    def reset_failed(self, preset=None):
+        """把失败记录的尝试次数清零并立即可重试，返回条目数。"""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE done SET attempts = 0, retry_after = 0 WHERE status = 'failed'"
+                + (" AND preset = ?" if preset is not None else ""),
+                (preset,) if preset is not None else ())
+            self._conn.commit()
+            return cur.rowcount
+
+    def counts(self):
+        """返回 {状态: 条目数}。"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM done GROUP BY status").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class WatchDaemon:
+    """
+    监视输入目录并增量处理图片。
+
+    Args:
+        inputs (list): 输入目录列表 (递归监视)。
+        output (str): 输出目录，保持与输入目录相同的相对路径结构。
+        params (dict): 渲染参数预设。
+        manifest (Manifest): 处理清单。
+        poll (float): 轮询间隔 (秒)。
+        debounce (float): 文件 (大小, mtime) 稳定多少秒后才处理。
+        workers (int): 并发处理数，None 时取校准配置。
+    """
+
+    def __init__(self, inputs, output, params, manifest, poll=2.0, debounce=5.0, workers=None):
+        self.inputs = [os.path.abspath(d) for d in inputs]
+        self.output = os.path.abspath(output)
+        self.params = dict(params)
+        self.preset = preset_digest(self.params)
+        self.manifest = manifest
+        self.meta_cache = metaCache.get_cache()   # 参数信息条的元数据缓存 (进程共享)
+        self.poll = poll
+        self.debounce = debounce
+        self.workers = calibration.pool_settings(workers)[0]
+        self._seen = {}        # 路径 -> (大小, mtime_ns)，已判定无需处理或已提交的版本
+        self._pending = {}     # 路径 -> (大小, mtime_ns, 最近一次变化的时间)
+        self._inflight = set()
+        self._stop = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="watch")
+        self._inotify = None
+        self._wd_paths = {}
+        self.processed = 0
+        self.failed = 0
+
+    # ---------- 变化检测 ----------
+
+    def _scan(self):
+        """全量扫描输入目录，把新出现或变化的图片加入待定列表。"""
+        for root_dir in self.inputs:
+            for dirpath, dirnames, filenames in os.walk(root_dir):
+                if self._inotify is not None:
+                    self._watch_dir(dirpath)
+                for name in filenames:
+                    if name.lower().endswith(IMAGE_EXTS) and not name.startswith("."):
+                        self._observe(os.path.join(dirpath, name))
+
+    def _observe(self, path):
+        """记录一个文件的当前 (大小, mtime)，与上次不同则 (重新) 开始防抖计时。"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._pending.pop(path, None)
+            return
+        sig = (st.st_size, st.st_mtime_ns)
+        if self._seen.get(path) == sig or path in self._inflight:
+            return
+        prev = self._pending.get(path)
+        if prev is None or prev[:2] != sig:
+            self._pending[path] = (sig[0], sig[1], time.monotonic())
+
+    def _init_inotify(self):
+        if inotify_simple is None:
+            return
+        try:
+            self._inotify = inotify_simple.INotify()
+        except OSError as e:
+            print(f"inotify 不可用，改为轮询: {e}")
+            self._inotify = None
+
+    def _watch_dir(self, path):
+        if path in self._wd_paths.values():
+            return
+        flags = inotify_simple.flags
+        mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.MODIFY
+        try:
+            wd = self._inotify.add_watch(path, mask)
+            self._wd_paths[wd] = path
+        except OSError:
+            pass
+
+    def _read_events(self, timeout):
+        """读取 inotify 事件 (最多等待 timeout 秒)，把相关文件加入待定列表。"""
+        for event in self._inotify.read(timeout=int(timeout * 1000)):
+            base = self._wd_paths.get(event.wd)
+            if base is None or not event.name:
+                continue
+            path = os.path.join(base, event.name)
+            if event.mask & inotify_simple.flags.ISDIR:
+                self._watch_dir(path)
+            elif event.name.lower().endswith(IMAGE_EXTS):
+                self._observe(path)
+
+    # ---------- 处理 ----------
+
+    def _ready(self):
+        """返回已稳定 debounce 秒的文件，并重新确认其大小/mtime 未变化。"""
+        now = time.monotonic()
+        ready = []
+        for path, (size, mtime_ns, since) in list(self._pending.items()):
+            self._observe(path)
+            cur = self._pending.get(path)
+            if cur is None:
+                continue
+            if cur[:2] == (size, mtime_ns) and now - cur[2] >= self.debounce:
+                ready.append((path, size, mtime_ns))
+        return ready
+
+    def _output_dir(self, path):
+        for root_dir in self.inputs:
+            if path.startswith(root_dir + os.sep):
+                rel = os.path.relpath(os.path.dirname(path), root_dir)
+                return os.path.normpath(os.path.join(self.output, os.path.basename(root_dir), rel))
+        return self.output
+
+    def _process_file(self, path, size, mtime_ns):
+        """处理单个文件 (工作线程)：查清单 -> 渲染 -> 原子写出 -> 记录清单。"""
+        try:
+            digest = self.manifest.digest_for(path, size, mtime_ns)
+        except OSError as e:  # 文件暂时无法读取 (网络共享等)，不记入 _seen，下次扫描时重试
+            print(f"读取 {path} 失败: {e}")
+            return "retry"
+        if not self.manifest.should_process(digest, self.preset):
+            return "skip"
+        try:
+            outputs = export_jobs.render_file(path, self._output_dir(path), self.params,
+                                              meta_cache=self.meta_cache)
+            self.manifest.record(digest, self.preset, "done", path, outputs)
+            return "done"
+        except Exception as e:
+            permanent = isinstance(e, job_limits.JobLimitError)
+            attempts = self.manifest.record_failure(digest, self.preset, path, e, permanent=permanent)
+            note = "不再重试" if attempts >= MAX_ATTEMPTS else f"稍后重试 ({attempts}/{MAX_ATTEMPTS})"
+            print(f"处理 {path} 失败: {e}，{note}")
+            return "failed"
+
+    def _retry_due(self):
+        """把已到重试时间的失败文件重新加入待定列表 (仍经过防抖与清单检查)。"""
+        for path in self.manifest.due_retries(self.preset):
+            if path in self._inflight or path in self._pending:
+                continue
+            self._seen.pop(path, None)
+            self._observe(path)
+
+    def _submit(self, path, size, mtime_ns):
+        self._pending.pop(path, None)
+        self._inflight.add(path)
+
+        def done(future):
+            self._inflight.discard(path)
+            result = future.result() if not future.exception() else "failed"
+            if result != "retry":
+                self._seen[path] = (size, mtime_ns)
+            if result == "done":
+                self.processed += 1
+            elif result == "failed":
+                self.failed += 1
+
+        self._pool.submit(self._process_file, path, size, mtime_ns).add_done_callback(done)
+
+    # ---------- 主循环 ----------
+
+    def stop(self, *_):
+        self._stop.set()
+
+    def run(self):
+        """运行直到 stop() (或收到 SIGINT/SIGTERM)。"""
+        self._init_inotify()
+        mode = "inotify" if self._inotify is not None else f"轮询 ({self.poll}s)"
+        print(f"监视 {', '.join(self.inputs)} -> {self.output}，模式: {mode}，并发 {self.workers}")
+        last_scan = 0.0
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                interval = RESCAN_INTERVAL if self._inotify is not None else self.poll
+                if now - last_scan >= interval:
+                    self._scan()
+                    self._retry_due()
+                    last_scan = now
+                if self._inotify is not None:
+                    self._read_events(min(self.poll, self.debounce))
+                else:
+                    self._stop.wait(self.poll)
+                # 在途任务不超过并发数的 2 倍，其余留在待定列表中
+                for path, size, mtime_ns in self._ready():
+                    if len(self._inflight) >= self.workers * 2:
+                        break
+                    self._submit(path, size, mtime_ns)
+        finally:
+            self._pool.shutdown(wait=True)
+            if self._inotify is not None:
+                self._inotify.close()
+            print(f"已停止。本次处理 {self.processed} 张，失败 {self.failed} 张，清单: {self.manifest.counts()}")
+
+
+def load_preset(path):
+    """读取参数预设 JSON，缺少的参数用 DEFAULT_PARAMS 补全；ratio 转换为元组。"""
+    params = dict(DEFAULT_PARAMS)
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            params.update(json.load(f))
+    if isinstance(params.get("ratio"), list):
+        params["ratio"] = tuple(params["ratio"])
+    return params
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="监视输入目录，自动处理新图片。")
+    parser.add_argument("--input", action="append", required=True, help="输入目录 (可多次指定)")
+    parser.add_argument("--output", required=True, help="输出目录")
+    parser.add_argument("--preset", help="参数预设 JSON 文件")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST, help="处理清单数据库路径")
+    parser.add_argument("--poll", type=float, default=2.0, help="轮询间隔 (秒)")
+    parser.add_argument("--debounce", type=float, default=5.0, help="文件稳定多少秒后处理")
+    parser.add_argument("--workers", type=int, help="并发数 (默认取校准配置)")
+    parser.add_argument("--retry-failed", action="store_true", help="启动时立即重试全部失败记录")
+    args = parser.parse_args(argv)
+
+    manifest = Manifest(args.manifest)
+    if args.retry_failed:
+        print(f"重置 {manifest.reset_failed()} 条失败记录")
+    daemon = WatchDaemon(args.input, args.output, load_preset(args.preset), manifest,
+                         poll=args.poll, debounce=args.debounce, workers=args.workers)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    daemon.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,30 @@
 2. 从 enlarged_img 的中心裁剪出 output_size 大小的区域得到 cropped_bg。
 3. 对 cropped_bg 应用高斯模糊得到 blurred_bg。
 4. (新增) 根据 mask_type 和 mask_opacity 在 blurred_bg 上叠加蒙版。
+
+模式处理: 全程在 RGB 下计算，蒙版用 Image.blend 直接混合（背景不透明，
+结果与 RGBA alpha_composite 等价），最后只转换一次 RGBA。
+
+模糊方法 (blur_method):
+- "gaussian": 全分辨率高斯模糊 (reference)。
+- "downscale": 先整数倍缩小到模糊半径约 DOWNSCALE_TARGET_RADIUS，再模糊并放大回原尺寸。
+  大半径时快得多，误差很小；注册表中作为 "background" 阶段的 "downscale" 后端，
+  由校准 (controller/calibration.py) 按半径区间决定是否使用。
 """
 
 import math
+from functools import partial
 from PIL import Image, ImageFilter, ImageOps
+from model.modes import ensure_mode
+
+# downscale 模糊时缩小后的目标模糊半径
+DOWNSCALE_TARGET_RADIUS = 8
+
+# 蒙版类型 -> 蒙版颜色
+MASK_COLORS = {
+    "白色透明蒙版": (255, 255, 255),
+    "黑色透明蒙版": (0, 0, 0),
+}
 
 def create_blur_background(
     original_img,
@@ -17,7 +37,9 @@ def create_blur_background(
     scale_factor: float = 1.0,
     blur_radius: int = 20,
     mask_type: str = "无",
-    mask_opacity: int = 40 # 新增：蒙版不透明度 (0-100)
+    mask_opacity: int = 40, # 新增：蒙版不透明度 (0-100)
+    mask_layer=None, # 预先生成的颜色蒙版层 (create_mask_overlay 的结果)，批处理时共享
+    blur_method: str = "gaussian" # 模糊方法 ("gaussian" / "downscale")
 ):
     """
     生成毛玻璃背景，支持缩放裁剪和颜色蒙版。
@@ -29,6 +51,8 @@ def create_blur_background(
         blur_radius (int): 高斯模糊半径。
         mask_type (str): 蒙版类型 ("无", "白色透明蒙版", "黑色透明蒙版")。
         mask_opacity (int): 蒙版的不透明度 (0-100, 百分比)。
+        mask_layer (PIL.Image): 可选的预生成蒙版层，尺寸不符时忽略。
+        blur_method (str): 模糊方法，见模块说明。
 
     Returns:
         PIL.Image: 处理后的 RGBA 背景图像。
@@ -37,7 +61,7 @@ def create_blur_background(
     if out_w <= 0 or out_h <= 0:
         return Image.new("RGBA", (1, 1), (0, 0, 0, 0))
 
-    base = original_img.convert("RGB")
+    base = ensure_mode(original_img, "RGB") # 已是 RGB 时不拷贝
     ow, oh = base.size
 
     # --- 1. 按 scale_factor 放大原图 ---
@@ -76,24 +100,72 @@ def create_blur_background(
 
     # --- 3. 应用高斯模糊 ---
     if blur_radius > 0:
-        blurred_bg = cropped_bg.filter(ImageFilter.GaussianBlur(blur_radius))
+        blurred_bg = BLUR_METHODS.get(blur_method, gaussian_blur)(cropped_bg, blur_radius)
     else:
         blurred_bg = cropped_bg
 
-    final_bg = blurred_bg.convert("RGBA")
-
     # --- 4. 应用颜色蒙版 (使用传入的透明度) ---
-    if mask_type != "无":
-        # 将百分比透明度 (0-100) 转换为 alpha 值 (0-255)
-        alpha_value = max(0, min(255, int((mask_opacity / 100.0) * 255)))
-
-        if mask_type == "白色透明蒙版":
-            mask_color = (255, 255, 255, alpha_value)
-            color_mask_layer = Image.new('RGBA', (out_w, out_h), mask_color)
-            final_bg = Image.alpha_composite(final_bg, color_mask_layer)
-        elif mask_type == "黑色透明蒙版":
-            mask_color = (0, 0, 0, alpha_value)
-            color_mask_layer = Image.new('RGBA', (out_w, out_h), mask_color)
-            final_bg = Image.alpha_composite(final_bg, color_mask_layer)
-
-    return final_bg
\ No newline at end of file
+    blurred_bg = apply_mask(blurred_bg, mask_type, mask_opacity, mask_layer)
+
+    return blurred_bg.convert("RGBA")
+
+
+def apply_mask(img, mask_type, mask_opacity, mask_layer=None):
+    """在 RGB 背景上混合颜色蒙版 (其他背景模式共用)；蒙版为 "无" 时原样返回。"""
+    alpha_value = _mask_alpha(mask_type, mask_opacity)
+    if alpha_value <= 0:
+        return img
+    if mask_layer is None or mask_layer.size != img.size:
+        mask_layer = create_mask_overlay(img.size, mask_type, mask_opacity)
+    return Image.blend(img, mask_layer, alpha_value / 255.0)
+
+
+def gaussian_blur(img, radius):
+    """全分辨率高斯模糊。"""
+    return img.filter(ImageFilter.GaussianBlur(radius))
+
+
+def downscaled_blur(img, radius):
+    """
+    缩小 -> 模糊 -> 放大 的近似高斯模糊。
+    缩小倍数使缩小后的半径约为 DOWNSCALE_TARGET_RADIUS，倍数为 1 时等同于 gaussian_blur。
+    """
+    factor = int(radius // DOWNSCALE_TARGET_RADIUS)
+    w, h = img.size
+    factor = min(factor, w // 4, h // 4)
+    if factor < 2:
+        return gaussian_blur(img, radius)
+    small = img.reduce(factor) # 整数倍盒式缩小，速度快
+    small = small.filter(ImageFilter.GaussianBlur(radius / factor))
+    return small.resize((w, h), Image.BILINEAR)
+
+
+# 模糊方法名 -> 实现
+BLUR_METHODS = {
+    "gaussian": gaussian_blur,
+    "downscale": downscaled_blur,
+}
+
+# 注册表使用的 downscale 后端 (签名与 create_blur_background 一致)
+create_blur_background_downscaled = partial(create_blur_background, blur_method="downscale")
+
+
+def _mask_alpha(mask_type, mask_opacity):
+    """蒙版类型有效时返回 0-255 的 alpha 值，否则返回 0。"""
+    if mask_type not in MASK_COLORS:
+        return 0
+    # 将百分比透明度 (0-100) 转换为 alpha 值 (0-255)
+    return max(0, min(255, int((mask_opacity / 100.0) * 255)))
+
+
+def create_mask_overlay(size, mask_type, mask_opacity):
+    """
+    生成纯色蒙版层 (RGB)，与 create_blur_background 中 Image.blend 配合使用。
+    只依赖尺寸和蒙版参数，批处理中同尺寸图片可共享（只读）。
+
+    Returns:
+        PIL.Image: 蒙版层；蒙版类型为 "无" 或不透明度为 0 时返回 None。
+    """
+    if _mask_alpha(mask_type, mask_opacity) <= 0:
+        return None
+    return Image.new("RGB", size, MASK_COLORS[mask_type])
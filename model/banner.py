@@ -0,0 +1,162 @@
+"""
+相机/镜头参数信息条
+----------------------------------------------------------------
+根据 readPicInfo 提取的元数据 (机型、镜头、焦距、光圈、快门、ISO)
+生成一条带品牌 Logo 的透明信息条，由 processing_controller 合成到画布上。
+
+性能要点:
+1. 字体按 (字体, 字号) 缓存，只加载一次。
+2. 品牌 Logo 按 (文件, 高度) 缓存缩放结果。
+3. 文字条按 (字体, 字号, 文本, 颜色) 缓存渲染结果。
+同一台相机拍摄的一批图片，机型/镜头等文字只会光栅化一次。
+"""
+
+import os
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+
+# 品牌 -> Logo 文件 (相对项目根目录)，键为大写的 EXIF Make
+BRAND_LOGOS = {
+    "SONY": os.path.join("static", "pic", "SonyLogo1.png"),
+}
+
+# 未指定字体时依次尝试的字体文件
+_FONT_CANDIDATES = ("msyh.ttc", "arial.ttf", "DejaVuSans.ttf", "NotoSansCJK-Regular.ttc")
+
+TEXT_COLORS = {
+    "白色": (255, 255, 255, 255),
+    "黑色": (0, 0, 0, 255),
+}
+
+
+@lru_cache(maxsize=32)
+def load_font(font_path, size):
+    """
+    加载字体，按 (font_path, size) 缓存。
+    font_path 为 None 时按候选列表查找系统字体，都不可用时使用 Pillow 内置字体。
+    """
+    size = max(1, int(size))
+    for candidate in ((font_path,) if font_path else _FONT_CANDIDATES):
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size)  # Pillow >= 10.1 支持指定字号
+    except TypeError:
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=32)
+def load_logo(logo_path, height):
+    """加载品牌 Logo，裁掉透明留白后按高度等比缩放，按 (logo_path, height) 缓存。"""
+    height = max(1, int(height))
+    try:
+        with Image.open(logo_path) as src:
+            logo = src.convert("RGBA")
+    except (OSError, ValueError):
+        return None
+    bbox = logo.getchannel("A").getbbox()
+    if bbox:
+        logo = logo.crop(bbox)
+    w = max(1, round(logo.width * height / logo.height))
+    return logo.resize((w, height), Image.LANCZOS)
+
+
+@lru_cache(maxsize=256)
+def render_text_strip(text, font_path, size, color):
+    """
+    把一行文字渲染为紧贴文字的透明 RGBA 图像，按 (字体, 字号, 文本, 颜色) 缓存。
+    返回的图像被多处共享，调用方不得修改。
+    """
+    font = load_font(font_path, size)
+    left, top, right, bottom = font.getbbox(text)
+    w, h = max(1, right - left), max(1, bottom - top)
+    strip = Image.new("RGBA", (w, h), (0, 0, 0, 0))
+    ImageDraw.Draw(strip).text((-left, -top), text, font=font, fill=color)
+    return strip
+
+
+def banner_lines(metadata):
+    """
+    从元数据生成两行文字：(机型行, 参数行)。
+
+    Returns:
+        tuple: (title, detail)，缺失的部分为空字符串。
+    """
+    if not metadata:
+        return "", ""
+    title = metadata.get("Model") or metadata.get("Make") or ""
+    lens = metadata.get("LensModel")
+    parts = []
+    focal = metadata.get("FocalLength")
+    if focal:
+        parts.append(str(focal).replace(" ", ""))
+    if metadata.get("Aperture"):
+        parts.append(str(metadata["Aperture"]))
+    exposure = metadata.get("ExposureTime")
+    if exposure:
+        parts.append(str(exposure).replace(" ", ""))
+    if metadata.get("ISO"):
+        parts.append(f"ISO{metadata['ISO']}")
+    detail = "  ".join(parts)
+    if lens:
+        detail = f"{lens}  |  {detail}" if detail else str(lens)
+    return title, detail
+
+
+def create_info_banner(metadata, size, text_color="白色", font_path=None, show_logo=True):
+    """
+    生成参数信息条。
+
+    Args:
+        metadata (dict): readPicInfo 返回的清理后元数据。
+        size (tuple): 信息条尺寸 (宽, 高)。
+        text_color (str): 文字颜色 ("白色" / "黑色")。
+        font_path (str): 字体文件路径，None 表示自动查找。
+        show_logo (bool): 是否在机型前显示品牌 Logo。
+
+    Returns:
+        PIL.Image: 透明背景的 RGBA 信息条；没有可显示的内容时返回 None。
+    """
+    title, detail = banner_lines(metadata)
+    out_w, out_h = size
+    if (not title and not detail) or out_w <= 0 or out_h <= 0:
+        return None
+    color = TEXT_COLORS.get(text_color, TEXT_COLORS["白色"])
+
+    # 两行文字：机型行较大，参数行较小，行间留白
+    title_size = max(1, int(out_h * 0.38))
+    detail_size = max(1, int(out_h * 0.24))
+    gap = max(1, int(out_h * 0.08))
+
+    title_strip = render_text_strip(title, font_path, title_size, color) if title else None
+    detail_strip = render_text_strip(detail, font_path, detail_size, color) if detail else None
+
+    logo = None
+    if show_logo and metadata.get("Make"):
+        logo_path = BRAND_LOGOS.get(str(metadata["Make"]).strip().upper())
+        if logo_path:
+            logo = load_logo(logo_path, title_size)
+
+    # --- 排版：第一行 [Logo] 机型，第二行参数，整体居中 ---
+    row1_w = (logo.width if logo else 0) + (title_strip.width if title_strip else 0)
+    if logo and title_strip:
+        row1_w += gap
+    row1_h = max(logo.height if logo else 0, title_strip.height if title_strip else 0)
+    row2_h = detail_strip.height if detail_strip else 0
+    block_h = row1_h + row2_h + (gap if row1_h and row2_h else 0)
+
+    banner = Image.new("RGBA", (out_w, out_h), (0, 0, 0, 0))
+    y = max(0, (out_h - block_h) // 2)
+    if row1_h:
+        x = (out_w - row1_w) // 2
+        if logo:
+            banner.alpha_composite(logo, (max(0, x), y + (row1_h - logo.height) // 2))
+            x += logo.width + (gap if title_strip else 0)
+        if title_strip:
+            banner.alpha_composite(title_strip, (max(0, x), y + (row1_h - title_strip.height) // 2))
+        y += row1_h + gap
+    if detail_strip:
+        banner.alpha_composite(detail_strip, (max(0, (out_w - detail_strip.width) // 2), y))
+    return banner
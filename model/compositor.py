@@ -0,0 +1,253 @@
+"""
+融合合成器 (NumPy 预乘 alpha)
+----------------------------------------------------------------
+把 背景 -> 阴影 -> 前景 三层在一次按行分块的遍历中合成，直接写入预先分配的输出缓冲区，
+取代两次整幅画布的 Image.alpha_composite 以及中间 RGBA 图层。
+
+算法:
+1. 所有运算使用 uint16 整数、预乘 alpha：over(src, dst) = src_p + dst_p * (255 - src_a) / 255。
+2. 阴影是纯黑色，只需其 alpha 通道：颜色只衰减、不叠加，且只处理阴影的非零外接矩形。
+3. 按行分块 (默认 64 行)，块内临时缓冲区按线程复用，块大小保证数据留在缓存中，
+   除输出缓冲区外不产生与画布同尺寸的分配。
+4. 背景不透明 (最常见情况) 时走快速路径：结果 alpha 恒为 255，直接在输出缓冲区上运算；
+   背景整块按字节拷贝，前景完全不透明的行块也直接拷贝；被不透明前景整行盖住的阴影不计算，
+   只有前景四周露出的阴影和前景半透明边缘 (如圆角) 需要整数运算。
+5. 背景含透明时走通用路径，结束时把预乘结果还原为直通 alpha。
+
+所有输入均为 NumPy 视图（如 np.asarray(PIL.Image) 的结果或其切片），不会被修改。
+"""
+
+import threading
+
+import numpy as np
+
+BAND_ROWS = 64
+
+_scratch = threading.local()
+
+
+def _buffers(rows, width):
+    """返回本线程复用的分块缓冲区 (acc: rows x width x 4, tmp: rows x width)，只增不减。"""
+    bufs = getattr(_scratch, "bufs", None)
+    if bufs is None or bufs[0][0] < rows or bufs[0][1] < width:
+        key = (max(rows, bufs[0][0] if bufs else 0), max(width, bufs[0][1] if bufs else 0))
+        bufs = (key, np.empty(key + (4,), np.uint16), np.empty(key, np.uint16))
+        _scratch.bufs = bufs
+    return bufs[1][:rows, :width], bufs[2][:rows, :width]
+
+
+def _div255(x):
+    """原地计算 round(x / 255)，x 为 uint16 且不超过 255*255。"""
+    x += 128
+    x += x >> 8
+    x >>= 8
+    return x
+
+
+def _clip_box(canvas_w, canvas_h, pos, size):
+    """计算放置于 pos 的 size 区域与画布的交集，返回 (画布切片, 源切片) 或 None。"""
+    x, y = pos
+    w, h = size
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(canvas_w, x + w), min(canvas_h, y + h)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return (slice(y0, y1), slice(x0, x1)), (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+
+
+def _over_band(acc, tmp, src, rows, cols):
+    """把直通 alpha 的 src (RGBA uint8) 以 over 方式合成到预乘累加缓冲 acc 的 rows/cols 区域。"""
+    a = acc[rows, cols]
+    t = tmp[rows, cols]
+    # 先把背景按 (255 - src_a) 衰减
+    np.subtract(255, src[..., 3], out=t, dtype=np.uint16, casting="unsafe")
+    np.multiply(a, t[..., None], out=a)
+    _div255(a)
+    # 再加上预乘后的前景颜色与 alpha
+    for c in range(3):
+        np.multiply(src[..., c], src[..., 3], out=t, dtype=np.uint16, casting="unsafe")
+        _div255(t)
+        a[..., c] += t
+    a[..., 3] += src[..., 3]
+
+
+def _nonzero_box(alpha):
+    """返回 alpha 非零区域的 (行切片, 列切片)，全零时返回 None。"""
+    rows = np.flatnonzero(alpha.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(alpha[rows[0]:rows[-1] + 1].any(axis=0))
+    return slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
+
+
+def _opaque_rows(arr):
+    """返回布尔数组：arr 的每一行是否完全不透明。"""
+    return (arr[..., 3] == 255).all(axis=1)
+
+
+def _shade(band, shadow_alpha, y0, rows, cols):
+    """在 uint8 输出块 band 的 rows/cols 区域 (画布坐标) 上叠加黑色阴影：颜色乘以 (255 - s) / 255。"""
+    if rows.stop <= rows.start or cols.stop <= cols.start:
+        return
+    region = band[rows.start - y0:rows.stop - y0, cols, :3]
+    acc, tmp = _buffers(rows.stop - rows.start, cols.stop - cols.start)
+    acc = acc[..., :3]
+    np.subtract(255, shadow_alpha[rows, cols], out=tmp, dtype=np.uint16, casting="unsafe")
+    np.multiply(region, tmp[..., None], out=acc, dtype=np.uint16, casting="unsafe")
+    region[...] = _div255(acc)
+
+
+def _composite_opaque(out, background, shadow_alpha, shadow_box, placed, rows):
+    """快速路径：背景不透明，直接在 uint8 输出上计算 (结果 alpha 恒为 255)。"""
+    ch, cw = out.shape[:2]
+    # 第一个图层 (前景) 完全不透明的行会把阴影整段盖住，这部分阴影无需计算
+    cover = None
+    if placed:
+        arr, ((ry, rx), (sy, sx)) = placed[0]
+        cover = (ry, rx, _opaque_rows(arr[sy, sx]))
+    opaque_rows = [_opaque_rows(arr[sy, sx]) for arr, (_, (sy, sx)) in placed]
+
+    for y0 in range(0, ch, rows):
+        y1 = min(ch, y0 + rows)
+        band = out[y0:y1]
+        # --- 1. 背景：整块拷贝 ---
+        band[...] = background[y0:y1]
+
+        # --- 2. 阴影：只处理非零外接矩形中未被前景盖住的部分 ---
+        if shadow_box is not None:
+            sy, sx = shadow_box
+            b0, b1 = max(sy.start, y0), min(sy.stop, y1)
+            if b1 > b0:
+                if cover is None:
+                    _shade(band, shadow_alpha, y0, slice(b0, b1), sx)
+                else:
+                    ry, rx, full = cover
+                    left = slice(sx.start, min(sx.stop, rx.start))
+                    right = slice(max(sx.start, rx.stop), sx.stop)
+                    y = b0
+                    while y < b1:
+                        # 找出从 y 开始“是否被前景整行覆盖”相同的连续行
+                        inside = ry.start <= y < ry.stop and full[y - ry.start]
+                        y_end = y + 1
+                        while y_end < b1 and (ry.start <= y_end < ry.stop and full[y_end - ry.start]) == inside:
+                            y_end += 1
+                        if inside:
+                            _shade(band, shadow_alpha, y0, slice(y, y_end), left)
+                            _shade(band, shadow_alpha, y0, slice(y, y_end), right)
+                        else:
+                            _shade(band, shadow_alpha, y0, slice(y, y_end), sx)
+                        y = y_end
+
+        # --- 3. 前景等图层：不透明的行块直接拷贝，其余按 alpha 混合 ---
+        for (arr, ((ry, rx), (sy, sx))), full in zip(placed, opaque_rows):
+            b0, b1 = max(ry.start, y0), min(ry.stop, y1)
+            if b1 <= b0:
+                continue
+            src = arr[sy.start + (b0 - ry.start): sy.start + (b1 - ry.start), sx]
+            dst = band[b0 - y0:b1 - y0, rx]
+            if full[b0 - ry.start:b1 - ry.start].all():
+                dst[...] = src
+                continue
+            src_a = src[..., 3]
+            if src_a.max() == 0:
+                continue
+            acc, tmp = _buffers(src.shape[0], src.shape[1])
+            acc = acc[..., :3]
+            # out = (src * a + dst * (255 - a)) / 255，只取整一次
+            np.subtract(255, src_a, out=tmp, dtype=np.uint16, casting="unsafe")
+            np.multiply(dst[..., :3], tmp[..., None], out=acc, dtype=np.uint16, casting="unsafe")
+            for c in range(3):
+                np.multiply(src[..., c], src_a, out=tmp, dtype=np.uint16, casting="unsafe")
+                acc[..., c] += tmp
+            dst[..., :3] = _div255(acc)
+            dst[..., 3] = 255
+    return out
+
+
+def composite(canvas_size, background=None, shadow_alpha=None, foreground=None, fg_pos=(0, 0),
+              overlays=(), out=None, band_rows=BAND_ROWS, background_opaque=None, shadow_box=None):
+    """
+    一次遍历合成 背景、阴影、前景 (及可选的小图层)。
+
+    Args:
+        canvas_size (tuple): 画布尺寸 (宽, 高)。
+        background (np.ndarray): (H, W, 4) uint8 直通 alpha 背景，None 表示全透明。
+        shadow_alpha (np.ndarray): (H, W) uint8 阴影 alpha（已与画布对齐），None 表示无阴影。
+        foreground (np.ndarray): (h, w, 4) uint8 直通 alpha 前景，None 表示无前景。
+        fg_pos (tuple): 前景左上角在画布上的位置，可为负或超出画布（自动裁剪）。
+        overlays (iterable): 额外叠加在前景之上的 ((h, w, 4) 数组, (x, y)) 列表，如参数信息条。
+        out (np.ndarray): 预分配的 (H, W, 4) uint8 输出缓冲区，None 时新建。
+        band_rows (int): 分块行数。
+        background_opaque (bool): 背景是否完全不透明，None 时自动检测。
+        shadow_box (tuple): 阴影非零区域的 (行切片, 列切片)，None 时自动计算。
+
+    Returns:
+        np.ndarray: 直通 alpha 的 RGBA 输出 (即 out)。
+    """
+    cw, ch = canvas_size
+    if out is None:
+        out = np.empty((ch, cw, 4), np.uint8)
+    layers = []
+    if foreground is not None:
+        layers.append((foreground, fg_pos))
+    layers.extend(overlays)
+    placed = []
+    for arr, pos in layers:
+        box = _clip_box(cw, ch, pos, (arr.shape[1], arr.shape[0]))
+        if box is not None:
+            placed.append((arr, box))
+
+    rows = max(1, min(band_rows, ch))
+    if shadow_alpha is not None and shadow_box is None:
+        shadow_box = _nonzero_box(shadow_alpha)
+    if background is not None and background_opaque is None:
+        background_opaque = bool(background[..., 3].min() == 255)
+    if background is not None and background_opaque:
+        return _composite_opaque(out, background, shadow_alpha, shadow_box, placed, rows)
+
+    # --- 通用路径：背景含透明或无背景，使用预乘 alpha 累加 ---
+    bg_opaque = background is None or background_opaque
+    acc_full, tmp_full = _buffers(rows, cw)
+
+    for y0 in range(0, ch, rows):
+        y1 = min(ch, y0 + rows)
+        n = y1 - y0
+        acc = acc_full[:n]
+        tmp = tmp_full[:n]
+
+        # --- 1. 背景 (转为预乘) ---
+        if background is None:
+            acc.fill(0)
+        else:
+            acc[...] = background[y0:y1]
+            if not bg_opaque:
+                for c in range(3):
+                    acc[..., c] *= acc[..., 3]
+                    _div255(acc[..., c])
+        all_opaque = background is not None and bg_opaque
+
+        # --- 2. 阴影 (黑色，仅 alpha) ---
+        if shadow_box is not None and shadow_box[0].start < y1 and shadow_box[0].stop > y0:
+            np.subtract(255, shadow_alpha[y0:y1], out=tmp, dtype=np.uint16, casting="unsafe")
+            acc *= tmp[..., None]
+            _div255(acc)
+            acc[..., 3] += shadow_alpha[y0:y1]
+
+        # --- 3. 前景及其他图层 ---
+        for arr, ((ry, rx), (sy, sx)) in placed:
+            b0, b1 = max(ry.start, y0), min(ry.stop, y1)
+            if b1 <= b0:
+                continue
+            src = arr[sy.start + (b0 - ry.start): sy.start + (b1 - ry.start), sx]
+            _over_band(acc, tmp, src, slice(b0 - y0, b1 - y0), rx)
+
+        # --- 4. 还原直通 alpha 并写出 ---
+        np.minimum(acc, 255, out=acc)
+        if not all_opaque:
+            alpha = acc[..., 3]
+            partial = (alpha > 0) & (alpha < 255)
+            if partial.any():
+                a = alpha[partial][:, None]
+                acc[partial, :3] = np.minimum(255, (acc[partial, :3] * 255 + a // 2) // a)
+        out[y0:y1] = acc
+    return out
@@ -1,22 +1,38 @@
-from PIL import Image, ImageDraw
+from PIL import Image, ImageChops, ImageDraw
+from model.modes import ensure_mode, has_alpha
 
-def apply_round_corners(image, corner_radius=0):
+def round_corner_mask(size, corner_radius):
     """
-    对输入图像应用圆角遮罩，返回带圆角透明区域的图像 (RGBA)。
-    image: PIL Image对象（将被转换为RGBA以应用透明遮罩）。
-    corner_radius: 圆角半径（像素）。
+    生成圆角遮罩 (L模式，0为透明，255为不透明)。
+    只依赖尺寸和半径，批处理中同尺寸图片可共享同一遮罩（只读）。
     """
-    # 转换为RGBA模式，准备添加alpha通道
-    img = image.convert("RGBA")
-    if corner_radius <= 0:
-        # 无圆角处理，直接返回转换后的图像
-        return img
-    w, h = img.size
-    # 创建与图像尺寸相同的遮罩（L模式，0为透明，255为不透明）
+    w, h = size
     mask = Image.new("L", (w, h), 0)
     draw = ImageDraw.Draw(mask)
     # 在遮罩上绘制圆角矩形，白色部分为保留区域（不透明部分）
     draw.rounded_rectangle([0, 0, w, h], radius=corner_radius, fill=255)
+    return mask
+
+
+def apply_round_corners(image, corner_radius=0, mask=None):
+    """
+    对输入图像应用圆角遮罩，返回带圆角透明区域的图像 (RGBA)。
+    image: PIL Image对象（将被转换为RGBA以应用透明遮罩）。
+    corner_radius: 圆角半径（像素）。
+    mask: 预先生成的圆角遮罩 (round_corner_mask 的结果)，尺寸不符时忽略并重新生成。
+    输入已是 RGBA 且无需圆角时原样返回（不拷贝），调用方不得修改返回值。
+    输入自带透明度时，圆角遮罩与原有 alpha 相乘，保留原图的透明区域。
+    """
+    if corner_radius <= 0:
+        # 无圆角处理，模式已符合时直接返回
+        return ensure_mode(image, "RGBA")
+    # 转换为RGBA模式，准备添加alpha通道（已是RGBA时复制一份，避免修改输入）
+    img = image.copy() if image.mode == "RGBA" else image.convert("RGBA")
+    if mask is None or mask.size != img.size:
+        # 创建与图像尺寸相同的圆角遮罩
+        mask = round_corner_mask(img.size, corner_radius)
+    if has_alpha(image):
+        mask = ImageChops.multiply(img.getchannel("A"), mask)
     # 将遮罩应用为图像的alpha通道
     img.putalpha(mask)
     return img
@@ -0,0 +1,65 @@
+"""
+图像模式工具
+----------------------------------------------------------------
+渲染流程中每次 convert() 都是一次整图拷贝。这里集中处理模式判断：
+1. normalize_source(): 在流程入口把任意输入模式统一为 RGB 或 RGBA，只转换一次。
+   - P (调色板): 带透明色时转 RGBA，否则转 RGB。
+   - LA / PA / RGBa: 转 RGBA，保留透明度。
+   - I;16 / I (16 位灰度): 按位深缩放到 8 位 (取高 8 位)，避免 Pillow 直接截断成全白。
+   - 其余 (L / 1 / CMYK / YCbCr ...): 转 RGB。
+2. ensure_mode(): 模式已经符合时直接返回原对象，不产生拷贝。
+"""
+
+import numpy as np
+from PIL import Image
+
+_ALPHA_MODES = ("RGBA", "LA", "PA", "RGBa", "La")
+_WIDE_GRAY_MODES = ("I", "I;16", "I;16L", "I;16B", "I;16N")
+
+
+def has_alpha(img):
+    """判断图像是否带有透明通道（包括带透明色的调色板图像）。"""
+    return img.mode in _ALPHA_MODES or (img.mode == "P" and "transparency" in img.info)
+
+
+def ensure_mode(img, mode):
+    """模式相同时原样返回（不拷贝），否则转换一次。"""
+    return img if img.mode == mode else img.convert(mode)
+
+
+def _wide_gray_to_l(img):
+    """
+    把 16/32 位灰度图缩放到 8 位 L 模式。
+
+    - I;16 / I;16L / I;16B / I;16N: 位深确定为 16 位，一律取高 8 位 (>> 8)，
+      与像素值大小无关 (暗部为主、最大值不超过 255 的图片也按 16 位缩放)。
+    - I (32 位有符号整数): 模式本身不带位深信息。Pillow 通常把 16 位 PNG/TIFF 读成这种模式，
+      所以最大值超过 255 时按 16 位范围处理 (先截到 0~65535 再 >> 8)；否则视为 8 位数据原样保留。
+      这是启发式判断：像素值都不超过 255 的真 16 位图片会偏亮。
+    """
+    arr = np.asarray(img)
+    if img.mode.startswith("I;16"):
+        arr = arr.astype(np.uint16) >> 8
+    elif arr.size and arr.max() > 255:
+        arr = np.clip(arr, 0, 65535) >> 8
+    return Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8))
+
+
+def normalize_source(img):
+    """
+    把输入图像统一为 RGB（不透明）或 RGBA（带透明度），已经是这两种模式时不拷贝。
+
+    Args:
+        img (PIL.Image): 任意模式的输入图像。
+
+    Returns:
+        PIL.Image: RGB 或 RGBA 图像。
+    """
+    mode = img.mode
+    if mode in ("RGB", "RGBA"):
+        return img
+    if mode in _WIDE_GRAY_MODES:
+        return _wide_gray_to_l(img).convert("RGB")
+    if has_alpha(img):
+        return img.convert("RGBA")
+    return img.convert("RGB")
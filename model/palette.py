@@ -0,0 +1,195 @@
+"""
+主色背景 (低成本背景模式)
+----------------------------------------------------------------
+大批量处理时高斯模糊整幅照片作为背景开销较大，这里提供几种几乎零成本的背景：
+1. 主色纯色 (MODE_SOLID): 照片的主色填充整个画布。
+2. 双色渐变 (MODE_GRADIENT2): 上半部主色 -> 下半部主色的竖向渐变。
+3. 四角渐变 (MODE_GRADIENT4): 四个角区域的主色做双线性渐变。
+4. 色调低清模糊 (MODE_TINTED): 在 64px 缩略图上模糊并向主色着色，再放大到画布尺寸。
+
+颜色提取:
+- 原图先整数倍 reduce 到约 64px 的缩略图，再用 Pillow 的 median-cut 量化得到调色板，
+  角区域/上下半部的颜色取该区域中出现最多的调色板颜色 (与整体配色协调)。
+- 带透明度的输入：调色板只由不透明度 >= 50% 的像素生成，各颜色的出现次数按不透明度加权，
+  透明区域 (通常存为黑色) 不会成为主色；缩略图的透明区域以主色填充 (色调模糊使用)。
+- 结果按缩略图内容哈希缓存 (LRU)，同一张图改变参数反复预览时不会重新计算。
+- 渐变由 2x2 (或 1x2) 的小图以双线性插值放大到画布尺寸，成本只与输出像素数相关。
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image, ImageFilter
+from model.modes import ensure_mode, has_alpha
+
+# 背景模式 (界面显示值)
+MODE_BLUR = "毛玻璃模糊"
+MODE_SOLID = "主色纯色"
+MODE_GRADIENT2 = "双色渐变"
+MODE_GRADIENT4 = "四角渐变"
+MODE_TINTED = "色调低清模糊"
+BACKGROUND_MODES = (MODE_BLUR, MODE_SOLID, MODE_GRADIENT2, MODE_GRADIENT4, MODE_TINTED)
+
+# 颜色提取使用的缩略图最长边、调色板颜色数
+THUMB_SIZE = 64
+PALETTE_COLORS = 6
+
+# 色调模糊中主色的混合比例
+TINT_STRENGTH = 0.35
+
+_CACHE_SIZE = 256
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _tiny(img):
+    """
+    缩小到最长边约 THUMB_SIZE 的缩略图 (先整数倍 reduce，避免全尺寸重采样)。
+    带透明度的输入返回 RGBA，否则返回 RGB。
+    """
+    mode = "RGBA" if has_alpha(img) else "RGB"
+    if img.mode == "P":
+        img = img.convert(mode)
+    factor = max(1, max(img.size) // (THUMB_SIZE * 2))
+    small = img.reduce(factor) if factor > 1 else img
+    small = small.resize(_fit(small.size, THUMB_SIZE), Image.BILINEAR, reducing_gap=2.0)
+    return ensure_mode(small, mode)
+
+
+def _quantize(thumb, alpha):
+    """median-cut 量化；带透明度时只用不透明度 >= 50% 的像素生成调色板，再把整图映射到该调色板。"""
+    if alpha is not None and alpha.min() < 0.5:
+        opaque = np.asarray(thumb)[alpha >= 0.5]
+        if len(opaque):
+            sample = Image.fromarray(np.ascontiguousarray(opaque.reshape(1, -1, 3)))
+            pal = sample.quantize(colors=PALETTE_COLORS, method=Image.Quantize.MEDIANCUT)
+            return thumb.quantize(palette=pal, dither=Image.Dither.NONE)
+    return thumb.quantize(colors=PALETTE_COLORS, method=Image.Quantize.MEDIANCUT)
+
+
+def _fit(size, max_edge):
+    w, h = size
+    scale = min(1.0, max_edge / max(w, h))
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+
+def _region_color(indexed, palette, box, alpha=None):
+    """返回 box 区域内出现最多 (按不透明度加权) 的调色板颜色；区域全透明时返回 None。"""
+    x0, y0, x1, y1 = box
+    ys, xs = slice(y0, max(y1, y0 + 1)), slice(x0, max(x1, x0 + 1))
+    weights = alpha[ys, xs].ravel() if alpha is not None else None
+    counts = np.bincount(indexed[ys, xs].ravel(), weights=weights, minlength=len(palette))
+    return palette[int(counts.argmax())] if counts.max() > 0 else None
+
+
+def extract_palette(img):
+    """
+    提取图片的配色信息 (结果缓存)。
+
+    Returns:
+        dict:
+            - "thumb": 缩略图 (RGB，只读共享)。
+            - "dominant": 主色 (r, g, b)。
+            - "palette": 按出现频率排序的调色板颜色列表。
+            - "top" / "bottom": 上下半部主色。
+            - "corners": 四角主色 [左上, 右上, 左下, 右下]。
+    """
+    tiny = _tiny(img)
+    key = hashlib.blake2b(tiny.mode.encode() + tiny.tobytes(), digest_size=16).digest()
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    alpha = None
+    thumb = tiny
+    if tiny.mode == "RGBA":
+        alpha = np.asarray(tiny.getchannel("A"), dtype=np.float32) / 255
+        thumb = tiny.convert("RGB")
+        if alpha.max() == 0:  # 全透明时按普通图片处理
+            alpha = None
+    quant = _quantize(thumb, alpha)
+    raw = quant.getpalette()[:PALETTE_COLORS * 3]
+    palette = [tuple(raw[i:i + 3]) for i in range(0, len(raw), 3)]
+    indexed = np.asarray(quant)
+    w, h = thumb.size
+    weights = alpha.ravel() if alpha is not None else None
+    counts = np.bincount(indexed.ravel(), weights=weights, minlength=len(palette))
+    order = np.argsort(-counts)
+    dominant = palette[int(order[0])]
+    if alpha is not None:
+        # 透明区域填充主色，色调模糊背景不会出现黑边
+        filled = Image.new("RGB", thumb.size, dominant)
+        filled.paste(thumb, mask=tiny.getchannel("A"))
+        thumb = filled
+
+    def region(box):
+        return _region_color(indexed, palette, box, alpha) or dominant
+
+    cw, ch = max(1, w // 3), max(1, h // 3)
+    info = {
+        "thumb": thumb,
+        "dominant": dominant,
+        "palette": [palette[int(i)] for i in order if counts[i] > 0],
+        "top": region((0, 0, w, h // 2)),
+        "bottom": region((0, h // 2, w, h)),
+        "corners": [
+            region((0, 0, cw, ch)),
+            region((w - cw, 0, w, ch)),
+            region((0, h - ch, cw, h)),
+            region((w - cw, h - ch, w, h)),
+        ],
+    }
+    with _cache_lock:
+        _cache[key] = info
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return info
+
+
+def _gradient(colors, grid, size):
+    """把 grid=(列, 行) 的颜色小图以双线性插值放大到 size，颜色中心对齐到画布边缘。"""
+    gw, gh = grid
+    tiny = Image.new("RGB", grid)
+    tiny.putdata(colors)
+    # box 取相邻像素中心之间的区域，使角点颜色恰好落在画布四角
+    x0, x1 = (0.5, gw - 0.5) if gw > 1 else (0, 1)
+    y0, y1 = (0.5, gh - 0.5) if gh > 1 else (0, 1)
+    box = (x0, y0, x1, y1)
+    return tiny.resize(size, Image.BILINEAR, box=box)
+
+
+def _tinted(info, size, blur_radius):
+    """缩略图上模糊并向主色着色，再放大到 size。"""
+    thumb = info["thumb"]
+    # 模糊半径按缩略图与画布的比例缩小
+    scale = max(thumb.size) / max(size)
+    radius = max(1.0, blur_radius * scale)
+    small = thumb.filter(ImageFilter.GaussianBlur(radius))
+    small = Image.blend(small, Image.new("RGB", small.size, info["dominant"]), TINT_STRENGTH)
+    return small.resize(size, Image.BILINEAR)
+
+
+def create_palette_background(original_img, output_size, mode=MODE_SOLID, blur_radius=20):
+    """
+    生成主色背景 (RGB)。
+
+    Args:
+        original_img (PIL.Image): 原始图像。
+        output_size (tuple): 背景尺寸 (宽, 高)。
+        mode (str): MODE_SOLID / MODE_GRADIENT2 / MODE_GRADIENT4 / MODE_TINTED。
+        blur_radius (int): 色调低清模糊使用的模糊半径 (按画布尺寸计)。
+
+    Returns:
+        PIL.Image: RGB 背景图像。
+    """
+    size = (max(1, output_size[0]), max(1, output_size[1]))
+    info = extract_palette(original_img)
+    if mode == MODE_GRADIENT2:
+        return _gradient([info["top"], info["bottom"]], (1, 2), size)
+    if mode == MODE_GRADIENT4:
+        return _gradient(info["corners"], (2, 2), size)
+    if mode == MODE_TINTED:
+        return _tinted(info, size, blur_radius)
+    return Image.new("RGB", size, info["dominant"])
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+渲染后端注册表 (registry.py)
+-------------------------------------------------
+为背景、阴影、圆角等渲染阶段提供可插拔的实现选择。
+"shadow_alpha" 为阴影的单通道版本，供融合合成器使用；
+"shadow_contour" 为由前景 alpha 生成的轮廓阴影 (单通道)。
+
+主要功能:
+1.  每个阶段 (stage) 维护一个 {后端名: 函数} 映射，"reference" 即当前
+    model/ 下的 Pillow 实现，更快的实现通过 `register_backend` 以新名字注册。
+2.  支持全局选择 (`set_default_backend`) 与单次调用选择 (`run_stage(..., backend=...)`)。
+    指定的后端在某阶段未注册时，自动回退到 "reference"。
+3.  校验模式 (`set_verify_mode(True)`)：每次调用同时运行 reference 与所选后端，
+    记录逐阶段的最大/平均像素误差以及加速比，通过 `verify_report` 查看。
+    校验模式下返回值始终为 reference 的结果，保证线上输出不受影响。
+4.  按数值区间选择后端 (`set_range_backends`)：例如背景阶段按模糊半径区间选择
+    "reference" 或 "downscale"，由校准结果 (controller/calibration.py) 设置。
+    调用时传入 `range_value`，未显式指定 backend 时按区间选择。
+    后端选择的优先级 (`choose_backend`)：单次调用指定的 backend > `set_default_backend` 显式设置的
+    全局后端 (含显式设为 "reference") > 区间设置 > reference。即校准得到的区间只在未设置全局后端时生效，
+    不会覆盖用户的全局选择。
+5.  阶段钩子 (`set_stage_hook`)：每次执行阶段时进入 hook(stage) 返回的上下文管理器，
+    供遥测 (controller/telemetry.py) 统计各阶段耗时与内存。
+"""
+
+import threading
+import time
+from contextlib import nullcontext
+
+import numpy as np
+
+from model import background, shadow, foreground
+
+REFERENCE = "reference"
+
+# 阶段名 -> {后端名: 实现函数}
+_BACKENDS = {
+    "background": {REFERENCE: background.create_blur_background,
+                   "downscale": background.create_blur_background_downscaled},
+    "shadow": {REFERENCE: shadow.create_shadow_layer},
+    "shadow_alpha": {REFERENCE: shadow.create_shadow_alpha},
+    "shadow_contour": {REFERENCE: shadow.create_contour_shadow},
+    "corners": {REFERENCE: foreground.apply_round_corners},
+}
+
+_state = {
+    "default": None,        # 显式设置的全局后端名，None 表示未设置 (按区间或 reference)
+    "verify": False,        # 是否开启校验模式
+    "hook": None,           # 阶段钩子: hook(stage) -> 上下文管理器
+}
+
+# 阶段名 -> [(区间上限, 后端名)]，按上限升序，上限 None 表示无上限
+_ranges = {}
+
+# 校验统计：阶段名 -> {后端名: 累计数据}
+_verify_stats = {}
+_lock = threading.Lock()
+
+
+def register_backend(stage, name, func=None):
+    """
+    为某个阶段注册一个实现。可直接调用，也可作为装饰器使用：
+
+        @registry.register_backend("background", "fast")
+        def fast_blur_background(...): ...
+
+    Args:
+        stage (str): 阶段名 ("background" / "shadow" / "shadow_alpha" / "shadow_contour" / "corners")。
+        name (str): 后端名，不能为 "reference"。
+        func (callable): 实现函数，签名需与 reference 一致。
+    """
+    if stage not in _BACKENDS:
+        raise ValueError(f"未知的渲染阶段: {stage}")
+    if name == REFERENCE:
+        raise ValueError("reference 后端不可被覆盖")
+
+    def _register(f):
+        with _lock:
+            _BACKENDS[stage][name] = f
+        return f
+
+    if func is None:
+        return _register
+    return _register(func)
+
+
+def available_backends(stage=None):
+    """返回某阶段（或所有阶段）已注册的后端名列表。"""
+    if stage is not None:
+        return list(_BACKENDS.get(stage, {}).keys())
+    return {s: list(b.keys()) for s, b in _BACKENDS.items()}
+
+
+def set_default_backend(name):
+    """设置全局默认后端 (优先于区间设置)，传入 None 取消设置，恢复为按区间选择或 reference。"""
+    _state["default"] = name or None
+
+
+def get_default_backend():
+    """返回当前全局默认后端名。"""
+    return _state["default"] or REFERENCE
+
+
+def set_verify_mode(enabled):
+    """开启/关闭校验模式。"""
+    _state["verify"] = bool(enabled)
+
+
+def set_range_backends(stage, ranges):
+    """
+    设置某阶段按数值区间选择的后端。
+
+    Args:
+        stage (str): 阶段名。
+        ranges (list): [(区间上限, 后端名)]，数值 <= 上限时使用该后端；上限为 None 表示无上限。
+            传入空列表或 None 清除区间设置。
+    """
+    if stage not in _BACKENDS:
+        raise ValueError(f"未知阶段: {stage}")
+    ordered = sorted(ranges or [], key=lambda r: float("inf") if r[0] is None else r[0])
+    with _lock:
+        if ordered:
+            _ranges[stage] = [(limit, name) for limit, name in ordered]
+        else:
+            _ranges.pop(stage, None)
+
+
+def set_stage_hook(hook):
+    """设置阶段钩子 hook(stage) -> 上下文管理器，传入 None 取消。"""
+    _state["hook"] = hook
+
+
+def range_backend(stage, value):
+    """返回某阶段在数值 value 下按区间选择的后端名，无区间设置时返回 None。"""
+    for limit, name in _ranges.get(stage, ()):
+        if limit is None or value <= limit:
+            return name
+    return None
+
+
+def choose_backend(stage, backend=None, range_value=None):
+    """
+    按优先级选择后端名：指定的 backend > 显式设置的全局后端 > 区间设置；都没有时返回 None (reference)。
+    """
+    if backend:
+        return backend
+    if _state["default"] is not None:
+        return _state["default"]
+    if range_value is not None:
+        return range_backend(stage, range_value)
+    return None
+
+
+def resolve(stage, backend=None):
+    """
+    解析某阶段实际使用的后端。
+
+    Returns:
+        tuple: (后端名, 实现函数)。未注册时回退到 reference。
+    """
+    impls = _BACKENDS[stage]
+    name = backend or _state["default"] or REFERENCE
+    if name not in impls:
+        name = REFERENCE
+    return name, impls[name]
+
+
+def effective_backends(backend=None, range_values=None):
+    """
+    各阶段实际生效的后端名 (渲染缓存把它计入缓存键，重新校准或换机器后不会命中其他方法的结果)。
+
+    Args:
+        backend (str): 调用时指定的后端 (参数 render_backend)，None 表示按全局设置或区间选择。
+        range_values (dict): {阶段名: 按区间选择后端用的数值}，如 {"background": 模糊半径}。
+
+    Returns:
+        dict: {阶段名: 后端名}；校验模式下输出来自 reference，全部为 "reference"。
+    """
+    range_values = range_values or {}
+    names = {}
+    for stage in _BACKENDS:
+        chosen = choose_backend(stage, backend, range_values.get(stage))
+        names[stage] = REFERENCE if _state["verify"] else resolve(stage, chosen)[0]
+    return names
+
+
+def run_stage(stage, *args, backend=None, range_value=None, **kwargs):
+    """
+    按选择的后端执行某个渲染阶段。
+
+    Args:
+        stage (str): 阶段名。
+        backend (str): 本次调用指定的后端，None 表示按全局设置或区间选择 (见 choose_backend)。
+        range_value (float): 用于按区间选择后端的数值 (如模糊半径)。
+        *args, **kwargs: 透传给实现函数。
+
+    Returns:
+        PIL.Image: 阶段输出图像。
+    """
+    name, func = resolve(stage, choose_backend(stage, backend, range_value))
+    hook = _state["hook"]
+    with hook(stage) if hook is not None else nullcontext():
+        if not _state["verify"] or name == REFERENCE:
+            return func(*args, **kwargs)
+        return _run_verified(stage, name, func, args, kwargs)
+
+
+def _run_verified(stage, name, func, args, kwargs):
+    """校验模式：reference 与所选后端都运行并比较，返回 reference 的结果。"""
+    t0 = time.perf_counter()
+    ref_out = _BACKENDS[stage][REFERENCE](*args, **kwargs)
+    t1 = time.perf_counter()
+    cand_out = func(*args, **kwargs)
+    t2 = time.perf_counter()
+    max_err, mean_err = _pixel_error(ref_out, cand_out)
+    _record(stage, name, max_err, mean_err, t1 - t0, t2 - t1)
+    return ref_out
+
+
+def _pixel_error(ref_img, cand_img):
+    """计算两幅图像在 RGBA 空间下的最大/平均绝对误差。尺寸不一致视为最大误差。"""
+    if ref_img.size != cand_img.size:
+        return 255, 255.0
+    if ref_img.mode != cand_img.mode:
+        ref_img, cand_img = ref_img.convert("RGBA"), cand_img.convert("RGBA")
+    a = np.asarray(ref_img, dtype=np.int16)
+    b = np.asarray(cand_img, dtype=np.int16)
+    diff = np.abs(a - b)
+    if diff.size == 0:
+        return 0, 0.0
+    return int(diff.max()), float(diff.mean())
+
+
+def _record(stage, name, max_err, mean_err, ref_time, cand_time):
+    """累计一次校验结果。"""
+    with _lock:
+        entry = _verify_stats.setdefault(stage, {}).setdefault(name, {
+            "calls": 0, "max_error": 0, "mean_error_sum": 0.0,
+            "reference_time": 0.0, "backend_time": 0.0,
+        })
+        entry["calls"] += 1
+        entry["max_error"] = max(entry["max_error"], max_err)
+        entry["mean_error_sum"] += mean_err
+        entry["reference_time"] += ref_time
+        entry["backend_time"] += cand_time
+
+
+def verify_report():
+    """
+    返回校验模式下累计的逐阶段报告。
+
+    Returns:
+        dict: {阶段名: {后端名: {"calls", "max_error", "mean_error", "speedup"}}}
+    """
+    report = {}
+    with _lock:
+        for stage, backends in _verify_stats.items():
+            for name, e in backends.items():
+                calls = max(1, e["calls"])
+                speedup = e["reference_time"] / e["backend_time"] if e["backend_time"] > 0 else float("inf")
+                report.setdefault(stage, {})[name] = {
+                    "calls": e["calls"],
+                    "max_error": e["max_error"],
+                    "mean_error": e["mean_error_sum"] / calls,
+                    "speedup": speedup,
+                }
+    return report
+
+
+def reset_verify_stats():
+    """清空校验统计。"""
+    with _lock:
+        _verify_stats.clear()
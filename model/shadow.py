@@ -1,10 +1,40 @@
-import math
+"""
+阴影图层
+----------------------------------------------------------------
+1. create_shadow_alpha(): 按原图位置与圆角绘制圆角矩形，扩散、模糊后得到阴影 alpha (共享，与内容无关)。
+   扩散使用行列分离的最大值滤波 `dilate`，结果与 MaxFilter 相同。
+2. create_contour_shadow(): 轮廓阴影，由前景 (透明 PNG 抠图) 的 alpha 通道生成，阴影贴合主体形状。
+   扩散与模糊在按模糊半径选定的缩小倍数下计算 (缩小后模糊半径约 CONTOUR_TARGET_RADIUS)，
+   只处理前景及其阴影范围所在的区域，再放大贴回画布，成本与矩形阴影相当，且不随原图尺寸明显增长。
+"""
+
 import numpy as np
 from PIL import Image, ImageFilter, ImageDraw
 
+# 阴影形状 (界面显示值)
+SHAPE_RECT = "矩形"
+SHAPE_CONTOUR = "透明轮廓"
+SHADOW_SHAPES = (SHAPE_RECT, SHAPE_CONTOUR)
+
+# 轮廓阴影缩小计算时的目标模糊半径 (与背景 downscale 模糊一致)
+CONTOUR_TARGET_RADIUS = 8
+
 def create_shadow_layer(orig_size, output_size, corner_radius=0, spread_radius=10, blur_radius=20, opacity=0.5, offset_x=0, offset_y=0):
     """
     根据原图尺寸和参数生成阴影层 (RGBA图像)。
+    即黑色图层 + create_shadow_alpha 生成的 alpha 通道，参数含义相同。
+    """
+    shadow_mask = create_shadow_alpha(orig_size, output_size, corner_radius, spread_radius,
+                                      blur_radius, opacity, offset_x, offset_y)
+    out_w, out_h = output_size
+    # 生成RGBA阴影图层（黑色），将遮罩直接合并为alpha通道，只产生一次RGBA拷贝
+    black = Image.new("L", (out_w, out_h), 0)
+    return Image.merge("RGBA", (black, black, black, shadow_mask))
+
+
+def create_shadow_alpha(orig_size, output_size, corner_radius=0, spread_radius=10, blur_radius=20, opacity=0.5, offset_x=0, offset_y=0):
+    """
+    生成阴影的 alpha 通道 (L图像)。阴影为纯黑色，融合合成器只需要这一通道。
     orig_size: 原图尺寸 (宽, 高)。
     output_size: 输出画布尺寸 (宽, 高)。
     corner_radius: 原图圆角半径，用于确定阴影形状的圆角。
@@ -12,7 +42,7 @@ def create_shadow_layer(orig_size, output_size, corner_radius=0, spread_radius=1
     blur_radius: 阴影模糊程度（高斯模糊半径）。
     opacity: 阴影不透明度 (0~1之间，小数)。
     offset_x, offset_y: 阴影偏移量（相对于原图位置，正值表示向右/向下偏移，负值表示向左/向上偏移）。
-    返回值: 生成的阴影层图像 (RGBA)。
+    返回值: 阴影 alpha (L)。
     """
     orig_w, orig_h = orig_size
     out_w, out_h = output_size
@@ -30,36 +60,91 @@ def create_shadow_layer(orig_size, output_size, corner_radius=0, spread_radius=1
     else:
         # 绘制普通矩形
         draw.rectangle(rect_coords, fill=255)
-    # 阴影扩散：使用最大值滤波 (MaxFilter) 扩大白色区域
+    # 阴影扩散：最大值滤波扩大白色区域 (与 MaxFilter(2*spread_radius+1) 相同，
+    # 按行列分离计算，成本与半径近似无关；MaxFilter 的成本随半径平方增长)
     if spread_radius > 0:
-        # Pillow的MaxFilter的kernel size应为 2*spread_radius + 1
-        size = spread_radius * 2 + 1
-        shadow_mask = shadow_mask.filter(ImageFilter.MaxFilter(size=size))
+        shadow_mask = Image.fromarray(dilate(np.asarray(shadow_mask), spread_radius))
     # 应用高斯模糊，使阴影边缘柔和
     if blur_radius > 0:
         shadow_mask = shadow_mask.filter(ImageFilter.GaussianBlur(radius=blur_radius))
-    # 将灰度遮罩转换为NumPy数组以调整透明度分布（实现近似二次平方衰减）
-    mask_array = np.array(shadow_mask, dtype=float) / 255.0
-    # 二次衰减：灰度值取平方，使边缘更透明
-    mask_array = mask_array ** 2
-    # 应用整体不透明度参数
-    mask_array = mask_array * opacity
-    # 限制在[0,1]范围并转换回0-255灰度值
-    mask_array = np.clip(mask_array, 0, 1)
-    shadow_mask = Image.fromarray((mask_array * 255).astype('uint8'), mode='L')
-    # 生成RGBA阴影图层（黑色），将计算得到的灰度遮罩用作alpha通道
-    shadow_layer = Image.new("RGBA", (out_w, out_h), (0, 0, 0, 0))
-    # 将阴影遮罩作为alpha应用到黑色图层
-    black_bg = Image.new("RGB", (out_w, out_h), (0, 0, 0))
-    black_bg.putalpha(shadow_mask)
-    shadow_layer = black_bg.convert("RGBA")
-    # 如果有偏移量，则将阴影层移动偏移后的位置
+    # 调整透明度分布（近似二次平方衰减）：灰度值取平方后乘以整体不透明度。
+    # 该映射只与单个像素值有关，用 256 项查找表代替整图浮点数组运算，结果与逐像素计算一致。
+    shadow_mask = shadow_mask.point(_falloff_lut(opacity))
+    # 如果有偏移量，先在单通道遮罩上移动（数据量仅为 RGBA 的 1/4）
     if offset_x != 0 or offset_y != 0:
-        shifted_layer = Image.new("RGBA", (out_w, out_h), (0, 0, 0, 0))
-        # 计算粘贴位置，对于负偏移，需要调整起始坐标
-        paste_x = offset_x
-        paste_y = offset_y
-        # 使用paste将阴影层偏移后粘贴，如果偏移为负，paste会自动裁剪
-        shifted_layer.paste(shadow_layer, (paste_x, paste_y))
-        shadow_layer = shifted_layer
-    return shadow_layer
+        shifted_mask = Image.new("L", (out_w, out_h), 0)
+        # 使用paste将遮罩偏移后粘贴，如果偏移为负，paste会自动裁剪
+        shifted_mask.paste(shadow_mask, (offset_x, offset_y))
+        shadow_mask = shifted_mask
+    return shadow_mask
+
+
+def _falloff_lut(opacity):
+    """生成阴影衰减查找表：v -> clip((v/255)^2 * opacity, 0, 1) * 255 (截断取整)。"""
+    mask_array = (np.arange(256, dtype=float) / 255.0) ** 2 * opacity
+    mask_array = np.clip(mask_array, 0, 1)
+    return [int(v) for v in (mask_array * 255).astype('uint8')]
+
+
+def _max_window(arr, radius, axis):
+    """沿一个轴做窗口为 2*radius+1 的最大值滤波 (窗口倍增，O(log r) 次数组运算)，边界外按 0 处理。"""
+    width = 2 * radius + 1
+    n = arr.shape[axis]
+    pad = [(0, 0)] * arr.ndim
+    pad[axis] = (radius, radius)
+    a = np.pad(arr, pad)
+
+    def part(x, start, length):
+        idx = [slice(None)] * x.ndim
+        idx[axis] = slice(start, start + length)
+        return x[tuple(idx)]
+
+    # a[j] 依次变为原数组 [j, j+span) 的最大值
+    span = 1
+    while span * 2 <= width:
+        a = np.maximum(part(a, 0, a.shape[axis] - span), part(a, span, a.shape[axis] - span))
+        span *= 2
+    return np.maximum(part(a, 0, n), part(a, width - span, n))
+
+
+def dilate(arr, radius):
+    """方形最大值滤波 (与 ImageFilter.MaxFilter(2*radius+1) 结果相同)，按行列分离计算。"""
+    if radius <= 0:
+        return arr
+    return _max_window(_max_window(arr, radius, 0), radius, 1)
+
+
+def create_contour_shadow(alpha, output_size, spread_radius=10, blur_radius=20, opacity=0.5, offset_x=0, offset_y=0):
+    """
+    由前景 alpha 生成轮廓阴影的 alpha 通道 (L图像)，位置约定与 create_shadow_alpha 相同
+    (前景居中于输出画布，再按偏移量移动)。
+    alpha: 前景的 alpha 通道 (L，原图尺寸，已包含圆角)。
+    其余参数含义同 create_shadow_alpha。
+    返回值: 阴影 alpha (L，输出画布尺寸)。
+    """
+    orig_w, orig_h = alpha.size
+    out_w, out_h = output_size
+    orig_x = (out_w - orig_w) // 2
+    orig_y = (out_h - orig_h) // 2
+    # 缩小倍数: 缩小后的模糊半径约为 CONTOUR_TARGET_RADIUS
+    factor = max(1, min(int(blur_radius // CONTOUR_TARGET_RADIUS), orig_w // 4, orig_h // 4))
+    # 工作区域: 前景外扩 扩散 + 3 倍模糊半径 (高斯核的有效范围)，并对齐到缩小倍数
+    reach = spread_radius + int(np.ceil(3 * blur_radius))
+    reach = -(-reach // factor) * factor
+    work_w = -(-(orig_w + 2 * reach) // factor) * factor
+    work_h = -(-(orig_h + 2 * reach) // factor) * factor
+    work = Image.new("L", (work_w, work_h), 0)
+    work.paste(alpha, (reach, reach))
+    small = work.reduce(factor) if factor > 1 else work  # 整数倍盒式缩小
+    # 扩散 (缩小后的半径) 与模糊
+    spread_small = int(round(spread_radius / factor))
+    if spread_small > 0:
+        small = Image.fromarray(dilate(np.asarray(small), spread_small))
+    if blur_radius > 0:
+        small = small.filter(ImageFilter.GaussianBlur(radius=blur_radius / factor))
+    work = small.resize((work_w, work_h), Image.BILINEAR) if factor > 1 else small
+    # 衰减映射只作用于工作区域，再贴到画布上 (paste 自动裁剪画布外部分)
+    work = work.point(_falloff_lut(opacity))
+    shadow_mask = Image.new("L", (out_w, out_h), 0)
+    shadow_mask.paste(work, (orig_x - reach + offset_x, orig_y - reach + offset_y))
+    return shadow_mask
@@ -0,0 +1,141 @@
+"""
+水印图层 (Logo + 文字)
+----------------------------------------------------------------
+在输出画布上叠加工作室 Logo (PNG 等位图或 SVG) 与文字水印，由 processing_controller
+作为小图层交给合成器，只在水印所在区域混合。
+
+性能要点:
+1. Logo 按 (文件, 修改时间, 目标宽度) 光栅化并缓存，SVG 直接以目标宽度光栅化 (需要 cairosvg)。
+2. 文字复用 banner.render_text_strip 的缓存。
+3. 组合后的水印 (Logo + 文字 + 不透明度) 按 (素材, 目标尺寸, 样式) 缓存为只读 NumPy 数组，
+   同一批尺寸相同的输出只生成一次，每张图片只剩水印区域的 alpha 混合，不产生整幅画布的合成。
+"""
+
+import io
+import os
+from functools import lru_cache
+import numpy as np
+from PIL import Image
+from model import banner
+
+try:
+    import cairosvg  # 可选依赖，SVG Logo 需要
+except ImportError:
+    cairosvg = None
+
+# 水印位置 (界面显示值)
+POSITIONS = ("右下", "左下", "右上", "左上", "居中")
+
+# Logo 与文字之间的间距 (相对文字高度)
+_GAP_RATIO = 0.4
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+@lru_cache(maxsize=32)
+def _rasterize_logo(path, mtime, width):
+    """把 Logo 光栅化为指定宽度的 RGBA 图像 (SVG 直接按宽度渲染)，失败时返回 None。"""
+    width = max(1, int(width))
+    try:
+        if path.lower().endswith(".svg"):
+            if cairosvg is None:
+                print(f"无法加载 SVG 水印 {path}: 需要安装 cairosvg")
+                return None
+            data = cairosvg.svg2png(url=path, output_width=width)
+            logo = Image.open(io.BytesIO(data)).convert("RGBA")
+        else:
+            with Image.open(path) as src:
+                logo = src.convert("RGBA")
+    except (OSError, ValueError) as e:
+        print(f"无法加载水印 Logo {path}: {e}")
+        return None
+    bbox = logo.getchannel("A").getbbox()
+    if bbox:
+        logo = logo.crop(bbox)
+    if logo.width != width:
+        logo = logo.resize((width, max(1, round(logo.height * width / logo.width))), Image.LANCZOS)
+    return logo
+
+
+@lru_cache(maxsize=64)
+def _build_watermark(logo_path, mtime, text, width, opacity, text_color, font_path):
+    """组合 Logo 与文字 (横向排列，整体宽度为 width) 并应用不透明度，返回只读 (h, w, 4) 数组。"""
+    color = banner.TEXT_COLORS.get(text_color, banner.TEXT_COLORS["白色"])
+    parts = []
+    if logo_path and mtime is not None:
+        parts.append("logo")
+    if text:
+        parts.append("text")
+    if not parts:
+        return None
+
+    # 先按参考字号排版求出缩放比例，再按最终尺寸光栅化 Logo 与文字 (不对位图做二次缩放)
+    ref_h = 64
+    strip = banner.render_text_strip(text, font_path, ref_h, color) if text else None
+    logo_ref = _rasterize_logo(logo_path, mtime, 256) if "logo" in parts else None
+    logo_ref_w = round(logo_ref.width * ref_h / logo_ref.height) if logo_ref is not None else 0
+    gap = round(ref_h * _GAP_RATIO) if logo_ref is not None and strip is not None else 0
+    ref_w = logo_ref_w + gap + (strip.width if strip is not None else 0)
+    if ref_w <= 0:
+        return None
+    scale = width / ref_w
+    h = max(1, round(ref_h * scale))
+
+    logo = _rasterize_logo(logo_path, mtime, max(1, round(logo_ref_w * scale))) if logo_ref is not None else None
+    text_img = banner.render_text_strip(text, font_path, h, color) if strip is not None else None
+    x_text = logo.width + round(gap * scale) if logo is not None else 0
+    total_w = x_text + (text_img.width if text_img is not None else 0)
+    total_h = max(im.height for im in (logo, text_img) if im is not None)
+    canvas = Image.new("RGBA", (max(1, total_w), total_h), (0, 0, 0, 0))
+    if logo is not None:
+        canvas.alpha_composite(logo, (0, (total_h - logo.height) // 2))
+    if text_img is not None:
+        canvas.alpha_composite(text_img, (x_text, (total_h - text_img.height) // 2))
+
+    arr = np.array(canvas)
+    if opacity < 100:
+        alpha = arr[..., 3].astype(np.uint16) * max(0, int(opacity))
+        arr[..., 3] = (alpha + 50) // 100
+    arr.setflags(write=False)
+    return arr
+
+
+def create_watermark(canvas_size, logo_path=None, text="", scale_pct=15, opacity=60,
+                     text_color="白色", font_path=None):
+    """
+    生成水印图层 (缓存)。
+
+    Args:
+        canvas_size (tuple): 画布尺寸 (宽, 高)。
+        logo_path (str): Logo 文件路径 (PNG/JPEG/SVG 等)，可为空。
+        text (str): 水印文字，可为空。
+        scale_pct (float): 水印宽度占画布宽度的百分比。
+        opacity (int): 不透明度 (0-100)。
+        text_color (str): 文字颜色 ("白色" / "黑色")。
+        font_path (str): 字体文件，None 时使用默认字体。
+
+    Returns:
+        np.ndarray: 只读的 (h, w, 4) uint8 直通 alpha 数组；没有可用素材时返回 None。
+    """
+    width = max(1, round(canvas_size[0] * scale_pct / 100))
+    mtime = _mtime(logo_path) if logo_path else None
+    if logo_path and mtime is None:
+        print(f"水印 Logo 不存在: {logo_path}")
+    return _build_watermark(logo_path or None, mtime, text or "", width, int(opacity), text_color, font_path)
+
+
+def watermark_position(canvas_size, asset_size, position="右下", margin_pct=3):
+    """计算水印左上角在画布上的位置，边距为画布短边的 margin_pct%。"""
+    cw, ch = canvas_size
+    w, h = asset_size
+    m = round(min(cw, ch) * margin_pct / 100)
+    x = {"左": m, "右": cw - w - m}
+    y = {"上": m, "下": ch - h - m}
+    if position == "居中" or position not in POSITIONS:
+        return (cw - w) // 2, (ch - h) // 2
+    return x[position[0]], y[position[1]]
@@ -0,0 +1,46 @@
+"""
+Streamlit 版本兼容工具
+-------------------------------------------------
+fragment(): 局部重跑装饰器。
+- Streamlit >= 1.37 使用 st.fragment；1.33~1.36 使用 st.experimental_fragment；
+- 更旧的版本没有局部重跑，退化为普通函数（整页重跑），run_every 轮询不可用。
+rerun(): 在局部重跑区域内只重跑该区域 (st.rerun(scope="fragment"))，不支持时整页重跑。
+"""
+
+import streamlit as st
+from streamlit.errors import StreamlitAPIException
+
+_FRAGMENT = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+
+# 当前 Streamlit 是否支持局部重跑
+HAS_FRAGMENT = _FRAGMENT is not None
+
+
+def fragment(func=None, *, run_every=None):
+    """
+    局部重跑装饰器，用法与 st.fragment 相同：
+
+        @fragment
+        def section(): ...
+
+        @fragment(run_every=1)
+        def poll(): ...
+    """
+    if _FRAGMENT is None:
+        return func if func is not None else (lambda f: f)
+    if func is None:
+        return _FRAGMENT(run_every=run_every)
+    return _FRAGMENT(func, run_every=run_every)
+
+
+def rerun(scope="app"):
+    """
+    触发重跑。scope="fragment" 时只重跑当前局部区域；
+    Streamlit 不支持该参数或当前不在局部区域内时退化为整页重跑。
+    """
+    if scope == "fragment" and HAS_FRAGMENT:
+        try:
+            st.rerun(scope="fragment")
+        except (TypeError, StreamlitAPIException):
+            pass
+    st.rerun()
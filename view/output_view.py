@@ -1,7 +1,39 @@
-import io, os, zipfile, streamlit as st
-from controller import processing_controller
+import io, os, uuid, streamlit as st
+from controller import export_jobs
+from view.compat import fragment, rerun, HAS_FRAGMENT
 # 导入 DEFAULTS 以便获取所有参数键和默认值
-from view.param_view import DEFAULTS
+from view.param_view import DEFAULTS, RATIO_PRESETS
+
+# 多比例导出的平台预设: 标签 -> 比例
+PLATFORM_PRESETS = {
+    "抖音 9:16": (9, 16),
+    "小红书 3:4": (3, 4),
+    "B站 16:9": (16, 9),
+}
+
+# 管理视图：设置 BGF_EXPORT_ADMIN=1 时显示所有会话的导出任务 (含未记录所有者的旧任务)
+ADMIN_VIEW = os.environ.get("BGF_EXPORT_ADMIN", "") not in ("", "0")
+
+# 进程启动后载入上次运行留下的导出任务 (只载入不续传)，每个会话只显示自己的任务
+export_jobs.recover_jobs()
+
+
+def _owner_token():
+    """
+    本浏览器会话的导出任务所有者标识。
+    保存在页面地址的查询参数 owner 中，刷新页面或服务重启后用同一地址仍能找回自己的任务。
+    """
+    token = st.session_state.get("export_owner")
+    if token is None:
+        query = getattr(st, "query_params", None)
+        token = query.get("owner") if query is not None else None
+        if not token:
+            token = uuid.uuid4().hex
+            if query is not None:
+                query["owner"] = token
+        st.session_state["export_owner"] = token
+    return token
+
 
 def _ensure_output():
     """确保 output 目录存在"""
@@ -34,31 +66,35 @@ def _get_current_export_params():
     return params
 
 
-def _export_one(img, fname, p):
-    """处理单张图片并返回文件名和数据流"""
-    # process_single_image 会处理尺寸计算，不再需要预先计算 output_size
-    # p["output_size"] = (cw, ch) # 移除
-    out_img = processing_controller.process_single_image(img, p)
-    if out_img is None: # 处理失败的情况
-        st.error(f"处理图片 '{fname}' 失败。")
+def _export_one(img, fname, p, meta=None):
+    """处理单张图片并返回文件名和数据流 (原图与参数未变化时直接读取渲染缓存)"""
+    try:
+        entries = export_jobs.render_outputs(img, fname, p, meta)
+    except Exception as e: # 处理失败的情况
+        st.error(f"处理图片 '{fname}' 失败: {e}")
         return None, None
 
-    buf = io.BytesIO()
-    out_img.save(buf, format="PNG")
-    buf.seek(0)
-    # 构造输出文件名
-    base, ext = os.path.splitext(fname)
-    out_name = f"{base}_output.png" # 保证是 png
-    return out_name, buf
+    out_name, data = entries[0]
+    return out_name, io.BytesIO(data)
 
 def show_download_section():
-    """显示导出按钮区域"""
+    """显示导出按钮区域 (局部重跑) 和后台导出任务列表 (单独轮询刷新)"""
     if "images" not in st.session_state or not st.session_state["images"]:
         # st.info("请先上传图片。") # 避免重复提示，app.py 已有
         return
+    _show_export_controls()
+    _show_export_jobs()
+
 
+@fragment
+def _show_export_controls():
+    """
+    导出选项与按钮。作为局部重跑区域，点击按钮只重跑本区域；
+    导出参数在点击时从 session_state 读取，因此参数区域的修改无需重跑本区域。
+    """
     images = st.session_state["images"]
     fnames = st.session_state["filenames"]
+    metas = st.session_state.get("metadata") or [None] * len(images)
 
     # *** 修改点：直接从 state 读取参数 ***
     export_params = _get_current_export_params() # 获取最新的参数
@@ -74,7 +110,7 @@ def show_download_section():
                 fname_to_export = fnames[idx]
                 st.info(f"正在处理: {fname_to_export}...")
                 # 使用最新的参数进行处理
-                out_name, buf = _export_one(img_to_export, fname_to_export, export_params.copy())
+                out_name, buf = _export_one(img_to_export, fname_to_export, export_params.copy(), metas[idx])
                 if out_name and buf:
                     _ensure_output()
                     # 可选：保存到服务器 output 目录
@@ -91,30 +127,121 @@ def show_download_section():
 
     with col2:
         st.write("#### 批量导出") # 添加小标题
+        # 导出在后台任务中执行，不阻塞页面；导出期间可以继续调整参数
         if st.button("批量导出为 ZIP"):
             _ensure_output()
-            zip_mem = io.BytesIO()
-            processed_count = 0
-            with zipfile.ZipFile(zip_mem, "w") as zf:
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                total_images = len(images)
-                for i, (img, fname) in enumerate(zip(images, fnames)):
-                    status_text.text(f"正在处理第 {i+1}/{total_images} 张: {fname}")
-                    # 对每张图片使用最新的参数进行处理
-                    out_name, buf = _export_one(img, fname, export_params.copy())
-                    if out_name and buf:
-                        zf.writestr(out_name, buf.getvalue())
-                        processed_count += 1
-                    else:
-                        status_text.text(f"处理第 {i+1}/{total_images} 张 '{fname}' 失败，已跳过。")
-                    progress_bar.progress((i + 1) / total_images)
-
-            zip_mem.seek(0)
-            zip_name = "processed_images.zip"
-            # 可选：保存 ZIP 到服务器 output 目录
-            # with open(os.path.join("output", zip_name), "wb") as f:
-            #     f.write(zip_mem.getbuffer())
-            st.download_button("下载 ZIP 压缩包", zip_mem, file_name=zip_name, mime="application/zip", key="dl_zip")
-            # st.success(f"ZIP 已保存 output/{zip_name}") # 如果不保存到服务器则移除
-            status_text.text(f"ZIP 文件已准备好，包含 {processed_count}/{total_images} 张处理成功的图片。")
\ No newline at end of file
+            export_jobs.submit_export(images, fnames, export_params, metas,
+                                      name=f"批量导出 {len(images)} 张",
+                                      sources=st.session_state.get("source_files"),
+                                      owner=_owner_token())
+            rerun()  # 整页重跑，任务列表切换为轮询刷新
+
+    # --- 多比例导出：一次处理输出多个平台比例 ---
+    with st.expander("多比例导出 (一次生成多个平台尺寸)"):
+        presets = {**PLATFORM_PRESETS, **RATIO_PRESETS}
+        chosen = st.multiselect("目标比例", options=list(presets.keys()), default=list(PLATFORM_PRESETS.keys()), key="multi_ratio_targets")
+        # 去重：不同标签可能对应同一比例
+        ratios = list(dict.fromkeys(presets[label] for label in chosen))
+        if st.button("多比例批量导出为 ZIP", disabled=not ratios):
+            _ensure_output()
+            export_jobs.submit_export(images, fnames, export_params, metas, ratios=ratios,
+                                      name=f"多比例导出 {len(images)} 张 × {len(ratios)} 个比例",
+                                      sources=st.session_state.get("source_files"),
+                                      owner=_owner_token())
+            rerun()
+
+
+def _show_job_metrics(job):
+    """显示已结束任务的遥测摘要：吞吐量、写出字节、峰值内存、各阶段耗时。"""
+    m = job.metrics.summary()
+    rss = m["peak_rss_bytes"]
+    text = (f"{m['images']} 张，用时 {m['elapsed_s']:.1f} 秒，{m['images_per_sec']:.2f} 张/秒，"
+            f"写出 {m['bytes_written'] / 1e6:.1f} MB")
+    if rss:
+        text += f"，进程峰值内存 {rss / 1e9:.2f} GB"
+    if m["failures"]:
+        text += "，失败: " + ", ".join(f"{k} × {v}" for k, v in m["failures"].items())
+    st.caption(text)
+    if m["stage_seconds"]:
+        st.caption("阶段耗时: " + "，".join(f"{k} {v:.2f}s/{m['stage_calls'][k]}次"
+                                         for k, v in sorted(m["stage_seconds"].items(), key=lambda kv: -kv[1])))
+
+
+def _visible_job_ids():
+    return export_jobs.list_jobs(owner=None if ADMIN_VIEW else _owner_token())
+
+
+def _jobs_where(job_ids, active):
+    """按是否进行中筛选任务 id (已被移除的任务跳过)。"""
+    jobs = [export_jobs.get_job(j) for j in job_ids]
+    return [job.id for job in jobs if job is not None and job.active == active]
+
+
+def _show_export_jobs():
+    """
+    显示本会话 (所有者标识) 的后台导出任务。进行中的任务放在每秒轮询的局部区域，
+    已结束的任务放在不轮询的局部区域：空闲时不产生周期性重跑，轮询时也不会重复渲染已结束任务。
+    """
+    job_ids = _visible_job_ids()
+    if not job_ids:
+        return
+    st.write("#### 导出任务")
+    if not HAS_FRAGMENT:
+        st.button("刷新进度", key="refresh_export_jobs")
+    if _jobs_where(job_ids, active=True):
+        _export_jobs_live()
+    _export_jobs_finished()
+
+
+@fragment(run_every=1)
+def _export_jobs_live():
+    """进行中的任务：每秒只刷新此区域；全部结束后整页重跑一次，结束的任务移到下方区域。"""
+    job_ids = _jobs_where(_visible_job_ids(), active=True)
+    _render_export_jobs(job_ids)
+    if not job_ids:
+        rerun()
+
+
+@fragment
+def _export_jobs_finished():
+    """已结束的任务：只在按钮操作时重跑。"""
+    _render_export_jobs(_jobs_where(_visible_job_ids(), active=False))
+
+
+def _render_export_jobs(job_ids):
+    """任务列表：进度、取消、下载、续传、移除。"""
+    # 已读取的 ZIP 内容 (任务 id -> bytes)，只在用户点击“准备下载”时读取一次
+    prepared = st.session_state.setdefault("export_downloads", {})
+    for job_id in reversed(job_ids):
+        job = export_jobs.get_job(job_id)
+        if job is None:  # 刚被移除
+            continue
+        st.progress(job.progress, text=f"{job.name} — {job.status} ({job.done}/{job.total})")
+        cols = st.columns(3)
+        if job.active:
+            if cols[0].button("取消", key=f"cancel_{job_id}"):
+                export_jobs.cancel_job(job_id)
+        elif job.status == export_jobs.STATUS_DONE:
+            if job_id in prepared:
+                cols[0].download_button("下载 ZIP", prepared[job_id], file_name=f"processed_{job_id}.zip",
+                                        mime="application/zip", key=f"dl_{job_id}")
+            elif cols[0].button("准备下载", key=f"prepare_{job_id}", help="读取 ZIP 文件后显示下载按钮。"):
+                data = export_jobs.read_artifact(job_id)
+                if data is None:
+                    cols[0].caption("ZIP 文件已不存在。")
+                else:
+                    prepared[job_id] = data
+                    rerun(scope="fragment")
+        elif job.resumable and cols[0].button("继续", key=f"resume_{job_id}",
+                                              help="跳过已完成的图片，继续导出剩余部分。"):
+            export_jobs.resume_job(job_id)
+            rerun()  # 切换为轮询刷新
+        if not job.active and cols[1].button("移除", key=f"remove_{job_id}"):
+            prepared.pop(job_id, None)
+            export_jobs.remove_job(job_id)
+        if job.failed:
+            cols[2].caption(f"{len(job.failed)} 张失败: " + ", ".join(job.failed[:5]))
+        if not job.active:
+            _show_job_metrics(job)
+        if job.error:
+            st.error(f"任务出错: {job.error}")
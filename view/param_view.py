@@ -20,8 +20,15 @@
     - 添加更详细的中文注释，统一代码风格。
 """
 
+import hashlib
 import math
+import os
 import streamlit as st
+from view.compat import rerun
+from model import watermark, shadow
+
+# 上传的水印 Logo 保存目录 (按内容哈希命名，参数中只保存路径)
+WATERMARK_DIR = os.path.join("cache", "watermarks")
 
 # -------- 默认参数表 (DEFAULTS) --------
 # 定义所有可配置参数及其默认值
@@ -29,10 +36,12 @@ import streamlit as st
 DEFAULTS = {
     "background_enabled": True,          # 是否启用背景
     "background_scale": 1.0,             # 背景内容缩放比例 (>=1.0) - 相关滑块已注释掉
+    "background_mode": "毛玻璃模糊",      # 背景模式 ("毛玻璃模糊", "主色纯色", "双色渐变", "四角渐变", "色调低清模糊")
     "background_blur": 20,               # 背景高斯模糊半径 (像素)
     "background_mask": "无",             # 背景蒙版类型 ("无", "白色透明蒙版", "黑色透明蒙版")
     "background_mask_opacity": 40,       # 背景蒙版不透明度 (0-100, 百分比)
     "shadow_enabled": True,              # 是否启用阴影
+    "shadow_shape": "矩形",              # 阴影形状 ("矩形" 或 "透明轮廓"，后者按透明 PNG 的主体轮廓生成)
     "shadow_spread": 16,                 # 阴影扩散半径 (像素)
     "shadow_blur": 30,                   # 阴影模糊半径 (像素)
     "shadow_opacity": 0.72,              # 阴影不透明度 (0.0-1.0)
@@ -64,6 +73,40 @@ DEFAULTS = {
     "shadow_follow_margin": True,        # 阴影是否根据边距差值自动调整位置
     "ratio": None,                       # 输出画面比例 (None 或 (宽比例, 高比例) tuple)
     "ind_margin": False,                 # 是否启用独立边距控制
+    "output_max_edge": 0,                # 输出画布长边上限 (像素，0 表示不限制)
+    "banner_enabled": False,             # 是否显示相机/镜头参数信息条
+    "banner_height_pct": 8,              # 信息条高度 (占画布高度百分比)
+    "banner_text_color": "白色",         # 信息条文字颜色 ("白色" 或 "黑色")
+    "banner_logo": True,                 # 是否显示品牌 Logo
+    "watermark_enabled": False,          # 是否叠加水印
+    "watermark_logo": "",                # 水印 Logo 文件路径 (PNG/SVG 等，可为空)
+    "watermark_text": "",                # 水印文字 (可为空)
+    "watermark_position": "右下",        # 水印位置 ("右下", "左下", "右上", "左上", "居中")
+    "watermark_scale_pct": 15,           # 水印宽度 (占画布宽度百分比)
+    "watermark_opacity": 60,             # 水印不透明度 (0-100)
+    "watermark_margin_pct": 3,           # 水印与画布边缘的距离 (占画布短边百分比)
+    "watermark_text_color": "白色",      # 水印文字颜色 ("白色" 或 "黑色")
+}
+
+# -------- 画面比例预设 --------
+# 标签 -> 比例值 (None 表示原图比例)；参数页的比例选择与多比例导出共用
+RATIO_PRESETS = {
+    "原图比例": None,
+    "9:16 竖屏": (9, 16),
+    "4:5 竖屏": (4, 5),
+    "3:4 竖屏": (3, 4),
+    "16:9 横屏": (16, 9),
+    # 可以根据需要添加更多比例选项
+}
+
+# -------- 输出尺寸上限预设 --------
+# 标签 -> 画布长边上限 (像素)，0 表示按原图分辨率输出
+MAX_EDGE_PRESETS = {
+    "原始分辨率": 0,
+    "长边 1920 (1080P 竖屏)": 1920,
+    "长边 2560": 2560,
+    "长边 1440": 1440,
+    "长边 1080": 1080,
 }
 
 def initialize_state():
@@ -80,7 +123,7 @@ def _reset(keys_to_reset):
     """
     重置 Session State 中指定的参数。
     将 `keys_to_reset` 列表中的每个键的值恢复为其在 DEFAULTS 中定义的默认值。
-    重置后调用 st.rerun() 强制刷新界面。
+    重置后重跑参数/预览区域 (局部重跑，不支持时整页重跑) 以刷新界面。
 
     Args:
         keys_to_reset (list): 需要重置的参数键名列表。
@@ -88,7 +131,19 @@ def _reset(keys_to_reset):
     for k in keys_to_reset:
         if k in DEFAULTS:
             st.session_state[k] = DEFAULTS[k]
-    st.rerun() # 强制页面重新运行以应用默认值
+    rerun(scope="fragment") # 重新运行参数/预览区域以应用默认值
+
+def _save_watermark_logo(uploaded):
+    """把上传的 Logo 按内容哈希保存到 WATERMARK_DIR，返回文件路径 (同一文件只保存一次)。"""
+    data = uploaded.getvalue()
+    ext = os.path.splitext(uploaded.name)[1].lower() or ".png"
+    path = os.path.join(WATERMARK_DIR, hashlib.blake2b(data, digest_size=12).hexdigest() + ext)
+    if not os.path.exists(path):
+        os.makedirs(WATERMARK_DIR, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+    return path
+
 
 def show_parameter_controls():
     """
@@ -108,12 +163,7 @@ def show_parameter_controls():
 
     # --- 输出画面比例 ---
     # 定义可选的画面比例及其对应的标签
-    ratio_map = {
-        "原图比例": None,
-        "9:16 竖屏": (9, 16),
-        "4:5 竖屏": (4, 5),
-        # 可以根据需要添加更多比例选项
-    }
+    ratio_map = RATIO_PRESETS
     current_ratio = st.session_state.ratio # 获取当前状态中的比例值
     ratio_values = list(ratio_map.values()) # 获取所有比例值列表
     try:
@@ -135,10 +185,23 @@ def show_parameter_controls():
     # 当用户选择新的比例时，直接更新 session_state 中的 'ratio' 值
     st.session_state.ratio = ratio_map[ratio_label]
 
+    # --- 输出尺寸上限 ---
+    edge_values = list(MAX_EDGE_PRESETS.values())
+    if st.session_state.output_max_edge not in edge_values:
+        st.session_state.output_max_edge = DEFAULTS["output_max_edge"]
+    edge_label = st.selectbox(
+        "输出尺寸上限",
+        options=list(MAX_EDGE_PRESETS.keys()),
+        index=edge_values.index(st.session_state.output_max_edge),
+        key="max_edge_selector",
+        help="平台会重新压缩超过约 1080×1920 的图片。设置上限后先把原图缩小到输出分辨率再渲染，导出快得多。"
+    )
+    st.session_state.output_max_edge = MAX_EDGE_PRESETS[edge_label]
+
     # --- 参数选项卡 ---
     # 使用 Tabs 将参数设置分组
-    tab_bg, tab_shadow, tab_fg, tab_margin, tab_offset = st.tabs(
-        ["背景设置", "阴影设置", "前景设置", "边距设置", "偏移设置"]
+    tab_bg, tab_shadow, tab_fg, tab_margin, tab_offset, tab_banner, tab_mark = st.tabs(
+        ["背景设置", "阴影设置", "前景设置", "边距设置", "偏移设置", "参数信息", "水印"]
     )
 
     # -------- 背景设置 (Background Tab) --------
@@ -148,6 +211,7 @@ def show_parameter_controls():
             _reset([
                 "background_enabled",
                 "background_scale",      # 即使滑块注释了，也重置其状态值
+                "background_mode",
                 "background_blur",
                 "background_mask",
                 "background_mask_opacity"
@@ -165,12 +229,25 @@ def show_parameter_controls():
         # )
         # st.caption("背景内容缩放滑块已根据要求注释掉。将始终使用默认值 1.0。") # 添加说明
 
-        # 背景模糊半径滑块
+        # 背景模式：毛玻璃模糊，或几乎零成本的主色/渐变背景 (适合大批量处理)
+        bg_mode_options = ["毛玻璃模糊", "主色纯色", "双色渐变", "四角渐变", "色调低清模糊"]
+        if st.session_state.background_mode not in bg_mode_options:
+            st.session_state.background_mode = DEFAULTS["background_mode"]
+        st.selectbox(
+            "背景模式",
+            options=bg_mode_options,
+            key="background_mode",
+            help="毛玻璃模糊使用整幅照片模糊；其余模式从照片提取主色生成纯色、渐变或低清着色背景，批量处理快得多。"
+        )
+
+        # 背景模糊半径滑块：纯色/渐变模式不使用，但仍然显示 (禁用)，
+        # 控件不渲染时 Streamlit 会丢弃其状态，切换回来时半径会被重置为默认值
         st.slider(
             "背景模糊半径",
             min_value=0, max_value=100,
             key="background_blur",
-            help="调整背景层的高斯模糊强度，0 表示不模糊。"
+            disabled=st.session_state.background_mode not in ("毛玻璃模糊", "色调低清模糊"),
+            help="调整背景层的高斯模糊强度，0 表示不模糊。纯色/渐变模式不使用此项。"
         )
 
         # 背景蒙版类型单选按钮
@@ -204,12 +281,21 @@ def show_parameter_controls():
         # 阴影部分重置按钮
         if st.button("恢复阴影默认", key="rst_shadow"):
              _reset([
-                 "shadow_enabled", "shadow_spread", "shadow_blur", "shadow_opacity",
+                 "shadow_enabled", "shadow_shape", "shadow_spread", "shadow_blur", "shadow_opacity",
                  "shadow_offset_x", "shadow_offset_y", "shadow_unit",
                  "shadow_spread_pct", "shadow_blur_pct", "shadow_offset_x_pct", "shadow_offset_y_pct"
              ])
         # 启用/禁用阴影复选框
         st.checkbox("启用阴影效果", key="shadow_enabled", help="是否为前景图像添加阴影。")
+        if st.session_state.shadow_shape not in shadow.SHADOW_SHAPES:
+             st.session_state.shadow_shape = DEFAULTS["shadow_shape"]
+        st.radio(
+             "阴影形状",
+             options=list(shadow.SHADOW_SHAPES),
+             key="shadow_shape",
+             horizontal=True,
+             help="矩形: 按图片外框 (含圆角) 生成阴影。透明轮廓: 带透明度的图片 (抠图 PNG) 按主体轮廓生成阴影，不透明的图片仍为矩形。"
+        )
 
         # 阴影参数单位选择 (像素 vs 百分比)
         shadow_unit_options = ["像素(px)", "百分比(%)"]
@@ -353,6 +439,47 @@ def show_parameter_controls():
             help="勾选后，阴影会和前景图像一起移动相同的偏移量。"
         )
 
+    # -------- 参数信息条 (Banner Tab) --------
+    with tab_banner:
+        if st.button("恢复信息条默认", key="rst_banner"):
+             _reset(["banner_enabled", "banner_height_pct", "banner_text_color", "banner_logo"])
+        st.checkbox(
+            "显示相机/镜头参数",
+            key="banner_enabled",
+            help="在前景下方显示机型、镜头、焦距、光圈、快门和 ISO（读取自图片 EXIF）。"
+        )
+        if st.session_state.banner_enabled:
+             st.slider("信息条高度(%)", 2, 30, key="banner_height_pct", help="信息条高度占画布高度的百分比。")
+             banner_color_options = ["白色", "黑色"]
+             if st.session_state.banner_text_color not in banner_color_options:
+                 st.session_state.banner_text_color = DEFAULTS["banner_text_color"]
+             st.radio("文字颜色", options=banner_color_options, key="banner_text_color", horizontal=True)
+             st.checkbox("显示品牌 Logo", key="banner_logo")
+
+    # -------- 水印 (Watermark Tab) --------
+    with tab_mark:
+        if st.button("恢复水印默认", key="rst_mark"):
+             _reset([k for k in DEFAULTS if k.startswith("watermark_")])
+        st.checkbox("叠加水印", key="watermark_enabled", help="在每张输出上叠加工作室 Logo 和/或文字。")
+        if st.session_state.watermark_enabled:
+             logo_file = st.file_uploader("Logo (PNG/SVG)", type=["png", "svg", "webp", "jpg", "jpeg"],
+                                          key="watermark_upload")
+             if logo_file is not None:
+                 st.session_state.watermark_logo = _save_watermark_logo(logo_file)
+             if st.session_state.watermark_logo:
+                 st.caption(f"当前 Logo: {os.path.basename(st.session_state.watermark_logo)}")
+             st.text_input("水印文字", key="watermark_text")
+             if st.session_state.watermark_position not in watermark.POSITIONS:
+                 st.session_state.watermark_position = DEFAULTS["watermark_position"]
+             st.selectbox("位置", watermark.POSITIONS, key="watermark_position")
+             st.slider("水印宽度(%)", 2, 60, key="watermark_scale_pct", help="水印整体宽度占画布宽度的百分比。")
+             st.slider("不透明度(%)", 0, 100, key="watermark_opacity")
+             st.slider("边缘距离(%)", 0, 20, key="watermark_margin_pct", help="水印与画布边缘的距离（占画布短边百分比）。")
+             mark_color_options = ["白色", "黑色"]
+             if st.session_state.watermark_text_color not in mark_color_options:
+                 st.session_state.watermark_text_color = DEFAULTS["watermark_text_color"]
+             st.radio("文字颜色", options=mark_color_options, key="watermark_text_color", horizontal=True)
+
     # --- 构建并返回最终的参数字典 ---
     params = {}
     # 从 session_state 中读取所有在 DEFAULTS 中定义的参数值
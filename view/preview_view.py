@@ -8,42 +8,8 @@ from view.param_view import DEFAULTS as default_params # 导入默认值以防
 _canvas_size = processing_controller._canvas_size
 
 # ----- 将所有像素参数按 scale 同步缩放 -----
-def _scaled_params(p: dict, scale: float):
-    """为预览创建参数副本，并将像素单位参数按 scale 缩放。"""
-    p2 = p.copy()
-    # 缩放边距参数（仅当单位为像素）
-    if p2.get("margin_unit", "像素(px)") == "像素(px)":
-        use_independent = p2.get("ind_margin", False)
-        if use_independent:
-             for m in ["margin_top", "margin_bottom", "margin_left", "margin_right"]:
-                 p2[m] = int(p2.get(m, 0) * scale)
-        else:
-             p2["margin_all"] = int(p2.get("margin_all", 0) * scale)
-             # 同步更新独立值，以便 _canvas_size 能正确计算
-             p2["margin_top"] = p2["margin_bottom"] = p2["margin_left"] = p2["margin_right"] = p2["margin_all"]
-
-    # 缩放阴影参数（仅当单位为像素）
-    if p2.get("shadow_unit", "像素(px)") == "像素(px)":
-        for s in ["shadow_spread", "shadow_blur", "shadow_offset_x", "shadow_offset_y"]:
-            # 偏移量可为负，其他非负
-            val = p2.get(s, 0)
-            scaled_val = int(val * scale)
-            if "offset" not in s:
-                 scaled_val = max(0, scaled_val)
-            p2[s] = scaled_val
-
-    # 缩放背景模糊半径
-    p2["background_blur"] = max(0, int(p2.get("background_blur", 0) * scale))
-
-    # 缩放前景偏移量（仅当单位为像素）
-    if p2.get("offset_unit", "像素(px)") == "像素(px)":
-        p2["offset_x_val"] = int(p2.get("offset_x_val", 0) * scale)
-        p2["offset_y_val"] = int(p2.get("offset_y_val", 0) * scale)
-
-    # --- 重要的：不缩放百分比值或比例值 ---
-    # background_scale, corner_radius_pct, shadow_opacity, background_mask_opacity 等保持不变
-
-    return p2
+# 与输出尺寸上限共用 processing_controller 中的实现
+_scaled_params = processing_controller.scale_params
 
 def show_preview():
     """显示图片预览区域及控制"""
@@ -109,7 +75,9 @@ def show_preview():
     # --- 渲染预览 ---
     try:
         # 调用处理函数生成预览图
-        preview_img = processing_controller.process_single_image(preview_base_img, p_scaled)
+        metas = st.session_state.get("metadata") or []
+        meta = metas[current_preview_index] if current_preview_index < len(metas) else None
+        preview_img = processing_controller.process_single_image(preview_base_img, p_scaled, meta)
 
         # 显示预览图 (使用 use_container_width)
         st.image(
@@ -0,0 +1,115 @@
+import io
+import streamlit as st
+from controller import sweep
+from model import palette
+from view.compat import fragment
+from view.output_view import _get_current_export_params
+from view.param_view import DEFAULTS
+
+# 各扫描参数的默认取值 (逗号分隔)
+SWEEP_DEFAULT_VALUES = {
+    "background_blur": "10, 20, 40, 60",
+    "background_mask": "无, 白色透明蒙版, 黑色透明蒙版",
+    "background_mask_opacity": "20, 40, 60",
+    "background_mode": ", ".join(palette.BACKGROUND_MODES),
+    "background_scale": "1.0, 1.2, 1.5",
+    "shadow_blur": "10, 30, 60",
+    "shadow_spread": "0, 16, 32",
+    "shadow_opacity": "0.3, 0.5, 0.72, 0.9",
+    "corner_radius_pct": "0, 3, 5, 10",
+}
+
+_NONE_AXIS = "(无)"
+
+
+def _parse_values(key, text):
+    """按该参数默认值的类型解析逗号分隔的取值，无法解析的项忽略。"""
+    default = DEFAULTS.get(key)
+    values = []
+    for part in text.replace("，", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if isinstance(default, int):
+                values.append(int(float(part)))
+            elif isinstance(default, float):
+                values.append(float(part))
+            else:
+                values.append(part)
+        except ValueError:
+            st.warning(f"忽略无法识别的取值: {part}")
+    return list(dict.fromkeys(values))
+
+
+def _axis_input(label, key, exclude=None):
+    """一个扫描轴：参数选择 + 取值输入。返回 (参数键, 取值列表) 或 None。"""
+    options = [_NONE_AXIS] + [k for k in sweep.SWEEP_AXES if k != exclude]
+    axis = st.selectbox(label, options, key=key,
+                        format_func=lambda k: sweep.SWEEP_AXES.get(k, k))
+    if axis == _NONE_AXIS:
+        return None
+    text = st.text_input(f"{sweep.SWEEP_AXES[axis]} 取值 (逗号分隔)",
+                         SWEEP_DEFAULT_VALUES.get(axis, ""), key=f"{key}_values_{axis}")
+    return axis, _parse_values(axis, text)
+
+
+@fragment
+def show_sweep_section():
+    """参数对比：当前预览图片按 1~2 个参数的取值网格渲染，输出对比图或分别导出。"""
+    if "images" not in st.session_state or not st.session_state["images"]:
+        return
+    with st.expander("参数对比 (同一张图渲染多组参数)"):
+        images = st.session_state["images"]
+        names = st.session_state["filenames"]
+        metas = st.session_state.get("metadata") or [None] * len(images)
+        idx = min(st.session_state.get("preview_index", 0), len(images) - 1)
+        st.caption(f"对比图片: {names[idx]}，其余参数取当前设置。")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            row_axis = _axis_input("行参数", "sweep_row")
+        with col2:
+            col_axis = _axis_input("列参数", "sweep_col", exclude=row_axis[0] if row_axis else None)
+        axes = [a for a in (row_axis, col_axis) if a and a[1]]
+        total = 1
+        for _, values in axes:
+            total *= len(values)
+
+        output = st.radio("输出方式", ["对比图", "分别导出 (ZIP)"], horizontal=True, key="sweep_output")
+        if output == "对比图":
+            quality = st.slider("对比图渲染质量 (%)", 10, 100, 50, key="sweep_quality")
+            cell = st.slider("每格尺寸 (px)", 200, 800, 360, step=40, key="sweep_cell")
+
+        if not axes:
+            st.info("请至少选择一个参数并填写取值。")
+            return
+        if total > sweep.MAX_VARIANTS:
+            st.warning(f"共 {total} 组，超过上限 {sweep.MAX_VARIANTS} 组，请减少取值。")
+            return
+        if not st.button(f"渲染 {total} 组参数", key="sweep_run"):
+            return
+
+        params = _get_current_export_params()
+        scale = quality / 100.0 if output == "对比图" else 1.0
+        with st.spinner("正在渲染..."):
+            try:
+                variants, stats = sweep.render_sweep(images[idx], params, axes, metas[idx], scale=scale)
+            except Exception as e:
+                st.error(f"参数对比渲染失败: {e}")
+                return
+        built = "，".join(f"{k} {b} 次" for k, (b, _) in stats.items())
+        st.caption(f"{total} 组参数，实际生成图层: {built}")
+
+        base = names[idx].rsplit(".", 1)[0]
+        if output == "对比图":
+            sheet = sweep.contact_sheet(variants, axes, cell=cell)
+            st.image(sheet, use_container_width=True)
+            buf = io.BytesIO()
+            sheet.save(buf, format="PNG")
+            st.download_button("下载对比图", buf.getvalue(), file_name=f"{base}_sweep.png",
+                               mime="image/png", key="sweep_dl_sheet")
+        else:
+            data = sweep.encode_sweep_zip(variants, names[idx])
+            st.download_button("下载 ZIP", data, file_name=f"{base}_sweep.zip",
+                               mime="application/zip", key="sweep_dl_zip")
@@ -1,34 +1,64 @@
 import streamlit as st
 from controller import image_controller
+from controller.image_store import ImageStore
+
+
+def _upload_signature(uploaded_files):
+    """上传文件列表的标识 (文件 id / 文件名 + 大小)，用于判断上传内容是否变化。"""
+    return tuple((getattr(f, "file_id", None) or f.name, f.size) for f in uploaded_files)
+
+
+def _load_uploads(uploaded_files):
+    """读取上传文件：原图放入 ImageStore，并行生成缩略图和编码字节，结果写入会话状态。"""
+    # 原图放入本会话的 ImageStore，超出内存预算时写出到映射文件
+    old_store = st.session_state.get("images")
+    if isinstance(old_store, ImageStore):
+        old_store.close()
+    images, filenames, errors = image_controller.load_images(uploaded_files, store=ImageStore())
+    loaded_files = [f for f in uploaded_files if f.name not in errors]
+    # 缩略图直接由文件字节缩小解码生成，并缓存编码后的字节供网格展示
+    thumbs, thumb_bytes = image_controller.create_thumbnails_from_files(loaded_files, max_size=300)
+    st.session_state["images"] = images
+    st.session_state["filenames"] = filenames
+    st.session_state["thumbs"] = thumbs
+    st.session_state["thumb_bytes"] = thumb_bytes
+    st.session_state["upload_errors"] = errors
+    # 上传的原始文件 (与 images 一一对应)，导出任务把原始字节写入任务目录以便断点续传
+    st.session_state["source_files"] = loaded_files
+    # 读取相机/镜头元数据，供参数信息条使用
+    st.session_state["metadata"] = image_controller.load_metadata(loaded_files)
+    st.session_state["upload_signature"] = _upload_signature(uploaded_files)
+
 
 def show_upload_section():
     """
     显示文件上传区域，处理用户上传的图片，并在界面上显示缩略图列表。
     设置 st.session_state 包含上传的图片和缩略图。
+    上传内容未变化时 (例如调整参数引起的 rerun) 不重新读取，直接使用缓存的缩略图字节。
     """
     st.header("批量图片上传")
     uploaded_files = st.file_uploader("拖拽或点击上传图片文件", accept_multiple_files=True, type=["png", "jpg", "jpeg"])
     if uploaded_files:
-        # 调用控制器加载图片
-        images, filenames, errors = image_controller.load_images(uploaded_files)
+        if st.session_state.get("upload_signature") != _upload_signature(uploaded_files):
+            _load_uploads(uploaded_files)
+        errors = st.session_state.get("upload_errors") or []
         if errors:
             # 显示错误提示
             st.error("以下文件不是有效的图像或无法打开: " + ", ".join(errors))
+        images = st.session_state["images"]
         if images:
-            # 生成缩略图列表用于预览
-            thumbs = image_controller.create_thumbnails(images, max_size=300)
-            # 将结果存入会话状态
-            st.session_state["images"] = images
-            st.session_state["filenames"] = filenames
-            st.session_state["thumbs"] = thumbs
+            filenames = st.session_state["filenames"]
+            thumb_bytes = st.session_state["thumb_bytes"]
             # 显示上传成功的缩略图预览
             st.subheader("已上传图片预览")
             cols = st.columns(4)
-            for idx, thumb in enumerate(thumbs):
+            for idx, data in enumerate(thumb_bytes):
+                if data is None:
+                    continue
                 col = cols[idx % 4]
-                # 在网格中显示缩略图和文件名
+                # 在网格中显示缩略图和文件名 (已编码的字节，无需再次编码)
                 with col:
-                    st.image(thumb, caption=filenames[idx], use_column_width=True)
+                    st.image(data, caption=filenames[idx], use_column_width=True)
     else:
         # 如果尚未上传文件，给出提示
         st.info("请上传一张或多张图片。支持PNG、JPG格式。")